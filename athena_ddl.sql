@@ -23,7 +23,8 @@ CREATE EXTERNAL TABLE nyc_taxi (
     quarter                       TINYINT,
     month                         TINYINT,
     date                             DATE,
-    day_of_week                   TINYINT
+    day_of_week                   TINYINT,
+    hour_of_day                   TINYINT
 )
 STORED AS PARQUET
 LOCATION 's3://your-location/'
@@ -0,0 +1,136 @@
+import io
+import zipfile
+from typing import Iterator, List, Dict, Optional, Union, BinaryIO, Callable
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+# types that appear in 'dtype' of csv_params translated to Arrow,
+# integers are parsed as floats first because some files write them as '1.0' (pandas accepts that too)
+arrow_types: Dict[str, pa.DataType] = {
+    'object': pa.string(),
+    'Int16': pa.float64(),
+    'float32': pa.float32(),
+}
+# types that columns are cast to after parsing (the cast fails on fractional values just like pandas does)
+_integer_types: Dict[str, pa.DataType] = {'Int16': pa.int16()}
+# only columns declared as Int16 become int16 in Arrow, convert them back to pandas nullable type
+_pandas_types = {pa.int16(): pd.Int16Dtype()}
+
+
+def arrow_csv_chunks(filepath: Union[str, BinaryIO], chunksize: Union[int, Callable[[], int]] = 1000000,
+                     **kwargs) -> Iterator[pd.DataFrame]:
+    """Reads CSV file with pyarrow's streaming reader (parsing is multithreaded) and yields DataFrames
+    with the same columns and types as pd.read_csv with the same csv_params would.
+
+    Unlike pandas reader this one fails on timestamps in unexpected format and on rows with wrong number of fields.
+    Other read_csv arguments (eg. infer_datetime_format) are ignored.
+    Chunksize can be a function, it's called before every chunk to get its number of rows.
+    """
+
+    for table in arrow_csv_tables(filepath, chunksize, **kwargs):
+        yield csv_table_to_pandas(table)
+
+
+def csv_table_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """DataFrame with the same columns and types as pd.read_csv gives for a table from arrow_csv_tables."""
+
+    return table.to_pandas(types_mapper=_pandas_types.get)
+
+
+def arrow_csv_tables(filepath: Union[str, BinaryIO], chunksize: Union[int, Callable[[], int]] = 1000000,
+                     usecols: Optional[List[str]] = None, dtype: Optional[Dict[str, str]] = None,
+                     parse_dates: Optional[List[str]] = None, names: Optional[List[str]] = None,
+                     header: Union[int, str] = 'infer', skipinitialspace: bool = False,
+                     block_size: int = 16 * 1024 * 1024, **kwargs) -> Iterator[pa.Table]:
+    """Same as arrow_csv_chunks but yields Arrow tables (columns declared as Int16 are int16, strings are strings)."""
+
+    header_names = names if names is not None else _read_header(filepath, skipinitialspace)
+    # pandas keeps order of columns from file no matter what's the order of usecols
+    columns = [name for name in header_names if usecols is None or name in usecols]
+    column_types = {name: arrow_types[str(type_name)] for name, type_name in (dtype or {}).items()}
+    integer_columns = {name: _integer_types[str(type_name)] for name, type_name in (dtype or {}).items()
+                       if str(type_name) in _integer_types}
+    for name in parse_dates or []:
+        column_types[name] = pa.timestamp('ns')
+
+    read_options = pv.ReadOptions(
+        block_size=block_size,
+        column_names=header_names,
+        skip_rows=1 if names is None or header == 0 else 0)
+    convert_options = pv.ConvertOptions(
+        include_columns=columns,
+        column_types=column_types,
+        strings_can_be_null=True)
+
+    with _open_source(filepath) as source:
+        reader = pv.open_csv(source, read_options=read_options, convert_options=convert_options)
+        buffered: List[pa.RecordBatch] = []
+        buffered_rows = 0
+        rows = chunksize() if callable(chunksize) else chunksize
+        for batch in reader:
+            buffered.append(batch)
+            buffered_rows += batch.num_rows
+            # batches have fixed size in bytes, chunks should have fixed number of rows
+            while buffered_rows >= rows:
+                table = pa.Table.from_batches(buffered)
+                yield _prepare_table(table.slice(0, rows), columns, integer_columns, skipinitialspace)
+                rest = table.slice(rows)
+                buffered = rest.to_batches()
+                buffered_rows = rest.num_rows
+                rows = chunksize() if callable(chunksize) else chunksize
+        if buffered_rows > 0:
+            yield _prepare_table(pa.Table.from_batches(buffered), columns, integer_columns, skipinitialspace)
+
+
+def _prepare_table(table: pa.Table, columns: List[str], integer_columns: Dict[str, pa.DataType],
+                   skipinitialspace: bool) -> pa.Table:
+    table = table.select(columns)
+    for name, data_type in integer_columns.items():
+        if name in columns:
+            i = table.schema.get_field_index(name)
+            table = table.set_column(i, name, table.column(i).cast(data_type))
+    if skipinitialspace:
+        for i, field in enumerate(table.schema):
+            if pa.types.is_string(field.type):
+                table = table.set_column(i, field, pc.utf8_ltrim_whitespace(table.column(i)))
+    return table
+
+
+def _open_source(filepath: Union[str, BinaryIO]) -> BinaryIO:
+    """Opens file for reading, decompressing it if needed (zip archives with single file, gzip, bz2).
+    File objects (eg. part of the file already in memory) are read as they are."""
+
+    if not isinstance(filepath, str):
+        return pa.PythonFile(filepath, mode='r')
+    if filepath.lower().endswith('.zip'):
+        archive = zipfile.ZipFile(filepath)
+        return _ZipMemberStream(archive, archive.open(archive.namelist()[0]))
+    return pa.input_stream(filepath, compression='detect')
+
+
+def _read_header(filepath: str, skipinitialspace: bool) -> List[str]:
+    data = b''
+    with _open_source(filepath) as source:
+        while b'\n' not in data:
+            block = source.read(64 * 1024)
+            if not block:
+                break
+            data += block
+    names = data.split(b'\n', 1)[0].decode('utf-8').rstrip('\r').split(',')
+    return [name.lstrip() for name in names] if skipinitialspace else names
+
+
+class _ZipMemberStream(io.BufferedReader):
+    """File inside zip archive that closes the archive too when closed."""
+
+    def __init__(self, archive: zipfile.ZipFile, member: BinaryIO):
+        super().__init__(member, buffer_size=io.DEFAULT_BUFFER_SIZE)
+        self._archive = archive
+
+    def close(self) -> None:
+        super().close()
+        self._archive.close()
+
@@ -0,0 +1,325 @@
+import functools
+import logging
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from data_cleaning import column_mapping_function, rules_for_location, coordinate_columns, first_valid_year, \
+    last_valid_year, payment_type_dtype, trip_type_dtype, year_quarter_dtype, year_month_dtype, \
+    store_and_fwd_flag_mapping_function, payment_type_mapping_function, trip_type_mapping_function, \
+    count_rejected_rows
+from helper_objects import ParameterType, DropStats, timer
+from zone_index import locate_points
+from zone_registry import get_zone_registry
+
+# Arrow implementation of process_taxi_data (engine='arrow'). Every stage has the same name and gives the same values
+# as its pandas counterpart in data_cleaning, labels are dictionaries with the categories of the pandas categoricals.
+# Processed tables are written to Parquet as they are, to_pandas converts them to DataFrames with the same dtypes
+# as the pandas engine gives (numeric columns and dictionaries convert without copying the values).
+
+ArrowStageType = Callable[[pa.Table], Any]
+
+
+@timer(logging.DEBUG)
+def rename_columns(table: pa.Table) -> pa.Table:
+    return table.rename_columns([column_mapping_function(name) for name in table.column_names])
+
+
+def add_location_data(table: pa.Table, join_by: str) -> pa.Table:
+    if join_by == 'id':
+        return _join_location_data_by_id(table)
+    elif join_by == 'coordinates':
+        return _join_location_data_by_coordinates(table)
+    return table
+
+
+@timer(logging.DEBUG)
+def _join_location_data_by_id(table: pa.Table) -> pa.Table:
+    zone_attributes = get_zone_registry().zone_attributes
+    for prefix in ('pickup', 'dropoff'):
+        location_ids = _float_values(table.column(f'{prefix}_location_id'))
+        table = _set_column(table, f'{prefix}_borough', pa.array(zone_attributes.boroughs(location_ids)))
+        table = _set_column(table, f'{prefix}_zone', pa.array(zone_attributes.zones(location_ids)))
+    return table
+
+
+@timer(logging.DEBUG)
+def _join_location_data_by_coordinates(table: pa.Table) -> pa.Table:
+    registry = get_zone_registry()
+    zone_location_ids = registry.zones_gdf['LocationID'].values
+    for prefix in ('pickup', 'dropoff'):
+        points, zones = locate_points(
+            registry.zones_gdf, registry.zone_index,
+            x=_float_values(table.column(f'{prefix}_longitude')),
+            y=_float_values(table.column(f'{prefix}_latitude')))
+        if len(points) != table.num_rows:
+            # some points are in area where zones overlap, row is repeated for every zone (like with sjoin)
+            table = table.take(points)
+        location_ids = np.where(zones >= 0, zone_location_ids[zones], np.nan)
+        table = _set_column(table, f'{prefix}_borough', pa.array(registry.zone_attributes.boroughs(location_ids)))
+        table = _set_column(table, f'{prefix}_zone', pa.array(registry.zone_attributes.zones(location_ids)))
+        table = _set_column(table, f'{prefix}_location_id', pa.array(location_ids, from_pandas=True))
+    return table
+
+
+_nanoseconds_in_second = 10 ** 9
+_nanoseconds_in_day = 24 * 3600 * _nanoseconds_in_second
+
+
+@timer(logging.DEBUG)
+def add_trip_duration(table: pa.Table) -> pa.Table:
+    """Like pandas' Timedelta.seconds: seconds part of the duration without whole days (days are floored,
+    so negative durations give seconds counted from the previous midnight), in minutes."""
+
+    duration = pc.cast(pc.subtract(table.column('dropoff_datetime'), table.column('pickup_datetime')), pa.int64())
+    # integer division truncates, negative remainders are moved to the previous day
+    remainder = pc.subtract(duration, pc.multiply(pc.divide(duration, _nanoseconds_in_day), _nanoseconds_in_day))
+    remainder = pc.if_else(pc.less(remainder, 0), pc.add(remainder, _nanoseconds_in_day), remainder)
+    seconds = pc.divide(remainder, _nanoseconds_in_second)
+    minutes = pc.divide(pc.cast(seconds, pa.float64()), 60.0)
+    return _set_column(table, 'trip_duration_minutes', pc.cast(minutes, pa.float32()))
+
+
+def has_valid_coordinates(table: pa.Table) -> pa.ChunkedArray:
+    masks = [pc.fill_null(pc.not_equal(table.column(name), 0), False) for name in coordinate_columns]
+    return functools.reduce(pc.and_, masks)
+
+
+def has_location_ids(table: pa.Table) -> pa.ChunkedArray:
+    return pc.and_(pc.is_valid(table.column('pickup_location_id')), pc.is_valid(table.column('dropoff_location_id')))
+
+
+def has_valid_timestamps(table: pa.Table) -> pa.ChunkedArray:
+    return pc.fill_null(pc.less(table.column('pickup_datetime'), table.column('dropoff_datetime')), False)
+
+
+def has_no_negative_values(table: pa.Table) -> pa.ChunkedArray:
+    masks = [pc.greater_equal(pc.fill_null(table.column(name), 0), 0)
+             for name in ('trip_distance', 'total_amount', 'passenger_count')]
+    return functools.reduce(pc.and_, masks)
+
+
+def has_valid_passenger_count(table: pa.Table) -> pa.ChunkedArray:
+    passenger_count = pc.fill_null(table.column('passenger_count'), 0)
+    return pc.and_(pc.greater_equal(passenger_count, 0), pc.less_equal(passenger_count, 20))
+
+
+def has_valid_trip_duration(table: pa.Table) -> pa.ChunkedArray:
+    return pc.fill_null(pc.less_equal(table.column('trip_duration_minutes'), 90), False)
+
+
+def has_valid_year(table: pa.Table) -> pa.ChunkedArray:
+    year = pc.year(table.column('pickup_datetime'))
+    return pc.fill_null(pc.and_(pc.greater_equal(year, first_valid_year), pc.less_equal(year, last_valid_year)), False)
+
+
+# counterparts of data_cleaning.row_rules (by name), every rule there needs one here
+row_predicates: Dict[str, Callable[[pa.Table], pa.ChunkedArray]] = {
+    'invalid_coordinates': has_valid_coordinates,
+    'missing_location_ids': has_location_ids,
+    'invalid_timestamps': has_valid_timestamps,
+    'negative_values': has_no_negative_values,
+    'invalid_passenger_count_values': has_valid_passenger_count,
+    'invalid_trip_durations': has_valid_trip_duration,
+    'invalid_year_values': has_valid_year,
+}
+
+
+@timer(logging.DEBUG)
+def filter_rows(table: pa.Table, location: str, drop_stats: Optional[DropStats] = None) -> pa.Table:
+    """Removes rows that don't pass all of the rules for the location and coordinate columns,
+    counts rejected rows like data_cleaning.filter_rows."""
+
+    masks = {rule.name: _bool_values(row_predicates[rule.name](table)) for rule in rules_for_location(location)}
+    keep = np.logical_and.reduce(list(masks.values())) if masks else np.ones(table.num_rows, dtype=bool)
+    if drop_stats is not None:
+        count_rejected_rows(masks, drop_stats)
+    table = table.drop([name for name in coordinate_columns if name in table.column_names])
+    return table.filter(pa.array(keep))
+
+
+def convert_location_id_types(table: pa.Table) -> pa.Table:
+    for name in ('pickup_location_id', 'dropoff_location_id'):
+        table = _set_column(table, name, pc.cast(table.column(name), pa.int16()))
+    return table
+
+
+def convert_passenger_count_type(table: pa.Table) -> pa.Table:
+    return _set_column(table, 'passenger_count', pc.cast(table.column('passenger_count'), pa.int8()))
+
+
+@timer(logging.DEBUG)
+def standardize_snf_flag_values(table: pa.Table) -> pa.Table:
+    # flags are 0 and 1 so their codes are the values
+    flags = _mapped_codes(table.column('store_and_forward'), store_and_fwd_flag_mapping_function, [0, 1], pa.int16())
+    return _set_column(table, 'store_and_forward', flags)
+
+
+@timer(logging.DEBUG)
+def standardize_payment_type_values(table: pa.Table) -> pa.Table:
+    payment_types = _map_distinct_values(table.column('payment_type'), payment_type_mapping_function,
+                                         list(payment_type_dtype.categories))
+    return _set_column(table, 'payment_type', payment_types)
+
+
+@timer(logging.DEBUG)
+def replace_tip_values_for_cash_payments(table: pa.Table) -> pa.Table:
+    cash_code = list(payment_type_dtype.categories).index('cash')
+    is_cash = pc.fill_null(pc.equal(_dictionary_indices(table.column('payment_type')), cash_code), False)
+    tips = table.column('tip_amount')
+    return _set_column(table, 'tip_amount', pc.if_else(is_cash, pa.scalar(None, tips.type), tips))
+
+
+@timer(logging.DEBUG)
+def add_year(table: pa.Table) -> pa.Table:
+    return _set_column(table, 'year', pc.cast(pc.year(table.column('pickup_datetime')), pa.int16()))
+
+
+@timer(logging.DEBUG)
+def add_additional_date_features(table: pa.Table) -> pa.Table:
+    pickup = table.column('pickup_datetime')
+    year = pc.year(pickup)
+    month = pc.month(pickup)
+    quarter = pc.quarter(pickup)
+    valid_year = pc.and_(pc.greater_equal(year, first_valid_year), pc.less_equal(year, last_valid_year))
+    years_since_first = pc.subtract(year, first_valid_year)
+
+    year_quarter_codes = pc.add(pc.multiply(years_since_first, 4), pc.subtract(quarter, 1))
+    year_month_codes = pc.add(pc.multiply(years_since_first, 12), pc.subtract(month, 1))
+    table = _set_column(table, 'year_quarter', _dictionary(pc.if_else(valid_year, year_quarter_codes, None),
+                                                           list(year_quarter_dtype.categories), pa.int16()))
+    table = _set_column(table, 'year_month', _dictionary(pc.if_else(valid_year, year_month_codes, None),
+                                                         list(year_month_dtype.categories), pa.int16()))
+    table = _set_column(table, 'quarter', pc.cast(quarter, pa.int8()))
+    table = _set_column(table, 'month', pc.cast(month, pa.int8()))
+    table = _set_column(table, 'date', pc.floor_temporal(pickup, unit='day'))  # midnight, written as date32
+    table = _set_column(table, 'day_of_week', pc.cast(pc.day_of_week(pickup, count_from_zero=False, week_start=1),
+                                                      pa.int8()))
+    return _set_column(table, 'hour_of_day', pc.cast(pc.hour(pickup), pa.int8()))
+
+
+@timer(logging.DEBUG)
+def standardize_trip_type_values(table: pa.Table) -> pa.Table:
+    categories = list(trip_type_dtype.categories)
+    if 'trip_type' not in table.column_names:
+        trip_types = _dictionary(pa.nulls(table.num_rows, pa.int8()), categories, pa.int8())
+    else:
+        trip_types = _map_distinct_values(table.column('trip_type'), trip_type_mapping_function, categories)
+    return _set_column(table, 'trip_type', trip_types)
+
+
+def add_company(table: pa.Table, company: str) -> pa.Table:
+    # dictionary with single value doesn't copy the string for every row
+    return _set_column(table, 'company', _dictionary(pa.array(np.zeros(table.num_rows, dtype=np.int8)), [company],
+                                                     pa.int8()))
+
+
+@timer(logging.DEBUG)
+def sort_table(table: pa.Table, sort_keys: List[str]) -> pa.Table:
+    """Sorts like data_cleaning.sort_df: labels by their categories (dictionary codes), nulls last, stable."""
+
+    keys = pa.table({key: _dictionary_indices(table.column(key)) if pa.types.is_dictionary(table.schema.field(key).type)
+                     else table.column(key) for key in sort_keys})
+    return table.take(pc.sort_indices(keys, sort_keys=[(key, 'ascending') for key in sort_keys]))
+
+
+# pandas engine gives nullable integer columns here and object column of company,
+# other columns convert to the same dtypes on their own
+_nullable_integer_columns = {'store_and_forward': pd.Int16Dtype(), 'passenger_count': pd.Int8Dtype()}
+
+
+@timer(logging.DEBUG)
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """Converts processed table to the DataFrame the pandas engine gives."""
+
+    data_frame = table.to_pandas()
+    for name, dtype in _nullable_integer_columns.items():
+        column = table.column(name)
+        data_frame[name] = pd.arrays.IntegerArray(
+            pc.fill_null(column, 0).to_numpy().astype(dtype.numpy_dtype, copy=False),
+            pc.is_null(column).to_numpy())
+    data_frame['company'] = np.asarray(data_frame['company'], dtype=object)
+    return data_frame
+
+
+def processing_stages(params: ParameterType, company: str, drop_stats: Optional[DropStats] = None,
+                      sort_keys: Optional[List[str]] = None) -> List[Tuple[str, ArrowStageType]]:
+    """Named steps of the Arrow engine, the same as data_processing.processing_stages."""
+
+    location = params['location']
+    stages = [
+        ('rename_columns', rename_columns),
+        ('add_location_data', functools.partial(add_location_data, join_by=location)),
+        ('add_trip_duration', add_trip_duration),
+        ('filter_rows', functools.partial(filter_rows, location=location, drop_stats=drop_stats)),
+        ('convert_location_id_types', convert_location_id_types),
+        ('convert_passenger_count_type', convert_passenger_count_type),
+        ('standardize_snf_flag_values', standardize_snf_flag_values),
+        ('standardize_payment_type_values', standardize_payment_type_values),
+        ('replace_tip_values_for_cash_payments', replace_tip_values_for_cash_payments),
+        ('add_year', add_year),
+        ('add_additional_date_features', add_additional_date_features),
+        ('standardize_trip_type_values', standardize_trip_type_values),
+        ('add_company', functools.partial(add_company, company=company)),
+    ]
+    if sort_keys:
+        stages.append(('sort_df', functools.partial(sort_table, sort_keys=sort_keys)))
+    return stages
+
+
+def _map_distinct_values(column: pa.ChunkedArray, mapping_function: Callable[[Any], Any],
+                         categories: List[Any]) -> pa.ChunkedArray:
+    """Arrow version of data_cleaning.map_distinct_values, results are dictionary arrays with given categories."""
+
+    codes = _mapped_codes(column, mapping_function, categories, pa.int8())
+    return pa.chunked_array([_dictionary(chunk, categories, pa.int8()) for chunk in codes.chunks],
+                            pa.dictionary(pa.int8(), pa.array(categories).type))
+
+
+def _mapped_codes(column: pa.ChunkedArray, mapping_function: Callable[[Any], Any], categories: List[Any],
+                  index_type: pa.DataType) -> pa.ChunkedArray:
+    """Positions in categories of what mapping function returns for every value (nulls for NA).
+    It's called only for distinct values of every chunk."""
+
+    if pa.types.is_integer(column.type) and column.null_count > 0:
+        # pandas reads integer columns with missing values as floats so mapping functions see eg. 1.0 instead of 1
+        column = pc.cast(column, pa.float64())
+    chunks = []
+    for chunk in column.chunks:
+        encoded = pc.dictionary_encode(chunk)
+        mapped = [mapping_function(value) for value in encoded.dictionary.to_pylist()]
+        codes = pa.array([categories.index(value) if value is not pd.NA else None for value in mapped], index_type)
+        chunks.append(pc.take(codes, encoded.indices))
+    return pa.chunked_array(chunks, index_type)
+
+
+def _dictionary(codes: Any, categories: List[Any], index_type: pa.DataType) -> pa.Array:
+    if isinstance(codes, pa.ChunkedArray):
+        codes = codes.combine_chunks()
+    return pa.DictionaryArray.from_arrays(pc.cast(codes, index_type), pa.array(categories))
+
+
+def _dictionary_indices(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    return pa.chunked_array([chunk.indices for chunk in column.chunks], column.type.index_type)
+
+
+def _float_values(column: pa.ChunkedArray) -> np.ndarray:
+    """Values as floats with NaN for nulls (what pandas engine passes to zone lookups)."""
+
+    return pc.cast(column, pa.float64()).to_numpy()
+
+
+def _bool_values(mask: Any) -> np.ndarray:
+    return np.asarray(pc.fill_null(mask, False).to_numpy(), dtype=bool)
+
+
+def _set_column(table: pa.Table, name: str, column: Any) -> pa.Table:
+    """Replaces column with given name or appends it at the end (like assigning DataFrame column)."""
+
+    i = table.schema.get_field_index(name)
+    if i < 0:
+        return table.append_column(name, column)
+    return table.set_column(i, name, column)
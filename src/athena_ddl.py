@@ -0,0 +1,69 @@
+import os
+from typing import List
+
+import pyarrow as pa
+
+from compact_schema import compact_arrow_schema
+from helper_objects import arrow_schema, partition_columns
+
+athena_types = {
+    pa.timestamp('ns'): 'TIMESTAMP',
+    pa.timestamp('s'): 'TIMESTAMP',
+    pa.int8(): 'TINYINT',
+    pa.int16(): 'SMALLINT',
+    pa.int32(): 'INT',
+    pa.float32(): 'FLOAT',
+    pa.float64(): 'DOUBLE',
+    pa.string(): 'VARCHAR',
+    pa.date32(): 'DATE',
+}
+
+ddl_folder_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def athena_ddl(table_name: str = 'nyc_taxi', location: str = 's3://your-location/', partitioned: bool = False,
+               schema: pa.Schema = arrow_schema) -> str:
+    """Returns CREATE TABLE statement for Parquet files written by csv2parquet.
+
+    With partitioned=True the table matches dataset written with csv2parquet(..., partitioned=True),
+    partition columns are taken from folder names instead of the files.
+    Schema=compact_arrow_schema gives table of files written with csv2parquet(..., compact=True).
+    """
+
+    columns = [field for field in schema if not partitioned or field.name not in partition_columns]
+    ddl = f'CREATE EXTERNAL TABLE {table_name} (\n{_column_definitions(columns)}\n)\n'
+    if partitioned:
+        partitions = [schema.field(name) for name in partition_columns]
+        ddl += f'PARTITIONED BY (\n{_column_definitions(partitions)}\n)\n'
+    ddl += (f'STORED AS PARQUET\n'
+            f'LOCATION \'{location}\'\n'
+            f'tblproperties ("parquet.compression"="SNAPPY");\n'
+            f'\n'
+            f'MSCK REPAIR TABLE {table_name};\n')
+    return ddl
+
+
+def _column_definitions(fields: List[pa.Field]) -> str:
+    # type names aligned to the right like in DataFrame.dtypes
+    return ',\n'.join(f'    {field.name}{_athena_type(field.type):>{37 - len(field.name)}}' for field in fields)
+
+
+def _athena_type(data_type: pa.DataType) -> str:
+    if pa.types.is_dictionary(data_type):
+        # dictionary encoding is how Parquet stores the strings, Athena reads them as any other
+        return athena_types[data_type.value_type]
+    elif pa.types.is_decimal(data_type):
+        return f'DECIMAL({data_type.precision},{data_type.scale})'
+    return athena_types[data_type]
+
+
+if __name__ == '__main__':
+    # regenerates DDL files in the repository root after changing arrow_schema
+    with open(os.path.join(ddl_folder_path, 'athena_ddl.sql'), 'w') as f:
+        f.write(athena_ddl())
+    with open(os.path.join(ddl_folder_path, 'athena_ddl_partitioned.sql'), 'w') as f:
+        f.write(athena_ddl('nyc_taxi_partitioned', partitioned=True))
+    with open(os.path.join(ddl_folder_path, 'athena_ddl_compact.sql'), 'w') as f:
+        f.write(athena_ddl('nyc_taxi_compact', schema=compact_arrow_schema))
+    with open(os.path.join(ddl_folder_path, 'athena_ddl_compact_partitioned.sql'), 'w') as f:
+        f.write(athena_ddl('nyc_taxi_compact_partitioned', partitioned=True, schema=compact_arrow_schema))
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from typing import Dict, List, Optional, Callable, Any
+
+import pandas as pd
+
+from data_export import csv2parquet
+from data_processing import process_taxi_data_file_chunks, get_taxi_params
+from metrics import FileMetrics, Measurement
+from synthetic_data import generate_taxi_files, eras, location_mix
+from zone_registry import get_zone_registry
+
+# relative change of rows/second or peak RSS (compared to baseline) that counts as regression
+default_tolerance = 0.15
+
+ResultsType = Dict[str, Any]
+
+
+def run_benchmarks(folder: Optional[str] = None, rows: int = 100000, seed: int = 0,
+                   selected_eras: Optional[List[str]] = None, repeat: int = 3, **kwargs) -> ResultsType:
+    """Generates synthetic file for every era (or the selected ones) and measures every stage of process_taxi_data
+    (plus reading CSV) and csv2parquet end to end on it.
+
+    Every measurement is repeated and the fastest run is kept (peak RSS is the highest seen in any run).
+    Taxi zones are loaded before the first measurement so it doesn't include that.
+    Results of files with coordinates hold shares of points in zone, boundary and outside cells of the raster index
+    (location_mix), only points in boundary cells go through the exact point in polygon test.
+    Files are generated in a temporary folder unless folder is given.
+    Other keyword arguments are passed to process_taxi_data_file (eg. csv_engine='arrow', engine='arrow').
+    """
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        folder = folder or temp_folder
+        paths = generate_taxi_files(folder, rows, seed, selected_eras)
+        output_folder = os.path.join(temp_folder, 'parquet')
+        os.makedirs(output_folder)
+        _load_zones(paths)
+        results = {'rows': rows, 'seed': seed, 'repeat': repeat, 'options': kwargs,
+                   'pandas': pd.__version__, 'eras': {}}
+        for era, path in zip(selected_eras or eras(), paths):
+            stages = _best_of(repeat, lambda: _measure_stages(path, **kwargs))
+            end_to_end = _best_of(repeat, lambda: {'csv2parquet': _measure(
+                lambda: csv2parquet([path], output_folder, force=True, **kwargs), rows)})
+            results['eras'][era] = {'stages': stages, **end_to_end, 'location_mix': location_mix(path)}
+    return results
+
+
+def _load_zones(paths: List[str]) -> None:
+    registry = get_zone_registry()
+    registry.zone_attributes
+    if any(get_taxi_params(os.path.basename(path).split('.')[0])[1]['location'] == 'coordinates' for path in paths):
+        registry.zone_index
+
+
+def _measure_stages(path: str, **kwargs) -> Dict[str, Dict[str, float]]:
+    metrics = FileMetrics(path)
+    for _ in process_taxi_data_file_chunks(path, metrics=metrics, **kwargs):
+        pass
+    return {name: {
+        'seconds': total['wall_seconds'],
+        'rows_in': total['rows_in'],
+        'rows_out': total['rows_out'],
+        'rows_per_second': total['rows_per_second'],
+        'peak_rss_mb': _mb(total['peak_rss_bytes']),
+    } for name, total in metrics.stage_summary().items()}
+
+
+def _measure(func: Callable[[], Any], rows: int) -> Dict[str, float]:
+    measurement = Measurement()
+    with measurement:
+        func()
+    return {
+        'seconds': measurement.wall_seconds,
+        'rows_in': rows,
+        'rows_per_second': rows / measurement.wall_seconds if measurement.wall_seconds else None,
+        'peak_rss_mb': _mb(measurement.peak_rss),
+    }
+
+
+def _mb(size: Optional[int]) -> Optional[float]:
+    return None if size is None else size / 2 ** 20
+
+
+def _best_of(repeat: int, func: Callable[[], Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+    best = func()
+    for _ in range(repeat - 1):
+        for name, measurement in func().items():
+            if measurement['seconds'] < best[name]['seconds']:
+                measurement['peak_rss_mb'] = _max(measurement['peak_rss_mb'], best[name]['peak_rss_mb'])
+                best[name] = measurement
+            else:
+                best[name]['peak_rss_mb'] = _max(measurement['peak_rss_mb'], best[name]['peak_rss_mb'])
+    return best
+
+
+def _max(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return b if a is None else a if b is None else max(a, b)
+
+
+def compare_to_baseline(results: ResultsType, baseline: ResultsType,
+                        tolerance: float = default_tolerance) -> List[str]:
+    """Returns descriptions of measurements that are worse than in baseline by more than tolerance
+    (rows/second lower or peak RSS higher). Eras and stages missing from either of the results are skipped."""
+
+    regressions = []
+    for era, current in results['eras'].items():
+        if era not in baseline['eras']:
+            continue
+        previous = baseline['eras'][era]
+        measurements = {**current['stages'], 'csv2parquet': current['csv2parquet']}
+        previous_measurements = {**previous['stages'], 'csv2parquet': previous['csv2parquet']}
+        for name, measurement in measurements.items():
+            if name not in previous_measurements:
+                continue
+            before = previous_measurements[name]
+            if measurement['rows_per_second'] and before['rows_per_second'] \
+                    and measurement['rows_per_second'] < before['rows_per_second'] * (1 - tolerance):
+                regressions.append(f'{era} {name}: {measurement["rows_per_second"]:_.0f} rows/s, '
+                                   f'baseline {before["rows_per_second"]:_.0f} rows/s')
+            if measurement['peak_rss_mb'] and before['peak_rss_mb'] \
+                    and measurement['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+                regressions.append(f'{era} {name}: peak RSS {measurement["peak_rss_mb"]:.0f} MiB, '
+                                   f'baseline {before["peak_rss_mb"]:.0f} MiB')
+    return regressions
+
+
+def format_results(results: ResultsType) -> str:
+    lines = []
+    for era, measurements in results['eras'].items():
+        lines.append(f'{era}')
+        mix = measurements.get('location_mix')
+        if mix is not None:
+            lines.append(f'\tpoints in zone cells {mix["zone"]:.1%}, boundary cells {mix["boundary"]:.1%}, '
+                         f'outside {mix["outside"]:.1%}')
+        for name, measurement in {**measurements['stages'], 'csv2parquet': measurements['csv2parquet']}.items():
+            rows_per_second = measurement['rows_per_second']
+            peak_rss_mb = measurement['peak_rss_mb']
+            lines.append(f'\t{name:<40}{measurement["seconds"]:>10.4f} s'
+                         f'{rows_per_second if rows_per_second is not None else float("nan"):>16_.0f} rows/s'
+                         f'{peak_rss_mb if peak_rss_mb is not None else float("nan"):>10.0f} MiB')
+    return '\n'.join(lines) + '\n'
+
+
+def save_results(results: ResultsType, filepath: str) -> None:
+    with open(filepath, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(filepath: str) -> ResultsType:
+    with open(filepath) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks processing of synthetic files of every schema era.')
+    parser.add_argument('--rows', type=int, default=100000, help='rows per generated file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every measurement, the fastest one is kept')
+    parser.add_argument('--era', action='append', dest='eras', choices=eras(), help='can be given multiple times')
+    parser.add_argument('--csv-engine', default='pandas', choices=['pandas', 'arrow'])
+    parser.add_argument('--engine', default='pandas', choices=['pandas', 'arrow'],
+                        help='processing engine, arrow reads CSV with pyarrow too')
+    parser.add_argument('--save', help='path of JSON file to save results to (eg. new baseline)')
+    parser.add_argument('--baseline', help='path of JSON file with results to compare with')
+    parser.add_argument('--tolerance', type=float, default=default_tolerance)
+    args = parser.parse_args()
+
+    _results = run_benchmarks(rows=args.rows, seed=args.seed, selected_eras=args.eras, repeat=args.repeat,
+                              csv_engine=args.csv_engine, engine=args.engine)
+    sys.stdout.write(format_results(_results))
+    if args.save:
+        save_results(_results, args.save)
+    if args.baseline:
+        _baseline = load_results(args.baseline)
+        if _baseline['rows'] != _results['rows']:
+            sys.stderr.write(f'WARNING: baseline was measured on {_baseline["rows"]:_d} rows per file.\n')
+        _regressions = compare_to_baseline(_results, _baseline, args.tolerance)
+        for _regression in _regressions:
+            sys.stderr.write(f'REGRESSION: {_regression}\n')
+        sys.exit(1 if _regressions else 0)
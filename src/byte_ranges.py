@@ -0,0 +1,64 @@
+import os
+from typing import List, Tuple
+
+default_range_size = 128 * 1024 * 1024  # bytes, about a million rows of TLC files
+# extensions of files that are read as they are on disk, compressed ones can't be split without decompressing them
+_splittable_extensions = ('.csv', '.txt')
+_read_block_size = 64 * 1024
+
+RangeType = Tuple[int, int]  # offsets of the first byte and the byte after the last one
+
+
+def is_splittable(filepath: str) -> bool:
+    """True if the file is uncompressed so parts of it can be read at any offset."""
+
+    return filepath.lower().endswith(_splittable_extensions)
+
+
+def header_line(filepath: str) -> Tuple[str, int]:
+    """First line of the file (without line ending) and offset of the byte after it."""
+
+    data = b''
+    with open(filepath, 'rb') as f:
+        while b'\n' not in data:
+            block = f.read(_read_block_size)
+            if not block:
+                return data.decode('utf-8').rstrip('\r'), len(data)
+            data += block
+    line = data.split(b'\n', 1)[0]
+    return line.decode('utf-8').rstrip('\r'), len(line) + 1
+
+
+def split_lines(filepath: str, range_size: int = default_range_size, start: int = 0) -> List[RangeType]:
+    """Splits the file from start offset into ranges of about range_size bytes that end right after a newline,
+    so every range holds whole lines. Assumes there are no line breaks inside quoted fields (TLC files have none)."""
+
+    file_size = os.path.getsize(filepath)
+    ranges = []
+    with open(filepath, 'rb') as f:
+        while start < file_size:
+            end = min(start + range_size, file_size)
+            if end < file_size:
+                f.seek(end)
+                end = _next_line_start(f, file_size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _next_line_start(f, file_size: int) -> int:
+    while True:
+        position = f.tell()
+        block = f.read(_read_block_size)
+        if not block:
+            return file_size
+        newline = block.find(b'\n')
+        if newline >= 0:
+            return position + newline + 1
+
+
+def read_range(filepath: str, byte_range: RangeType) -> bytes:
+    start, end = byte_range
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
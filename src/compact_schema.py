@@ -0,0 +1,150 @@
+from typing import Dict, Any
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from arrow_processing import to_pandas
+from data_cleaning import payment_type_dtype, trip_type_dtype, year_quarter_dtype, year_month_dtype
+from helper_objects import arrow_schema, partition_columns
+from metrics import FrameType
+from zone_registry import get_zone_registry
+
+# amounts in dollars with cents, corrupt rows of TLC files have amounts over ten million dollars too
+money_type = pa.decimal128(18, 2)
+# amounts that don't fit money_type (or aren't finite) are written as nulls instead of failing the file
+money_limit = 10.0 ** (money_type.precision - money_type.scale)
+money_columns = ['fare_amount', 'tip_amount', 'total_amount']
+# TLC files have whole seconds, Parquet has no second unit so they're stored as milliseconds
+timestamp_type = pa.timestamp('s')
+timestamp_columns = ['pickup_datetime', 'dropoff_datetime']
+# index type of every dictionary column, wide enough for all of its values
+dictionary_index_types = {
+    'payment_type': pa.int8(),
+    'trip_type': pa.int8(),
+    'company': pa.int8(),
+    'pickup_borough': pa.int8(),
+    'pickup_zone': pa.int16(),
+    'dropoff_borough': pa.int8(),
+    'dropoff_zone': pa.int16(),
+    'year_quarter': pa.int16(),
+    'year_month': pa.int16(),
+}
+
+
+def _compact_type(field: pa.Field) -> pa.DataType:
+    if field.name in money_columns:
+        return money_type
+    elif field.name in timestamp_columns:
+        return timestamp_type
+    elif field.name in dictionary_index_types:
+        return pa.dictionary(dictionary_index_types[field.name], field.type)
+    return field.type
+
+
+# same columns as arrow_schema with smaller physical types, written with csv2parquet(..., compact=True)
+compact_arrow_schema = pa.schema([(field.name, _compact_type(field)) for field in arrow_schema])
+
+
+def shared_dictionaries() -> Dict[str, pa.Array]:
+    """Dictionary of every dictionary column. They hold every value the pipeline can produce (not only the ones
+    that are in a file) in fixed order, so codes mean the same in all files and their categoricals can be
+    concatenated without recoding. Zone names come from the lookup table so they change only with it."""
+
+    zone_attributes = get_zone_registry().zone_attributes
+    boroughs = list(zone_attributes.borough_categories)
+    zones = list(zone_attributes.zone_categories)
+    values = {
+        'payment_type': list(payment_type_dtype.categories),
+        'trip_type': list(trip_type_dtype.categories),
+        'company': ['green', 'yellow'],
+        'pickup_borough': boroughs,
+        'pickup_zone': zones,
+        'dropoff_borough': boroughs,
+        'dropoff_zone': zones,
+        'year_quarter': list(year_quarter_dtype.categories),
+        'year_month': list(year_month_dtype.categories),
+    }
+    return {name: pa.array(column_values, pa.string()) for name, column_values in values.items()}
+
+
+def to_compact_table(table: pa.Table) -> pa.Table:
+    """Casts columns of table with arrow_schema (or some of its columns) to types of compact_arrow_schema.
+
+    Money is rounded to cents (amounts that don't fit money_type become nulls), timestamps are truncated
+    to seconds, labels are encoded with shared_dictionaries (values that aren't in the dictionary become nulls).
+    Labels can also be dictionaries already (eg. converted from categoricals), then only their dictionaries
+    are looked up, not every row.
+    """
+
+    dictionaries = shared_dictionaries()
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if name in money_columns:
+            column = pc.round(pc.cast(column, pa.float64()), 2)
+            fits = pc.less(pc.abs(column), money_limit)  # false for NaN and infinity
+            column = pc.cast(pc.if_else(fits, column, pa.scalar(None, pa.float64())), money_type)
+        elif name in timestamp_columns:
+            column = pc.cast(column, timestamp_type, safe=False)
+        elif name in dictionary_index_types:
+            index_type = dictionary_index_types[name]
+            column = pa.chunked_array([_shared_dictionary_array(chunk, dictionaries[name], index_type)
+                                       for chunk in column.chunks],
+                                      pa.dictionary(index_type, pa.string()))
+        columns.append(column)
+    schema = pa.schema([compact_arrow_schema.field(name) for name in table.column_names], table.schema.metadata)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _shared_dictionary_array(array: pa.Array, dictionary: pa.Array, index_type: pa.DataType) -> pa.DictionaryArray:
+    if pa.types.is_dictionary(array.type):
+        # position of every value of array's own dictionary in the shared one, indices are translated through it
+        positions = pc.index_in(array.dictionary, value_set=dictionary)
+        indices = pc.take(positions, array.indices)
+    else:
+        indices = pc.index_in(array, value_set=dictionary)
+    return pa.DictionaryArray.from_arrays(pc.cast(indices, index_type), dictionary)
+
+
+def timestamp_options(schema: pa.Schema) -> Dict[str, Any]:
+    """Keyword arguments for pq.ParquetWriter and pq.write_table that store second timestamps as INT64 milliseconds
+    instead of INT96 nanoseconds that flavor='spark' uses (other schemas get none)."""
+
+    if any(field.type == timestamp_type for field in schema):
+        return {'use_deprecated_int96_timestamps': False, 'coerce_timestamps': 'ms'}
+    return {}
+
+
+def to_arrow_table(data_frame: FrameType, schema: pa.Schema = arrow_schema, compact: bool = False) -> pa.Table:
+    """Converts columns of the DataFrame that are in the schema column by column without copying the frame:
+    numeric columns share their buffers with Arrow arrays, masks of nullable columns (Int8, Int16) become validity
+    bitmaps, NaN and NaT become nulls and categoricals are taken as dictionaries (decoded to strings unless compact).
+    Arrow table (Arrow engine) has its columns selected and cast the same way.
+    Types aren't checked here, see check_schema."""
+
+    arrays = []
+    for field in schema:
+        if isinstance(data_frame, pa.Table):
+            array = data_frame.column(field.name)
+        else:
+            array = pa.array(data_frame[field.name], from_pandas=True)
+        if array.type != field.type and not (compact and pa.types.is_dictionary(array.type)):
+            array = array.cast(field.type)
+        arrays.append(array)
+    # pandas metadata (dtypes to restore when reading the file back) taken from empty frame, it's the same,
+    # tables get metadata of the DataFrame that the pandas engine gives so both engines write the same files
+    empty_frame = to_pandas(data_frame.slice(0, 0)) if isinstance(data_frame, pa.Table) else data_frame.iloc[:0]
+    pandas_schema = pa.Schema.from_pandas(empty_frame[schema.names], preserve_index=False)
+    table = pa.Table.from_arrays(arrays, names=schema.names, metadata=pandas_schema.metadata)
+    return to_compact_table(table) if compact else table
+
+
+def check_schema(schema: pa.Schema, compact: bool = False, partitioned: bool = False) -> None:
+    """Raises ValueError if schema of tables written to a file isn't the output schema.
+    Called once per written file with schema of its first table (every following one has to match it anyway)."""
+
+    expected = compact_arrow_schema if compact else arrow_schema
+    if partitioned:
+        expected = pa.schema([field for field in expected if field.name not in partition_columns])
+    if not schema.equals(expected, check_metadata=False):
+        raise ValueError(f'Schema of the output file doesn\'t match {"compact_" if compact else ""}arrow_schema.\n'
+                         f'Expected:\n{expected}\nGot:\n{schema}')
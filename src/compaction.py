@@ -0,0 +1,222 @@
+import argparse
+import logging
+import os
+from datetime import datetime
+from sys import stdout
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from compact_schema import to_compact_table, check_schema
+from data_cleaning import default_sort_keys
+from data_export import SortOptions, is_compact_layout
+from data_processing import get_taxi_params
+from external_sort import ExternalSorter, default_run_rows, row_groups
+from helper_objects import timer, temp_path_for
+from manifest import RunManifest
+from partitioned_writer import default_target_file_size, default_row_group_size
+from writer_profile import WriterProfile, parquet_options
+
+default_max_file_size = 512 * 1024 * 1024  # bytes, files between target and max size are left alone by compaction
+
+
+@timer(logging.INFO)
+def compact_output_folder(output_folder: str, target_file_size: int = default_target_file_size,
+                          max_file_size: int = default_max_file_size, row_group_size: int = default_row_group_size,
+                          sort: SortOptions = SortOptions(global_order=True)) -> List[str]:
+    """Rewrites Parquet files of the output folder (file per source output of csv2parquet) into files
+    of about target_file_size bytes, so neither many small months nor few huge ones slow down scans.
+
+    Files of every company are taken in order of months, files smaller than target_file_size are merged
+    with the following ones until they reach it and files bigger than max_file_size are split into files
+    of about target_file_size (the rest is left as it is). Rows of every group of files are sorted by sort.keys
+    as a whole (external merge sort) and written in row groups of row_group_size rows. New files are written
+    under temporary names and swapped in only when they hold the same number of rows as the files they replace.
+    Sources in the manifest point to the new files so csv2parquet doesn't convert them again, if one of them
+    is converted again anyway every file it was merged into is removed and converted again from its sources.
+    Returns paths of the new files.
+    """
+
+    manifest = RunManifest(output_folder)
+    profile = WriterProfile.for_output_folder(output_folder)
+    written = []
+    for (company, layout), files in _compaction_groups(manifest).items():
+        # files of the other schema than the profile was tuned on keep default settings
+        group_profile = profile if profile is not None and profile.compact == is_compact_layout(layout) else None
+        for group in _compaction_bins(files, target_file_size, max_file_size):
+            old_outputs = list(group)
+            sources = sorted({source for sources in group.values() for source in sources})
+            stdout.write(f"{datetime.now().isoformat(timespec='seconds')} - compacting {len(old_outputs)} files "
+                         f"of {len(sources)} {company} sources\n")
+            stdout.flush()
+            file_paths = _merge_files(old_outputs, output_folder, _compacted_file_name(sources), target_file_size,
+                                      row_group_size, sort, group_profile)
+            try:
+                _verify_row_counts(old_outputs, list(file_paths.values()))
+            except BaseException:
+                for temp_file_path in file_paths.values():
+                    os.remove(temp_file_path)
+                raise
+            # sources point to new files before old files are removed, interrupted swap makes them outdated
+            # (converted again by the next run) and rows are never in two files that both exist
+            manifest.record_compaction(sources, old_outputs, list(file_paths))
+            for old_output in old_outputs:
+                if old_output not in file_paths:
+                    os.remove(old_output)
+            for file_path, temp_file_path in file_paths.items():
+                os.replace(temp_file_path, file_path)
+            written += list(file_paths)
+    stdout.write(f"{datetime.now().isoformat(timespec='seconds')} - finished compacting files.\n")
+    stdout.flush()
+    return written
+
+
+def _compaction_groups(manifest: RunManifest) -> Dict[Tuple[str, str], Dict[str, List[str]]]:
+    """Parquet files of file per source output with sources whose rows they hold,
+    grouped by company and layout (files with different layouts can't be merged). Sources with missing files
+    are left out, they're outdated anyway."""
+
+    groups: Dict[Tuple[str, str], Dict[str, List[str]]] = {}
+    for source, entry in sorted(manifest.entries.items()):
+        if not entry['layout'].startswith('file per source'):
+            continue
+        outputs = [os.path.join(manifest.output_folder, output) for output in entry['outputs']
+                   if output.endswith('.parquet')]
+        if not all(os.path.exists(output) for output in outputs):
+            continue
+        company, _ = get_taxi_params(os.path.basename(source).split('.')[0])
+        files = groups.setdefault((company, entry['layout']), {})
+        for output in outputs:
+            files.setdefault(output, []).append(source)
+    return groups
+
+
+def _compaction_bins(files: Dict[str, List[str]], target_file_size: int,
+                     max_file_size: int) -> Iterator[Dict[str, List[str]]]:
+    """Groups of files (in order of their first source) that are merged and rewritten together."""
+
+    group: Dict[str, List[str]] = {}
+    group_size = 0
+    for file_path in sorted(files, key=lambda path: (min(map(os.path.basename, files[path])), path)):
+        size = os.path.getsize(file_path)
+        if target_file_size <= size <= max_file_size:
+            continue
+        if size > max_file_size:
+            yield {file_path: files[file_path]}
+            continue
+        group[file_path] = files[file_path]
+        group_size += size
+        if group_size >= target_file_size:
+            yield group
+            group, group_size = {}, 0
+    # single small file would be rewritten as it is
+    if len(group) > 1:
+        yield group
+
+
+def _compacted_file_name(sources: List[str]) -> str:
+    first, last = (os.path.basename(source).split('.')[0] for source in (sources[0], sources[-1]))
+    return first if first == last else f'{first}_{last.rsplit("_", 1)[-1]}'
+
+
+def _merge_files(file_paths: List[str], output_folder: str, result_name: str, target_file_size: int,
+                 row_group_size: int, sort: SortOptions,
+                 profile: Optional[WriterProfile]) -> Dict[str, str]:
+    """Writes rows of the files sorted by sort.keys into files with the same number of full row groups
+    (as many files as needed for about target_file_size bytes each, the last one has the rest),
+    returns their temporary paths keyed by final paths."""
+
+    input_size = sum(os.path.getsize(file_path) for file_path in file_paths)
+    input_rows = sum(pq.ParquetFile(file_path).metadata.num_rows for file_path in file_paths)
+    # output is about as big as input, rows are split evenly instead of leaving small file at the end
+    files = max(1, round(input_size / target_file_size))
+    file_row_groups = -(-input_rows // (files * row_group_size))
+    compact = any(pa.types.is_dictionary(field.type) for field in pq.read_schema(file_paths[0]))
+    output_paths: Dict[str, str] = {}
+    writer = sink = None
+    written_row_groups = 0
+    try:
+        with ExternalSorter(list(sort.keys), sort.run_rows, sort.spill_folder) as sorter:
+            for file_path in file_paths:
+                for batch in pq.ParquetFile(file_path).iter_batches(batch_size=row_group_size):
+                    # compact types are applied after merging, Arrow can't sort dictionary columns
+                    sorter.add(_decoded_table(pa.Table.from_batches([batch])))
+            for table in row_groups(sorter.sorted_tables(), row_group_size):
+                if compact:
+                    table = to_compact_table(table)
+                if writer is None:
+                    check_schema(table.schema, compact)
+                    file_path = _free_file_path(output_folder, result_name, file_paths, output_paths)
+                    output_paths[file_path] = temp_path_for(file_path)
+                    sink = pa.OSFile(output_paths[file_path], 'wb')
+                    writer = pq.ParquetWriter(sink, schema=table.schema, flavor='spark',
+                                              **parquet_options(profile, table.schema))
+                writer.write_table(table, row_group_size=row_group_size)
+                written_row_groups += 1
+                if written_row_groups == file_row_groups:
+                    writer.close()
+                    sink.close()
+                    writer = sink = None
+                    written_row_groups = 0
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            sink.close()
+        for temp_file_path in output_paths.values():
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+        raise
+    if writer is not None:
+        writer.close()
+        sink.close()
+    return output_paths
+
+
+def _free_file_path(output_folder: str, result_name: str, replaced: List[str], taken: Iterable[str]) -> str:
+    """First numbered path of the result that isn't taken nor a file other than the ones being replaced
+    (files of the company left as they are can have the same name, eg. the rest of a split file)."""
+
+    taken = set(taken)
+    index = 0
+    while True:
+        file_path = os.path.join(output_folder, f'{result_name}-{index:05d}.parquet')
+        if file_path not in taken and (file_path in replaced or not os.path.exists(file_path)):
+            return file_path
+        index += 1
+
+
+def _decoded_table(table: pa.Table) -> pa.Table:
+    """Table with dictionary columns decoded to their values."""
+
+    fields = [pa.field(field.name, field.type.value_type) if pa.types.is_dictionary(field.type) else field
+              for field in table.schema]
+    return table.cast(pa.schema(fields, table.schema.metadata))
+
+
+def _verify_row_counts(old_file_paths: List[str], new_file_paths: List[str]) -> None:
+    old_rows, new_rows = (sum(pq.ParquetFile(file_path).metadata.num_rows for file_path in file_paths)
+                          for file_paths in (old_file_paths, new_file_paths))
+    if old_rows != new_rows:
+        raise RuntimeError(f'Compacted files have {new_rows:_d} rows instead of {old_rows:_d}, '
+                           f'files weren\'t replaced: {old_file_paths}')
+
+
+_mib = 1024 * 1024
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merges Parquet files written by csv2parquet (file per source) '
+                                                 'into files of about the target size, see compact_output_folder.')
+    parser.add_argument('output_folder')
+    parser.add_argument('--target-size', type=int, default=default_target_file_size // _mib, help='MiB')
+    parser.add_argument('--max-size', type=int, default=default_max_file_size // _mib,
+                        help='MiB, files between target and max size are left as they are')
+    parser.add_argument('--row-group-size', type=int, default=default_row_group_size, help='rows')
+    parser.add_argument('--sort-key', action='append', dest='sort_keys', help='can be given multiple times')
+    parser.add_argument('--run-rows', type=int, default=default_run_rows, help='rows sorted in memory at once')
+    parser.add_argument('--spill-folder', help='where sorted runs are spilled, system\'s temporary folder by default')
+    args = parser.parse_args()
+
+    compact_output_folder(args.output_folder, args.target_size * _mib, args.max_size * _mib, args.row_group_size,
+                          SortOptions(tuple(args.sort_keys or default_sort_keys), True, args.run_rows,
+                                      args.spill_folder))
@@ -1,11 +1,12 @@
 import logging
-from typing import Union, Any
+from typing import Union, Any, Callable, NamedTuple, Optional, Dict, List, Iterable, Tuple
 
 import numpy as np
 import pandas as pd
 from pandas._libs.missing import NAType
+from pandas.api.extensions import ExtensionArray, ExtensionDtype
 
-from helper_objects import column_name_mapping_dict, timer
+from helper_objects import column_name_mapping_dict, timer, DropStats
 
 
 @timer(logging.DEBUG)
@@ -15,15 +16,121 @@ def rename_columns(data_frame: pd.DataFrame) -> pd.DataFrame:
     return data_frame.rename(columns=column_mapping_function)
 
 
+first_valid_year = 2009
+last_valid_year = 2028
+coordinate_columns = ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']
+
+
+class RowRule(NamedTuple):
+    """Row validity rule, predicate returns mask of rows that pass it (other rows are dropped)."""
+
+    name: str
+    predicate: Callable[[pd.DataFrame], Union[pd.Series, np.ndarray]]
+    location: Optional[str] = None  # rule applies only to files with this kind of location data, None - to all
+
+
+def has_valid_coordinates(data_frame: pd.DataFrame) -> pd.Series:
+    """None of the coordinates is 0 or null."""
+
+    coordinates = data_frame[coordinate_columns]
+    return coordinates.notna().all(axis=1) & (coordinates != 0).all(axis=1)
+
+
+def has_location_ids(data_frame: pd.DataFrame) -> pd.Series:
+    """Both pickup and dropoff location id are present."""
+
+    return data_frame['pickup_location_id'].notna() & data_frame['dropoff_location_id'].notna()
+
+
+def has_valid_timestamps(data_frame: pd.DataFrame) -> pd.Series:
+    """Taxi ride doesn't ignore laws of physics (going back in time).
+    Pickup is earlier than dropoff and neither of the timestamps is null."""
+
+    return data_frame['pickup_datetime'] < data_frame['dropoff_datetime']  # always False for NaT
+
+
+def has_no_negative_values(data_frame: pd.DataFrame) -> pd.Series:
+    """Trip distance, total fare and passenger count aren't below zero (nulls are ok)."""
+
+    return ((data_frame['trip_distance'].fillna(0) >= 0) &
+            (data_frame['total_amount'].fillna(0) >= 0) &
+            (data_frame['passenger_count'].fillna(0) >= 0).astype(bool))
+
+
+def has_valid_passenger_count(data_frame: pd.DataFrame) -> pd.Series:
+    """Passenger count value is inside acceptable range [0,20] - nulls are ok."""
+
+    passenger_count = data_frame['passenger_count'].fillna(0)
+    return ((passenger_count >= 0) & (passenger_count <= 20)).astype(bool)
+
+
+def has_valid_trip_duration(data_frame: pd.DataFrame) -> pd.Series:
+    """Trip duration could be calculated and it's not over 90 minutes."""
+
+    return data_frame['trip_duration_minutes'] <= 90  # always False for NaN
+
+
+def has_valid_year(data_frame: pd.DataFrame) -> pd.Series:
+    """Year of pickup is one that TLC could have published data for (not wrong or parsed improperly)."""
+
+    year = data_frame['pickup_datetime'].dt.year
+    return (year >= first_valid_year) & (year <= last_valid_year)  # always False for NaN
+
+
+# rules that decide which rows are dropped, order only matters for readability
+row_rules: Dict[str, RowRule] = {rule.name: rule for rule in [
+    RowRule('invalid_coordinates', has_valid_coordinates, location='coordinates'),
+    RowRule('missing_location_ids', has_location_ids),
+    RowRule('invalid_timestamps', has_valid_timestamps),
+    RowRule('negative_values', has_no_negative_values),
+    RowRule('invalid_passenger_count_values', has_valid_passenger_count),
+    RowRule('invalid_trip_durations', has_valid_trip_duration),
+    RowRule('invalid_year_values', has_valid_year),
+]}
+
+
+def rules_for_location(location: str) -> List[RowRule]:
+    """Rules that should be applied to file with given kind of location data (id, coordinates)."""
+
+    return [rule for rule in row_rules.values() if rule.location is None or rule.location == location]
+
+
+@timer(logging.DEBUG)
+def filter_rows(data_frame: pd.DataFrame, rules: Iterable[RowRule], drop_columns: Iterable[str] = (),
+                drop_stats: Optional[DropStats] = None) -> pd.DataFrame:
+    """Remove rows that don't pass all of the rules (and optionally columns that are no longer needed).
+    Masks of all rules are combined first so surviving rows are copied only once.
+    If drop_stats is given numbers of rows rejected by every rule are added to it."""
+
+    keep = np.ones(len(data_frame.index), dtype=bool)
+    masks = {}
+    for rule in rules:
+        masks[rule.name] = np.asarray(rule.predicate(data_frame), dtype=bool)
+        keep &= masks[rule.name]
+    if drop_stats is not None:
+        count_rejected_rows(masks, drop_stats)
+    drop_columns = set(drop_columns)
+    return data_frame.loc[keep, [column for column in data_frame.columns if column not in drop_columns]]
+
+
+def count_rejected_rows(masks: Dict[str, np.ndarray], drop_stats: DropStats) -> None:
+    failed_rules_count = np.zeros(len(next(iter(masks.values()), [])), dtype=np.int8)
+    for mask in masks.values():
+        failed_rules_count += ~mask
+    rejected_once = failed_rules_count == 1
+    drop_stats.rows_checked += len(failed_rules_count)
+    for name, mask in masks.items():
+        drop_stats.add_rule_counts(
+            name,
+            rejected=int(np.count_nonzero(~mask)),
+            rejected_alone=int(np.count_nonzero(~mask & rejected_once)))
+
+
 @timer(logging.DEBUG)
 def drop_invalid_coordinates(data_frame: pd.DataFrame) -> pd.DataFrame:
     """Remove rows where any of the coordinates is 0 or null."""
 
-    data_frame = data_frame.dropna(
-        subset=['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude'])
-    data_frame = data_frame[(data_frame['pickup_longitude'] != 0) & (data_frame['pickup_latitude'] != 0) &
-                            (data_frame['dropoff_longitude'] != 0) & (data_frame['dropoff_latitude'] != 0)]
-    return data_frame.copy()
+    return filter_rows(data_frame, [row_rules['invalid_coordinates']])
 
 
 @timer(logging.DEBUG)
@@ -31,66 +138,73 @@ def drop_invalid_timestamps(data_frame: pd.DataFrame) -> pd.DataFrame:
     """Remove taxi rides ignoring laws of physics (going back in time).
     Drop where pickup is the same time or later than dropoff or either of the timestamps is null."""
 
-    data_frame = data_frame.dropna(subset=['pickup_datetime', 'pickup_datetime'])
-    data_frame = data_frame[data_frame['pickup_datetime'] < data_frame['dropoff_datetime']]
-    return data_frame.copy()
+    return filter_rows(data_frame, [row_rules['invalid_timestamps']])
 
 
 @timer(logging.DEBUG)
 def drop_negative_values(data_frame: pd.DataFrame) -> pd.DataFrame:
     """Remove rows with trip distance, total fare or passenger count below zero."""
 
-    data_frame = data_frame[data_frame['trip_distance'].fillna(0) >= 0]
-    data_frame = data_frame[data_frame['total_amount'].fillna(0) >= 0]
-    data_frame = data_frame[data_frame['passenger_count'].fillna(0) >= 0]
-    return data_frame.copy()
+    return filter_rows(data_frame, [row_rules['negative_values']])
 
 
 @timer(logging.DEBUG)
-def drop_invalid_distances(data_frame: pd.DataFrame) -> pd.DataFrame:
-    # we could compare reported distance with pickup and dropoff locations but that's kinda too much work
-    raise NotImplementedError()
+def drop_invalid_trip_durations(data_frame: pd.DataFrame) -> pd.DataFrame:
+    """Remove rows where we couldn't calculate trip duration or it was over 90 minutes."""
+
+    return filter_rows(data_frame, [row_rules['invalid_trip_durations']])
 
 
 @timer(logging.DEBUG)
-def replace_tip_values_for_cash_payments(data_frame: pd.DataFrame) -> pd.DataFrame:
-    """Change tip amount to null for cash transactions (better to have nulls for unknown values than zeroes)."""
+def drop_invalid_year_values(data_frame: pd.DataFrame) -> pd.DataFrame:
+    """Remove records with dates that were wrong or parsed improperly."""
 
-    data_frame['tip_amount'] = data_frame['tip_amount'].mask(data_frame['payment_type'] == 'cash', np.nan)
-    return data_frame
+    return filter_rows(data_frame, [row_rules['invalid_year_values']])
 
 
 @timer(logging.DEBUG)
-def drop_invalid_trip_durations(data_frame: pd.DataFrame) -> pd.DataFrame:
-    """Remove rows where we couldn't calculate trip duration or it was over 90 minutes."""
+def drop_missing_location_ids(data_frame: pd.DataFrame) -> pd.DataFrame:
+    """Remove rows that don't have either pickup or dropoff location id."""
 
-    data_frame = data_frame.dropna(subset=['trip_duration_minutes'])
-    data_frame = data_frame[data_frame['trip_duration_minutes'] <= 90]
-    return data_frame.copy()
+    return filter_rows(data_frame, [row_rules['missing_location_ids']])
 
 
 @timer(logging.DEBUG)
-def drop_invalid_year_values(data_frame: pd.DataFrame) -> pd.DataFrame:
-    """Remove records with dates that were wrong or parsed improperly."""
+def drop_invalid_passenger_count_values(data_frame: pd.DataFrame) -> pd.DataFrame:
+    """Remove rows where passenger count value is outside acceptable range [0,20] - nulls are ok."""
 
-    data_frame = data_frame.dropna(subset=['year'])
-    data_frame = data_frame[(data_frame['year'] >= 2009) & (data_frame['year'] < 2029)]
-    return data_frame.copy()
+    data_frame = filter_rows(data_frame, [row_rules['invalid_passenger_count_values']])
+    return convert_passenger_count_type(data_frame)
 
 
 @timer(logging.DEBUG)
-def drop_missing_location_ids(data_frame: pd.DataFrame) -> pd.DataFrame:
-    """Remove rows that don't have either pickup or dropoff location id."""
+def convert_passenger_count_type(data_frame: pd.DataFrame) -> pd.DataFrame:
+    """Use smaller type for passenger count once values outside of [0,20] range are removed."""
+
+    data_frame['passenger_count'] = data_frame['passenger_count'].astype('Int8')
+    return data_frame
+
+
+@timer(logging.DEBUG)
+def drop_invalid_distances(data_frame: pd.DataFrame) -> pd.DataFrame:
+    # we could compare reported distance with pickup and dropoff locations but that's kinda too much work
+    raise NotImplementedError()
+
+
+@timer(logging.DEBUG)
+def replace_tip_values_for_cash_payments(data_frame: pd.DataFrame) -> pd.DataFrame:
+    """Change tip amount to null for cash transactions (better to have nulls for unknown values than zeroes)."""
 
-    return data_frame.dropna(subset=['pickup_location_id', 'dropoff_location_id']).copy()
+    data_frame['tip_amount'] = data_frame['tip_amount'].mask(data_frame['payment_type'] == 'cash', np.nan)
+    return data_frame
 
 
 @timer(logging.DEBUG)
 def standardize_snf_flag_values(data_frame: pd.DataFrame) -> pd.DataFrame:
     """Replace values of store_and_forward with standardized versions."""
 
-    data_frame['store_and_forward'] = data_frame['store_and_forward'].apply(store_and_fwd_flag_mapping_function).astype(
-        pd.Int16Dtype())
+    data_frame['store_and_forward'] = map_distinct_values(
+        data_frame['store_and_forward'], store_and_fwd_flag_mapping_function, pd.Int16Dtype())
     return data_frame
 
 
@@ -98,10 +212,28 @@ def standardize_snf_flag_values(data_frame: pd.DataFrame) -> pd.DataFrame:
 def standardize_payment_type_values(data_frame: pd.DataFrame) -> pd.DataFrame:
     """Replace values of payment_type with standardized versions."""
 
-    data_frame['payment_type'] = data_frame['payment_type'].apply(payment_type_mapping_function)
+    data_frame['payment_type'] = map_distinct_values(
+        data_frame['payment_type'], payment_type_mapping_function, payment_type_dtype)
     return data_frame
 
 
+def map_distinct_values(values: pd.Series, mapping_function: Callable[[Any], Any],
+                        dtype: Union[str, ExtensionDtype]) -> ExtensionArray:
+    """Apply mapping function only to distinct values of the Series and broadcast results back to every row.
+    Missing values stay missing (mapping functions return NA for them anyway)."""
+
+    codes, uniques = pd.factorize(values)
+    # extra NA at the end is picked by code -1 that factorize gives to missing values
+    mapped_uniques = pd.array([mapping_function(value) for value in uniques] + [pd.NA], dtype=dtype)
+    return mapped_uniques[codes]
+
+
+# every value that mapping functions can return, categories are fixed so chunks can be concatenated
+payment_type_dtype = pd.CategoricalDtype(
+    ['cash', 'credit card', 'dispute', 'no charge', 'unknown', 'voided trip'])
+trip_type_dtype = pd.CategoricalDtype(['Dispatch', 'Street-hail'])
+
+
 def store_and_fwd_flag_mapping_function(x: Any) -> Union[int, NAType]:
     if x is None:
         return pd.NA
@@ -159,11 +291,18 @@ def add_trip_duration(data_frame: pd.DataFrame) -> pd.DataFrame:
 
 @timer(logging.DEBUG)
 def add_year(data_frame: pd.DataFrame) -> pd.DataFrame:
-    data_frame['year'] = pd.DatetimeIndex(data_frame['pickup_datetime']).year
-    data_frame['year'] = data_frame['year'].astype(np.int16)
+    year, _, _ = _civil_date(_epoch_days(data_frame['pickup_datetime']))
+    data_frame['year'] = year.astype(np.int16)
     return data_frame
 
 
+# labels of every period that passes invalid_year_values rule, fixed so chunks can be concatenated
+year_quarter_dtype = pd.CategoricalDtype(
+    [f'{year}Q{quarter}' for year in range(first_valid_year, last_valid_year + 1) for quarter in range(1, 5)])
+year_month_dtype = pd.CategoricalDtype(
+    [f'{year}-{month:02d}' for year in range(first_valid_year, last_valid_year + 1) for month in range(1, 13)])
+
+
 @timer(logging.DEBUG)
 def add_additional_date_features(data_frame: pd.DataFrame) -> pd.DataFrame:
     """Add columns with values computed from pickup date.
@@ -176,45 +315,77 @@ def add_additional_date_features(data_frame: pd.DataFrame) -> pd.DataFrame:
         - date (eg. 2019-01-01),
         - day_of_week (1-7 where 1 is monday)
         - hour_of_day.
-    """
 
-    dti = pd.DatetimeIndex(data_frame['pickup_datetime'])
+        Everything is computed with integer arithmetic on nanoseconds since epoch so pickup_datetime can't be null,
+        labels (year_quarter, year_month) are categoricals and they're null for years outside of the valid range.
+    """
 
-    data_frame['year_quarter'] = dti.year.astype(str) + 'Q' + dti.quarter.astype(str)
-    data_frame['year_month'] = dti.strftime('%Y-%m')
-    data_frame['quarter'] = dti.quarter.astype(np.int8)
-    data_frame['month'] = dti.month.astype(np.int8)
-    data_frame['date'] = dti.date
-    data_frame['day_of_week'] = (dti.weekday + 1).astype(np.int8)
-    data_frame['hour_of_day'] = dti.hour.astype(np.int8)
+    days = _epoch_days(data_frame['pickup_datetime'])
+    year, month, _ = _civil_date(days)
+    quarter = (month - 1) // 3 + 1
+    years_since_first = year - first_valid_year
+    valid_year = (year >= first_valid_year) & (year <= last_valid_year)
+
+    data_frame['year_quarter'] = pd.Categorical.from_codes(
+        np.where(valid_year, years_since_first * 4 + quarter - 1, -1), dtype=year_quarter_dtype)
+    data_frame['year_month'] = pd.Categorical.from_codes(
+        np.where(valid_year, years_since_first * 12 + month - 1, -1), dtype=year_month_dtype)
+    data_frame['quarter'] = quarter.astype(np.int8)
+    data_frame['month'] = month.astype(np.int8)
+    data_frame['date'] = (days * _nanoseconds_in_day).view('datetime64[ns]')  # midnight, written as date32
+    data_frame['day_of_week'] = ((days + 3) % 7 + 1).astype(np.int8)  # 1970-01-01 was thursday
+    data_frame['hour_of_day'] = ((_epoch_nanoseconds(data_frame['pickup_datetime']) // _nanoseconds_in_hour) % 24
+                                 ).astype(np.int8)
 
     return data_frame
 
 
+_nanoseconds_in_hour = 3600 * 10 ** 9
+_nanoseconds_in_day = 24 * _nanoseconds_in_hour
+
+
+def _epoch_nanoseconds(timestamps: pd.Series) -> np.ndarray:
+    return timestamps.values.view(np.int64)
+
+
+def _epoch_days(timestamps: pd.Series) -> np.ndarray:
+    return _epoch_nanoseconds(timestamps) // _nanoseconds_in_day
+
+
+def _civil_date(days: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Year, month and day from number of days since 1970-01-01 (proleptic gregorian calendar).
+    Vectorized version of H. Hinnant's civil_from_days algorithm."""
+
+    z = days + 719468
+    era = z // 146097
+    day_of_era = z - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153  # months counted from march
+    day = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = np.where(month_index < 10, month_index + 3, month_index - 9)
+    year = year_of_era + era * 400 + (month <= 2)
+    return year, month, day
+
+
 @timer(logging.DEBUG)
 def standardize_trip_type_values(data_frame: pd.DataFrame) -> pd.DataFrame:
     # if column doesn't exist add it with null values
     if 'trip_type' not in data_frame.columns:
-        data_frame['trip_type'] = pd.NA
+        data_frame['trip_type'] = pd.Categorical.from_codes(
+            np.full(len(data_frame.index), -1, dtype=np.int8), dtype=trip_type_dtype)
     else:
-        data_frame['trip_type'] = data_frame['trip_type'].apply(trip_type_mapping_function)
+        data_frame['trip_type'] = map_distinct_values(
+            data_frame['trip_type'], trip_type_mapping_function, trip_type_dtype)
     return data_frame
 
 
-@timer(logging.DEBUG)
-def drop_invalid_passenger_count_values(data_frame: pd.DataFrame) -> pd.DataFrame:
-    """Remove rows where passenger count value is outside acceptable range [0,20] - nulls are ok."""
-
-    data_frame = data_frame[
-        (data_frame['passenger_count'].fillna(0) >= 0) & (data_frame['passenger_count'].fillna(0) <= 20)
-    ].copy()
-    data_frame['passenger_count'] = data_frame['passenger_count'].astype('Int8')
-    return data_frame
+# fields that help with compression in columnar format such as Parquet when rows are sorted by them
+default_sort_keys = ['pickup_location_id', 'dropoff_location_id', 'payment_type']
 
 
 @timer(logging.DEBUG)
-def sort_df(data_frame: pd.DataFrame) -> pd.DataFrame:
+def sort_df(data_frame: pd.DataFrame, sort_keys: List[str] = default_sort_keys) -> pd.DataFrame:
     """Sort DataFrame by fields that will help with compression in columnar format such as Parquet."""
 
-    return data_frame.sort_values(by=['pickup_location_id', 'dropoff_location_id', 'payment_type'])
-
+    return data_frame.sort_values(by=sort_keys)
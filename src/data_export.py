@@ -1,55 +1,460 @@
+import collections
+import io
 import logging
 import os
+import sys
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout, redirect_stderr, contextmanager
 from datetime import datetime
-from sys import stdout
-from typing import List
+from sys import stdout, stderr
+from typing import List, Dict, Tuple, Optional, NamedTuple, Iterable, Iterator, Any
 
-import numpy as np
-import pandas as pd
-import pyarrow as pa
 import pyarrow.parquet as pq
 
-from data_processing import process_taxi_data_file
-from helper_objects import arrow_schema, yellow_taxi_paths, green_taxi_paths, timer
+from data_cleaning import default_sort_keys
+from compact_schema import compact_arrow_schema, to_compact_table, timestamp_options, to_arrow_table, check_schema
+from data_processing import process_taxi_data_file_frame, process_taxi_data_file_chunks, pipeline_fingerprint
+from external_sort import ExternalSorter, default_run_rows, row_groups
+from helper_objects import arrow_schema, yellow_taxi_paths, green_taxi_paths, timer, DropStats, atomic_output
+from manifest import RunManifest, SourceStateType
+from metrics import FileMetrics, RunMetrics, FrameType, measure, frame_bytes, frame_rows
+from partitioned_writer import DatasetOptions, write_partitioned, default_target_file_size, default_row_group_size
+from pipelining import prefetch
+from writer_profile import WriterProfile, tune_columns, format_report, writer_profile_file_name, parquet_options
 
 
-def csv2parquet(paths: List[str], output_folder: str) -> None:
-    of = len(paths)
+class SortOptions(NamedTuple):
+    """Order of rows in output files."""
 
-    for i, path in enumerate(paths):
+    keys: Tuple[str, ...] = tuple(default_sort_keys)
+    # whole file sorted with external merge sort instead of every chunk separately
+    global_order: bool = False
+    run_rows: int = default_run_rows  # rows sorted in memory before they're spilled to disk
+    spill_folder: Optional[str] = None  # where sorted runs are spilled, system's temporary folder if None
+
+
+def csv2parquet(paths: List[str], output_folder: str, jobs: int = 1, streaming: bool = False,
+                partitioned: bool = False, target_file_size: int = default_target_file_size,
+                row_group_size: int = default_row_group_size, force: bool = False, metrics_path: Optional[str] = None,
+                prometheus_path: Optional[str] = None, sort_keys: List[str] = default_sort_keys,
+                global_sort: bool = False, sort_run_rows: int = default_run_rows, spill_folder: Optional[str] = None,
+                compact: bool = False, **kwargs) -> Dict[str, str]:
+    """Converts CSV files to Parquet files (one per source file) in the output folder.
+
+    With streaming=True each processed chunk is written straight to the Parquet file as its own row group
+    so memory usage depends on the chunk size instead of the size of the whole file.
+
+    With partitioned=True output folder becomes a Hive partitioned dataset (company=/year=/month= folders),
+    files in every partition have row groups of row_group_size rows and are split once they reach
+    target_file_size bytes. Partition columns aren't stored in the files.
+
+    With jobs > 1 files are distributed across a pool of worker processes (largest first),
+    output of each file (prints, logs and warnings) is printed as a whole once it's done and failures don't stop
+    the batch.
+    Returns dictionary with tracebacks of files that failed (path: traceback).
+    With range_jobs > 1 every uncompressed file is also split into byte ranges processed by range_jobs worker
+    processes (see process_taxi_data_file_chunks), so a few huge files don't leave the rest of the cores idle.
+    With parse_cache='folder' parsed CSV columns are cached in the folder, so converting the files again
+    (eg. after changing a cleaning rule) memory maps them instead of parsing the CSV files.
+
+    Other keyword arguments are passed to process_taxi_data_file (eg. csv_engine='arrow').
+
+    Next to every Parquet file JSON file (.quality.json) is saved with number of rows rejected by each cleaning rule.
+
+    Converted files are recorded in the manifest (_manifest.json) in the output folder, files that are up to date
+    (same contents, pipeline fingerprint and output layout, outputs still exist) are skipped unless force=True.
+    So after a crash the same call picks up where it stopped and after changing eg. a cleaning rule
+    only files it applies to are converted again. Every output file is written under temporary name first
+    and renamed once complete.
+
+    Wall time, CPU time, rows, bytes and peak memory growth of every stage (reading, processing steps, writing)
+    of every chunk are measured, once all files are done they're appended to metrics_path as JSON lines
+    (together with per file and per run totals) and per stage totals are written to prometheus_path
+    in Prometheus text format (eg. for node_exporter's textfile collector), if these paths are given.
+
+    Rows are sorted by sort_keys for better compression. By default every chunk is sorted separately,
+    with global_sort=True whole file is sorted: chunks are gathered in sorted runs of sort_run_rows rows,
+    runs that don't fit in memory are spilled to Arrow IPC files in spill_folder (system's temporary folder
+    by default) and merged into the Parquet file, so memory use doesn't depend on size of the file.
+    It only works with file per source output (partitioned=False) and implies streaming.
+
+    If the output folder has writer profile saved by tune_writer_profile (_writer_profile.json) every file
+    is written with its per column compression and encoding settings, it has to be tuned with the same compact
+    (raises ValueError otherwise).
+
+    With compact=True files are written with compact_arrow_schema: money as decimal with cents, timestamps
+    in seconds and labels as dictionaries shared by all files (categoricals in pandas), see athena_ddl_compact.sql.
+    """
+
+    if global_sort and partitioned:
+        raise ValueError('global_sort only works with file per source output (partitioned=False)')
+    dataset = DatasetOptions(target_file_size, row_group_size) if partitioned else None
+    sort = SortOptions(tuple(sort_keys), global_sort, sort_run_rows, spill_folder)
+    layout = _output_layout(dataset, sort, compact)
+    kwargs['profile'] = WriterProfile.for_output_folder(output_folder, compact)
+    kwargs['compact'] = compact
+    manifest = RunManifest(output_folder)
+    # options that change contents of files besides the layout
+    pipeline_options = {name: kwargs[name] for name in ('csv_engine', 'engine') if name in kwargs}
+    pipeline_options['compact'] = compact
+    pending = _outdated_files(paths, manifest, layout, force, pipeline_options)
+    _release_compacted_outputs(pending, manifest, output_folder, pipeline_options)
+    run_metrics = RunMetrics()
+    if jobs > 1:
+        failures = _csv2parquet_parallel(pending, manifest, output_folder, jobs, streaming, dataset, run_metrics,
+                                         sort, **kwargs)
+        _write_metrics(run_metrics, metrics_path, prometheus_path)
+        return failures
+
+    of = len(pending)
+
+    for i, (path, (source_state, pipeline)) in enumerate(pending.items()):
         source_file_name = os.path.basename(path)
-        result_file_name = source_file_name.split('.')[0] + '.parquet'
-        result_file_path = os.path.join(output_folder, result_file_name)
 
         stdout.write(f"{str(i+1).zfill(2)}/{str(of).zfill(2)} - {datetime.now().isoformat(timespec='seconds')} - processing: {source_file_name}\n")
         stdout.flush()
-        df = process_taxi_data_file(path)
-        write_to_parquet(df, result_file_path)
+        file_metrics = FileMetrics(source_file_name)
+        outputs = _convert_file(path, output_folder, streaming, dataset, file_metrics, sort, **kwargs)
+        manifest.record(path, source_state, pipeline, layout, outputs)
+        run_metrics.add(file_metrics)
         stdout.write(f"{str(i + 1).zfill(2)}/{str(of).zfill(2)} - {datetime.now().isoformat(timespec='seconds')} - done.\n")
-        stdout.write(f'___\n')
+        stdout.write('___\n')
         stdout.flush()
 
     stdout.write(f"{datetime.now().isoformat(timespec='seconds')} - finished processing files.\n")
+    _write_metrics(run_metrics, metrics_path, prometheus_path)
+    return {}
+
+
+def _write_metrics(run_metrics: RunMetrics, metrics_path: Optional[str], prometheus_path: Optional[str]) -> None:
+    if metrics_path is not None:
+        run_metrics.write_jsonl(metrics_path)
+    if prometheus_path is not None:
+        run_metrics.write_prometheus(prometheus_path)
+
+
+def _outdated_files(paths: List[str], manifest: RunManifest, layout: str, force: bool,
+                    pipeline_options: Dict[str, Any]) -> Dict[str, Tuple[SourceStateType, str]]:
+    """Returns source state and pipeline fingerprint (see pipeline_fingerprint for options)
+    of files that need to be converted."""
+
+    pending = {}
+    for path in paths:
+        source_state = manifest.source_state(path)
+        pipeline = pipeline_fingerprint(path, **pipeline_options)
+        if not force and manifest.is_current(path, source_state, pipeline, layout):
+            stdout.write(f"{datetime.now().isoformat(timespec='seconds')} - up to date, skipping: {os.path.basename(path)}\n")
+        else:
+            pending[path] = (source_state, pipeline)
+    stdout.flush()
+    return pending
+
+
+def _release_compacted_outputs(pending: Dict[str, Tuple[SourceStateType, str]], manifest: RunManifest,
+                               output_folder: str, pipeline_options: Dict[str, Any]) -> None:
+    """Removes files written by compact_output_folder for sources that are converted again, conversion writes
+    its own file so their rows would be there twice otherwise. Merged files hold rows of several sources,
+    the other sources are added to pending files (and their files are removed too)."""
+
+    pending_paths = {os.path.abspath(path) for path in pending}
+    queue = collections.deque(pending)
+    while queue:
+        path = queue.popleft()
+        entry = manifest.entries.get(os.path.abspath(path))
+        if entry is None or not entry['layout'].startswith('file per source'):
+            continue
+        result_name = os.path.basename(path).split('.')[0]
+        # file of the source itself is replaced by the conversion, files of other layouts by their writers
+        rewritten = {result_name + '.parquet', result_name + '.quality.json'}
+        for output in entry['outputs']:
+            output_path = os.path.join(output_folder, output)
+            if output not in rewritten and os.path.exists(output_path):
+                os.remove(output_path)
+        for other in manifest.sources_sharing_outputs(path):
+            if other not in pending_paths and os.path.exists(other):
+                stdout.write(f"{datetime.now().isoformat(timespec='seconds')} - converting again, it was compacted "
+                             f"with {os.path.basename(path)}: {os.path.basename(other)}\n")
+                pending[other] = (manifest.source_state(other), pipeline_fingerprint(other, **pipeline_options))
+                pending_paths.add(other)
+                queue.append(other)
+    stdout.flush()
+
+
+def _output_layout(dataset: Optional[DatasetOptions], sort: SortOptions = SortOptions(), compact: bool = False) -> str:
+    layout = 'file per source' if dataset is None else repr(dataset)
+    # only options that change contents of files, default order keeps layouts recorded before sorting was configurable
+    if sort.keys != SortOptions().keys or sort.global_order:
+        layout += f', sorted by {list(sort.keys)}' + (' (whole file)' if sort.global_order else '')
+    if compact:
+        layout += ', compact types'
+    return layout
+
+
+def is_compact_layout(layout: str) -> bool:
+    return layout.endswith(', compact types')
+
+
+def _csv2parquet_parallel(pending: Dict[str, Tuple[SourceStateType, str]], manifest: RunManifest, output_folder: str,
+                          jobs: int, streaming: bool, dataset: Optional[DatasetOptions], run_metrics: RunMetrics,
+                          sort: SortOptions, **kwargs) -> Dict[str, str]:
+    of = len(pending)
+    failures = {}
+    layout = _output_layout(dataset, sort, kwargs.get('compact', False))
+    # biggest files first so the pool doesn't end up waiting on one huge file at the end
+    paths = sorted(pending, key=os.path.getsize, reverse=True)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_convert_file_captured, path, output_folder, streaming, dataset, sort, **kwargs): path
+                   for path in paths}
+        for i, future in enumerate(as_completed(futures)):
+            path = futures[future]
+            source_file_name = os.path.basename(path)
+            try:
+                output, error, outputs, file_metrics = future.result()
+            except Exception as e:
+                # worker died (eg. killed by OOM killer) before it could report back
+                output, error = '', ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            if error is None:
+                status = 'done'
+                # only the main process writes the manifest
+                manifest.record(path, *pending[path], layout, outputs)
+                run_metrics.add(file_metrics)
+            else:
+                status = 'FAILED'
+                failures[path] = error
+
+            stdout.write(f"{str(i+1).zfill(2)}/{str(of).zfill(2)} - {datetime.now().isoformat(timespec='seconds')} - {status}: {source_file_name}\n")
+            stdout.write(output)
+            stdout.write('___\n')
+            stdout.flush()
+
+    stdout.write(f"{datetime.now().isoformat(timespec='seconds')} - finished processing files.\n")
+    if failures:
+        stderr.write(f'Failed to process {len(failures)} of {of} files:\n')
+        for path, tb in failures.items():
+            stderr.write(f'{path}\n{tb}\n')
+        stderr.flush()
+    return failures
 
 
-def csv2parquet_green_taxi(taxi_data_basepath: str, output_folder: str) -> None:
-    csv2parquet(green_taxi_paths(taxi_data_basepath), output_folder)
+def _convert_file(path: str, output_folder: str, streaming: bool = False, dataset: Optional[DatasetOptions] = None,
+                  metrics: Optional[FileMetrics] = None, sort: SortOptions = SortOptions(),
+                  profile: Optional[WriterProfile] = None, compact: bool = False, **kwargs) -> List[str]:
+    """Converts single file, returns paths of all files written."""
 
+    source_file_name = os.path.basename(path)
+    result_name = source_file_name.split('.')[0]
+    drop_stats = DropStats(source_file_name)
 
-def csv2parquet_yellow_taxi(taxi_data_basepath: str, output_folder: str) -> None:
-    csv2parquet(yellow_taxi_paths(taxi_data_basepath), output_folder)
+    if dataset is not None:
+        outputs = write_to_dataset(path, output_folder, dataset, streaming, drop_stats=drop_stats, metrics=metrics,
+                                   sort_keys=list(sort.keys), profile=profile, compact=compact, **kwargs)
+        # folders starting with underscore are ignored by Athena and Spark
+        quality_file_path = os.path.join(output_folder, '_quality', result_name + '.quality.json')
+        os.makedirs(os.path.dirname(quality_file_path), exist_ok=True)
+    else:
+        result_file_path = os.path.join(output_folder, result_name + '.parquet')
+        if sort.global_order:
+            sort_to_parquet(path, result_file_path, sort, drop_stats=drop_stats, metrics=metrics, profile=profile,
+                            compact=compact, **kwargs)
+        elif streaming:
+            stream_to_parquet(path, result_file_path, drop_stats=drop_stats, metrics=metrics,
+                              sort_keys=list(sort.keys), profile=profile, compact=compact, **kwargs)
+        else:
+            df = process_taxi_data_file_frame(path, drop_stats=drop_stats, metrics=metrics, sort_keys=list(sort.keys),
+                                        **kwargs)
+            write_to_parquet(df, result_file_path, metrics, profile, compact)
+        outputs = [result_file_path]
+        quality_file_path = os.path.join(output_folder, result_name + '.quality.json')
+    # rows rejected by every cleaning rule
+    drop_stats.write_json(quality_file_path)
+    return outputs + [quality_file_path]
+
+
+def _convert_file_captured(path: str, output_folder: str, streaming: bool, dataset: Optional[DatasetOptions],
+                           sort: SortOptions, **kwargs) -> Tuple[str, Optional[str], List[str], FileMetrics]:
+    """Runs conversion in worker process buffering everything it prints, logs and warns about
+    so it can be shown in one piece. Returns tuple with printed output, traceback (None if conversion succeeded),
+    paths of written files and metrics of the conversion."""
+
+    buffer = io.StringIO()
+    error = None
+    outputs = []
+    metrics = FileMetrics(os.path.basename(path))
+    with redirect_stdout(buffer), redirect_stderr(buffer), _logging_to(buffer):
+        try:
+            outputs = _convert_file(path, output_folder, streaming, dataset, metrics, sort, **kwargs)
+        except Exception:
+            error = traceback.format_exc()
+    return buffer.getvalue(), error, outputs, metrics
+
+
+@contextmanager
+def _logging_to(stream: io.StringIO) -> Iterator[None]:
+    """Handlers of the root logger are replaced by one writing to the stream (with the same format and level)
+    and warnings are written to the stream too. They hold the original stderr so redirecting it doesn't catch them."""
+
+    root_logger = logging.getLogger()
+    handler = logging.StreamHandler(stream)
+    if root_logger.handlers:
+        handler.setFormatter(root_logger.handlers[0].formatter)
+        handler.setLevel(root_logger.handlers[0].level)
+    handlers = root_logger.handlers
+    root_logger.handlers = [handler]
+
+    def show_warning(message, category, filename, lineno, file=None, line=None):
+        stream.write(warnings.formatwarning(message, category, filename, lineno, line))
+
+    try:
+        with warnings.catch_warnings():
+            warnings.showwarning = show_warning
+            yield
+    finally:
+        root_logger.handlers = handlers
+
+
+def csv2parquet_green_taxi(taxi_data_basepath: str, output_folder: str, **kwargs) -> Dict[str, str]:
+    return csv2parquet(green_taxi_paths(taxi_data_basepath), output_folder, **kwargs)
+
+
+def csv2parquet_yellow_taxi(taxi_data_basepath: str, output_folder: str, **kwargs) -> Dict[str, str]:
+    return csv2parquet(yellow_taxi_paths(taxi_data_basepath), output_folder, **kwargs)
 
 
 @timer(logging.INFO)
-def write_to_parquet(data_frame: pd.DataFrame, filepath: str) -> None:
-    # prepare arrow table
-    #   replacing NA with NaN due to current incompatibility of pyarrow with that type
-    table = pa.Table.from_pandas(
-        df=data_frame.fillna(np.nan),
-        schema=arrow_schema,
-        preserve_index=False)
+def write_to_parquet(data_frame: FrameType, filepath: str, metrics: Optional[FileMetrics] = None,
+                     profile: Optional[WriterProfile] = None, compact: bool = False) -> None:
     # write table to parquet file
-    pq.write_table(table=table, where=filepath, flavor='spark')
+    with atomic_output(filepath) as temp_path, measure(metrics, 'write_parquet') as record:
+        record['rows_in'], record['bytes_in'] = frame_rows(data_frame), frame_bytes(data_frame)
+        table = to_arrow_table(data_frame, compact=compact)
+        check_schema(table.schema, compact)
+        pq.write_table(table=table, where=temp_path, flavor='spark', **parquet_options(profile, table.schema))
+
+
+@timer(logging.INFO)
+def stream_to_parquet(source_filepath: str, filepath: str, chunksize: int = 1000000,
+                      metrics: Optional[FileMetrics] = None, pipeline_depth: int = 0,
+                      profile: Optional[WriterProfile] = None, compact: bool = False, **kwargs) -> None:
+    """Processes source file chunk by chunk and appends every chunk to the Parquet file as separate row group.
+
+    With pipeline_depth > 0 reading, processing and writing run in separate threads, so while one chunk is processed
+    the next one is read and the previous one is written. Every stage gets at most pipeline_depth chunks ahead
+    of the next one, errors in any of them are raised here.
+    """
+
+    with atomic_output(filepath) as temp_path:
+        writer = None
+        try:
+            data_frames = _processed_chunks(source_filepath, chunksize, metrics, pipeline_depth, **kwargs)
+            for idx, data_frame in enumerate(data_frames):
+                if frame_rows(data_frame) == 0:
+                    continue
+                with measure(metrics, 'write_parquet', idx) as record:
+                    record['rows_in'], record['bytes_in'] = frame_rows(data_frame), frame_bytes(data_frame)
+                    table = to_arrow_table(data_frame, compact=compact)
+                    if writer is None:
+                        check_schema(table.schema, compact)
+                        # schema taken from the first table so the file keeps pandas metadata like with write_to_parquet
+                        writer = pq.ParquetWriter(temp_path, schema=table.schema, flavor='spark',
+                                                  **parquet_options(profile, table.schema))
+                    writer.write_table(table)
+            if writer is None:
+                schema = compact_arrow_schema if compact else arrow_schema
+                writer = pq.ParquetWriter(temp_path, schema=schema, flavor='spark', **timestamp_options(schema))
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+@timer(logging.INFO)
+def sort_to_parquet(source_filepath: str, filepath: str, sort: SortOptions = SortOptions(global_order=True),
+                    chunksize: int = 1000000, metrics: Optional[FileMetrics] = None, pipeline_depth: int = 0,
+                    row_group_size: int = default_row_group_size, profile: Optional[WriterProfile] = None,
+                    compact: bool = False, **kwargs) -> None:
+    """Processes source file chunk by chunk and writes it to the Parquet file sorted as a whole by sort.keys
+    (external merge sort, see ExternalSorter). Chunks themselves aren't sorted, that would be wasted work."""
+
+    with atomic_output(filepath) as temp_path, \
+            ExternalSorter(list(sort.keys), sort.run_rows, sort.spill_folder) as sorter:
+        data_frames = _processed_chunks(source_filepath, chunksize, metrics, pipeline_depth, sort_keys=[], **kwargs)
+        for idx, data_frame in enumerate(data_frames):
+            if frame_rows(data_frame) == 0:
+                continue
+            with measure(metrics, 'sort_runs', idx) as record:
+                record['rows_in'], record['bytes_in'] = frame_rows(data_frame), frame_bytes(data_frame)
+                # compact types are applied after merging, Arrow can't sort dictionary columns
+                sorter.add(to_arrow_table(data_frame))
+
+        writer = None
+        try:
+            with measure(metrics, 'merge_runs') as record:
+                for table in row_groups(sorter.sorted_tables(), row_group_size):
+                    if compact:
+                        table = to_compact_table(table)
+                    if writer is None:
+                        check_schema(table.schema, compact)
+                        # schema taken from the first table so the file keeps pandas metadata like with write_to_parquet
+                        writer = pq.ParquetWriter(temp_path, schema=table.schema, flavor='spark',
+                                                  **parquet_options(profile, table.schema))
+                    writer.write_table(table, row_group_size=row_group_size)
+                    record['rows_out'] = record.get('rows_out', 0) + table.num_rows
+            if writer is None:
+                schema = compact_arrow_schema if compact else arrow_schema
+                writer = pq.ParquetWriter(temp_path, schema=schema, flavor='spark', **timestamp_options(schema))
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def tune_writer_profile(source_filepath: str, output_folder: str, sample_rows: int = 1000000,
+                        max_write_slowdown: float = 3.0, max_read_slowdown: float = 1.5, compact: bool = False,
+                        **kwargs) -> WriterProfile:
+    """Processes first sample_rows rows of the source file, tunes writer settings of every column on them
+    (see tune_columns), prints the report and saves the profile in the output folder,
+    where csv2parquet picks it up for every following conversion. Compact=True tunes columns of compact_arrow_schema.
+    Other keyword arguments are passed to process_taxi_data_file_chunks (eg. csv_engine='arrow')."""
+
+    chunks = process_taxi_data_file_chunks(source_filepath, sample_rows, **kwargs)
+    sample = to_arrow_table(next(chunks), compact=compact)
+    chunks.close()
+
+    profile, results = tune_columns(sample, max_write_slowdown, max_read_slowdown, compact=compact)
+    sys.stdout.write(format_report(profile, results))
+    sys.stdout.flush()
+    profile.save(os.path.join(output_folder, writer_profile_file_name))
+    return profile
+
+
+def _processed_chunks(source_filepath: str, chunksize: int, metrics: Optional[FileMetrics], pipeline_depth: int,
+                      **kwargs) -> Iterable[FrameType]:
+    data_frames = process_taxi_data_file_chunks(source_filepath, chunksize, metrics=metrics,
+                                                pipeline_depth=pipeline_depth, **kwargs)
+    if pipeline_depth:
+        data_frames = prefetch(data_frames, pipeline_depth, f'process {os.path.basename(source_filepath)}')
+    return data_frames
+
+
+@timer(logging.INFO)
+def write_to_dataset(source_filepath: str, output_folder: str, dataset: DatasetOptions = DatasetOptions(),
+                     streaming: bool = False, chunksize: int = 1000000, metrics: Optional[FileMetrics] = None,
+                     pipeline_depth: int = 0, profile: Optional[WriterProfile] = None, compact: bool = False,
+                     **kwargs) -> List[str]:
+    """Processes source file and writes it to the Hive partitioned dataset in the output folder.
+
+    Files are named after the source file so converting it again replaces its previous files.
+    Returns paths of written files. Pipeline_depth works like in stream_to_parquet.
+    """
+
+    result_name = os.path.basename(source_filepath).split('.')[0]
+    if streaming:
+        data_frames = _processed_chunks(source_filepath, chunksize, metrics, pipeline_depth, **kwargs)
+    else:
+        data_frames = [process_taxi_data_file_frame(source_filepath, chunksize, metrics=metrics,
+                                              pipeline_depth=pipeline_depth, **kwargs)]
+    return write_partitioned(data_frames, output_folder, result_name, dataset, metrics, profile, compact)
 
 
 if __name__ == '__main__':
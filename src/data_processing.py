@@ -1,19 +1,41 @@
+import collections
 import datetime
+import functools
+import io
+import hashlib
+import inspect
 import logging
 import time
 import os
-from sys import stdout
-from typing import Iterable, Tuple
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Tuple, Optional, Callable, List, Union, Dict, Any, BinaryIO
 
+import numpy as np
 import pandas as pd
-
-from data_cleaning import rename_columns, drop_invalid_coordinates, drop_invalid_timestamps, \
-    drop_negative_values, standardize_snf_flag_values, standardize_payment_type_values, \
-    replace_tip_values_for_cash_payments, drop_invalid_trip_durations, drop_invalid_year_values, \
-    drop_missing_location_ids, add_trip_duration, add_year, add_additional_date_features, \
-    standardize_trip_type_values, drop_invalid_passenger_count_values, sort_df
-from helper_objects import yellow_taxi_params, ParameterType, green_taxi_params, lookup_csv_path, \
-    lookup_shp_path, timer, print_sanity_stats
+import pyarrow as pa
+
+import arrow_csv
+import arrow_processing
+import byte_ranges
+import compact_schema
+import data_cleaning
+import timestamp_parser
+import zone_index
+from arrow_csv import arrow_csv_chunks, arrow_csv_tables, csv_table_to_pandas
+from byte_ranges import default_range_size, is_splittable, header_line, split_lines, read_range, RangeType
+from data_cleaning import rename_columns, standardize_snf_flag_values, standardize_payment_type_values, \
+    replace_tip_values_for_cash_payments, add_trip_duration, add_year, add_additional_date_features, \
+    standardize_trip_type_values, sort_df, filter_rows, rules_for_location, row_rules, coordinate_columns, \
+    convert_passenger_count_type, default_sort_keys
+from helper_objects import yellow_taxi_params, ParameterType, green_taxi_params, timer, print_sanity_stats, \
+    DropStats, arrow_schema, column_name_mapping_dict, lookup_csv_path
+from metrics import FileMetrics, Measurement, FrameType, frame_rows
+from parse_cache import cached_csv_tables
+from pipelining import prefetch, chunks_in_flight
+from timestamp_parser import parse_timestamps
+from zone_index import locate_points, shapefile_fingerprint
+from zone_registry import get_zone_registry
 
 
 def _get_yellow_taxi_params(filename: str) -> ParameterType:
@@ -43,60 +65,298 @@ def get_taxi_params(filename: str) -> Tuple[str, ParameterType]:
     return company_name, params
 
 
-def process_taxi_data(df: pd.DataFrame, params: ParameterType, company: str) -> pd.DataFrame:
-    """Applies cleaning rules and feature engineering on the provided DataFrame."""
-
-    df = rename_columns(df)
-    df = join_location_data(df, params['location'])
-    df = drop_invalid_timestamps(df)
-    df = drop_negative_values(df)
-    df = drop_invalid_passenger_count_values(df)
-    df = standardize_snf_flag_values(df)
-    df = standardize_payment_type_values(df)
-    df = replace_tip_values_for_cash_payments(df)
-    df = add_trip_duration(df)
-    df = drop_invalid_trip_durations(df)
-    df = add_year(df)
-    df = drop_invalid_year_values(df)
-    df = add_additional_date_features(df)
-    df = standardize_trip_type_values(df)
-
-    # assign company name
-    df['company'] = company
+# bump when output changes for reasons that pipeline_fingerprint can't see (eg. changed zone_registry.py)
+pipeline_version = 1
 
-    # sorting so later on when we save to parquet we get better compression
-    df = sort_df(df)
 
+def pipeline_fingerprint(filepath: str, csv_engine: str = 'pandas', engine: str = 'pandas',
+                         compact: bool = False) -> str:
+    """Hash of everything that determines output for the file: parameters of its era, reading, cleaning
+    and processing code, output schema, lookup data, versions of pandas, numpy and pyarrow and options
+    the file is converted with (csv_engine and engine of process_taxi_data_file_chunks, compact of csv2parquet).
+    Rules and location join that don't apply to the file are left out so changing them doesn't affect
+    fingerprints of files from other eras."""
+
+    filename = os.path.basename(filepath).split('.')[0]
+    company_name, params = get_taxi_params(filename)
+    location = params['location']
+    used_rules = rules_for_location(location)
+    unused_functions = [rule.predicate for rule in row_rules.values() if rule not in used_rules]
+    modules = [data_cleaning, arrow_processing, arrow_csv, byte_ranges, timestamp_parser, compact_schema,
+               sys.modules[__name__]]
+    if location == 'id':
+        unused_functions.append(_join_location_data_by_coordinates)
+        zones_fingerprint = None
+    else:
+        unused_functions.append(_join_location_data_by_id)
+        modules.append(zone_index)
+        zones_fingerprint = shapefile_fingerprint()
+
+    sha = hashlib.sha1()
+    for module in modules:
+        source = inspect.getsource(module)
+        for function in unused_functions:
+            source = source.replace(inspect.getsource(function), '')
+        sha.update(source.encode())
+    with open(lookup_csv_path, 'rb') as f:
+        sha.update(f.read())
+    for part in [pipeline_version, company_name, params, [rule.name for rule in used_rules], arrow_schema,
+                 column_name_mapping_dict, zones_fingerprint, pd.__version__, np.__version__, pa.__version__,
+                 csv_engine, engine, compact]:
+        sha.update(repr(part).encode())
+    return sha.hexdigest()
+
+
+def process_taxi_data(df: FrameType, params: ParameterType, company: str,
+                      drop_stats: Optional[DropStats] = None, metrics: Optional[FileMetrics] = None,
+                      chunk: Optional[int] = None, sort_keys: List[str] = default_sort_keys,
+                      engine: str = 'pandas') -> FrameType:
+    """Applies cleaning rules and feature engineering on the provided DataFrame.
+    Numbers of rows rejected by each rule are added to drop_stats (if given),
+    every stage is measured into metrics (if given) as the given chunk.
+    Rows are sorted by sort_keys, empty list skips sorting (eg. when whole file is sorted later).
+    With engine='arrow' df is Arrow table processed with pyarrow.compute (see arrow_processing)
+    and the result is Arrow table too, arrow_processing.to_pandas converts it to the DataFrame
+    the pandas engine gives."""
+
+    for name, stage in processing_stages(params, company, drop_stats, sort_keys, engine):
+        df = stage(df) if metrics is None else metrics.apply(name, chunk, stage, df)
+    return df
+
+
+StageType = Callable[[FrameType], FrameType]
+
+
+def processing_stages(params: ParameterType, company: str,
+                      drop_stats: Optional[DropStats] = None,
+                      sort_keys: List[str] = default_sort_keys, engine: str = 'pandas') -> List[Tuple[str, StageType]]:
+    """Named steps of process_taxi_data in the order they're applied (benchmarks time them one by one)."""
+
+    if engine == 'arrow':
+        return arrow_processing.processing_stages(params, company, drop_stats, sort_keys)
+    elif engine != 'pandas':
+        raise ValueError(f'Unknown processing engine: {engine!r}')
+    location = params['location']
+    stages = [
+        ('rename_columns', rename_columns),
+        ('add_location_data', functools.partial(add_location_data, join_by=location)),
+        ('add_trip_duration', add_trip_duration),
+        # all the rules are evaluated together so rows are filtered (and copied) once
+        ('filter_rows', functools.partial(filter_rows, rules=rules_for_location(location),
+                                          drop_columns=coordinate_columns, drop_stats=drop_stats)),
+        ('convert_location_id_types', functools.partial(_convert_location_id_types, new_type='int16')),
+        ('convert_passenger_count_type', convert_passenger_count_type),
+        ('standardize_snf_flag_values', standardize_snf_flag_values),
+        ('standardize_payment_type_values', standardize_payment_type_values),
+        ('replace_tip_values_for_cash_payments', replace_tip_values_for_cash_payments),
+        ('add_year', add_year),
+        ('add_additional_date_features', add_additional_date_features),
+        ('standardize_trip_type_values', standardize_trip_type_values),
+        ('add_company', functools.partial(_add_company, company=company)),
+    ]
+    if sort_keys:
+        # sorting so later on when we save to parquet we get better compression
+        stages.append(('sort_df', functools.partial(sort_df, sort_keys=sort_keys)))
+    return stages
+
+
+def _add_company(df: pd.DataFrame, company: str) -> pd.DataFrame:
+    df['company'] = company
     return df
 
 
 @timer(logging.INFO)
-def process_taxi_data_file(filepath: str, chunksize: int = 1000000, **kwargs) -> pd.DataFrame:
+def process_taxi_data_file(filepath: str, chunksize: int = 1000000, drop_stats: Optional[DropStats] = None,
+                           metrics: Optional[FileMetrics] = None, **kwargs) -> pd.DataFrame:
     """Reads file and applies cleaning rules and feature engineering."""
 
+    data_frame = process_taxi_data_file_frame(filepath, chunksize, drop_stats, metrics, **kwargs)
+    return arrow_processing.to_pandas(data_frame) if isinstance(data_frame, pa.Table) else data_frame
+
+
+def process_taxi_data_file_frame(filepath: str, chunksize: int = 1000000, drop_stats: Optional[DropStats] = None,
+                                 metrics: Optional[FileMetrics] = None, **kwargs) -> FrameType:
+    """Same as process_taxi_data_file but with engine='arrow' returns Arrow table instead of converting it
+    to DataFrame (eg. for writing it to Parquet)."""
+
+    chunks = list(process_taxi_data_file_chunks(filepath, chunksize, drop_stats, metrics, **kwargs))
+    if chunks and isinstance(chunks[0], pa.Table):
+        return pa.concat_tables(chunks)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def process_taxi_data_file_chunks(filepath: str, chunksize: int = 1000000, drop_stats: Optional[DropStats] = None,
+                                  metrics: Optional[FileMetrics] = None, memory_budget: Optional[int] = None,
+                                  pipeline_depth: int = 0, sort_keys: List[str] = default_sort_keys,
+                                  engine: str = 'pandas', range_jobs: int = 1, range_size: int = default_range_size,
+                                  parse_cache: Optional[str] = None, **kwargs) -> Iterator[FrameType]:
+    """Reads file and yields chunks with cleaning rules and feature engineering applied.
+    Only one chunk is held in memory at a time. Sanity stats are printed once all chunks were consumed,
+    per rule counts of rejected rows are gathered in drop_stats (new one is created if not given).
+    If metrics are given reading of every chunk and every stage of processing it is measured into them.
+
+    With memory_budget (bytes) chunksize is only the upper limit of the first chunk, memory used for reading
+    and processing it is measured and the following chunks are sized so that reading and processing
+    of a chunk stays under the budget (see ChunkSizer).
+
+    With pipeline_depth > 0 chunks are read and parsed in a background thread up to pipeline_depth chunks ahead
+    of processing. Memory budget is then shared by all chunks that can be in flight when writing is pipelined too
+    (see pipelining.chunks_in_flight).
+
+    With engine='arrow' file is read with pyarrow's CSV reader (csv_engine is ignored) and chunks are processed
+    as Arrow tables with pyarrow.compute kernels, yielded chunks are Arrow tables too.
+
+    With range_jobs > 1 uncompressed file is split into ranges of about range_size bytes that end at line breaks,
+    they're read and processed (in chunks of at most chunksize rows) by a pool of range_jobs worker processes
+    and chunks are yielded in the order of the file, so one huge file can use every core. At most
+    ranges_in_flight(range_jobs) ranges are processed or waiting to be yielded at once, memory_budget
+    and pipeline_depth don't apply then. Compressed files are read sequentially.
+
+    With parse_cache (folder) parsed columns of the file are cached there as Arrow IPC file (see parse_cache)
+    and memory mapped by the next run instead of parsing the CSV again, as long as the file and its csv_params
+    didn't change. It's parsed with pyarrow's CSV reader (csv_engine is ignored) and read sequentially.
+    """
+
     initial_number_of_rows = 0
+    final_number_of_rows = 0
     start_time = time.perf_counter()
     filename = os.path.basename(filepath).split('.')[0]
     company_name, params = get_taxi_params(filename)
+    if drop_stats is None:
+        drop_stats = DropStats(filepath)
 
-    data_frames = []
-    for idx, chunk in enumerate(_csv_chunks(filepath, chunksize, **params['csv_params'], **kwargs)):
-        stdout.write(f'File: {filename!r} - processing chunk: {idx + 1}\n')
-        initial_number_of_rows += len(chunk.index)
-        data_frames.append(process_taxi_data(chunk, params=params, company=company_name))
-
-    df = pd.concat(data_frames, ignore_index=True)
+    if range_jobs > 1 and is_splittable(filepath) and parse_cache is None:
+        processed_chunks = _process_byte_ranges(filepath, company_name, params, chunksize, drop_stats, metrics,
+                                                range_jobs, range_size, sort_keys, engine, **kwargs)
+    else:
+        processed_chunks = _process_chunks(filepath, company_name, params, chunksize, drop_stats, metrics,
+                                           memory_budget, pipeline_depth, sort_keys, engine, parse_cache, **kwargs)
+    for rows_read, processed_chunk in processed_chunks:
+        initial_number_of_rows += rows_read
+        final_number_of_rows += frame_rows(processed_chunk)
+        yield processed_chunk
 
     end_time = time.perf_counter()
     run_time = datetime.timedelta(seconds=(end_time - start_time))
-    stdout.write(f'___\nProcessing DataFrame from file {filename!r} took {run_time}.\n')
-    stdout.flush()
+    sys.stdout.write(f'___\nProcessing DataFrame from file {filename!r} took {run_time}.\n')
+    sys.stdout.flush()
 
     # info about processed DataFrame for sanity check
-    final_number_of_rows = len(df.index)
-    print_sanity_stats(initial_number_of_rows, final_number_of_rows)
+    drop_stats.rows_read += initial_number_of_rows
+    drop_stats.rows_written += final_number_of_rows
+    print_sanity_stats(initial_number_of_rows, final_number_of_rows, drop_stats)
 
-    return df
+
+def _process_chunks(filepath: str, company_name: str, params: ParameterType, chunksize: int, drop_stats: DropStats,
+                    metrics: Optional[FileMetrics], memory_budget: Optional[int], pipeline_depth: int,
+                    sort_keys: List[str], engine: str, parse_cache: Optional[str],
+                    **kwargs) -> Iterator[Tuple[int, FrameType]]:
+    """Reads file chunk by chunk in this process, yields number of rows read and processed chunk."""
+
+    filename = os.path.basename(filepath).split('.')[0]
+    sizer = None
+    if memory_budget is not None:
+        sizer = ChunkSizer(memory_budget // chunks_in_flight(pipeline_depth) if pipeline_depth else memory_budget,
+                           chunksize, filename, params['location'])
+    if parse_cache is not None:
+        chunks = cached_csv_tables(filepath, parse_cache, chunksize if sizer is None else sizer,
+                                   **params['csv_params'])
+        if engine != 'arrow':
+            chunks = map(csv_table_to_pandas, chunks)
+    elif engine == 'arrow':
+        chunks = arrow_csv_tables(filepath, chunksize if sizer is None else sizer, **params['csv_params'], **kwargs)
+    else:
+        chunks = _csv_chunks(filepath, chunksize if sizer is None else sizer, **params['csv_params'], **kwargs)
+    if metrics is not None:
+        chunks = metrics.measured_iter('read_csv', chunks)
+    if pipeline_depth:
+        chunks = prefetch(chunks, pipeline_depth, f'read {filename}')
+    for idx, chunk in enumerate(chunks):
+        sys.stdout.write(f'File: {filename!r} - processing chunk: {idx + 1}\n')
+        processed_chunk = process_taxi_data(chunk, params=params, company=company_name, drop_stats=drop_stats,
+                                            metrics=metrics, chunk=idx, sort_keys=sort_keys, engine=engine)
+        if sizer is not None:
+            sizer.chunk_processed(chunk, processed_chunk)
+        yield frame_rows(chunk), processed_chunk
+
+
+def ranges_in_flight(range_jobs: int) -> int:
+    """Most byte ranges held in memory at once: one in every worker and as many finished ones waiting their turn."""
+
+    return 2 * range_jobs
+
+
+def _process_byte_ranges(filepath: str, company_name: str, params: ParameterType, chunksize: int,
+                         drop_stats: DropStats, metrics: Optional[FileMetrics], range_jobs: int, range_size: int,
+                         sort_keys: List[str], engine: str, **kwargs) -> Iterator[Tuple[int, FrameType]]:
+    """Processes byte ranges of the file in worker processes, yields number of rows read and processed chunk
+    in the order of the file. Rule counts and measurements of the workers are added to drop_stats and metrics."""
+
+    filename = os.path.basename(filepath).split('.')[0]
+    csv_params, data_start = _byte_range_csv_params(filepath, params['csv_params'])
+    ranges = split_lines(filepath, range_size, data_start)
+    source_file = metrics.source_file if metrics is not None else None
+    chunk_offset = 0
+    with ProcessPoolExecutor(max_workers=range_jobs) as executor:
+        pending = collections.deque()
+        try:
+            for idx in range(len(ranges)):
+                # ranges are submitted ahead so workers don't wait for the consumer, but not too far ahead
+                while len(pending) < ranges_in_flight(range_jobs) and idx + len(pending) < len(ranges):
+                    pending.append(executor.submit(_process_byte_range, filepath, ranges[idx + len(pending)],
+                                                   csv_params, company_name, params, chunksize, sort_keys, engine,
+                                                   source_file, kwargs))
+                chunks, range_drop_stats, range_metrics = pending.popleft().result()
+                drop_stats.merge(range_drop_stats)
+                if metrics is not None:
+                    metrics.merge(range_metrics, chunk_offset)
+                sys.stdout.write(f'File: {filename!r} - processed byte range: {idx + 1}/{len(ranges)}\n')
+                chunk_offset += len(chunks)
+                yield from chunks
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _byte_range_csv_params(filepath: str, csv_params: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """Parameters that parse a byte range of the file (no header line in it) into the same columns
+    as csv_params parse the whole file and offset where data starts (after the header line if there's one)."""
+
+    names = csv_params.get('names')
+    line, data_start = header_line(filepath)
+    if names is None:
+        names = line.split(',')
+        if csv_params.get('skipinitialspace', False):
+            names = [name.lstrip() for name in names]
+    elif csv_params.get('header', 'infer') in ('infer', None):
+        # names without header=0 mean the first line is data
+        data_start = 0
+    return {**csv_params, 'names': names, 'header': None}, data_start
+
+
+def _process_byte_range(filepath: str, byte_range: RangeType, csv_params: Dict[str, Any], company_name: str,
+                        params: ParameterType, chunksize: int, sort_keys: List[str], engine: str,
+                        source_file: Optional[str],
+                        kwargs: Dict[str, Any]) -> Tuple[List[Tuple[int, FrameType]], DropStats,
+                                                         Optional[FileMetrics]]:
+    """Runs in worker process: reads and processes the byte range in chunks. Returns numbers of rows read
+    with processed chunks, rule counts and measurements (if source_file is given)."""
+
+    drop_stats = DropStats()
+    metrics = FileMetrics(source_file) if source_file is not None else None
+    source = io.BytesIO(read_range(filepath, byte_range))
+    if engine == 'arrow':
+        chunks = arrow_csv_tables(source, chunksize, **csv_params, **kwargs)
+    else:
+        chunks = _csv_chunks(source, chunksize, **csv_params, **kwargs)
+    if metrics is not None:
+        chunks = metrics.measured_iter('read_csv', chunks)
+    processed_chunks = []
+    for idx, chunk in enumerate(chunks):
+        processed_chunk = process_taxi_data(chunk, params=params, company=company_name, drop_stats=drop_stats,
+                                            metrics=metrics, chunk=idx, sort_keys=sort_keys, engine=engine)
+        processed_chunks.append((frame_rows(chunk), processed_chunk))
+    return processed_chunks, drop_stats, metrics
 
 
 @timer(logging.DEBUG)
@@ -104,22 +364,134 @@ def _read_csv(filepath: str, **kwargs) -> pd.DataFrame:
     return pd.read_csv(filepath, **kwargs)
 
 
-def _csv_chunks(filepath: str, chunksize: int = 1000000, **kwargs) -> Iterable[pd.DataFrame]:
-    return pd.read_csv(filepath, chunksize=chunksize, **kwargs)
+ChunkSizeType = Union[int, Callable[[], int]]
+timestamp_bytes_dtype = 'S64'
+
+
+def _csv_chunks(filepath: Union[str, BinaryIO], chunksize: ChunkSizeType = 1000000, csv_engine: str = 'pandas',
+                **kwargs) -> Iterable[pd.DataFrame]:
+    """Chunks of CSV file, chunksize can be a function that's called before reading every chunk.
+
+    pandas reader reads parse_dates columns as bytes and converts them with parse_timestamps,
+    it's faster than parse_dates for the fixed format that TLC files use.
+    """
+
+    if csv_engine == 'pandas':
+        timestamp_columns = kwargs.pop('parse_dates', None) or []
+        kwargs.pop('infer_datetime_format', None)
+        if timestamp_columns:
+            # fixed width bytes instead of str objects (longer values are cut, no timestamp is that long)
+            kwargs['dtype'] = {**(kwargs.get('dtype') or {}),
+                               **{name: timestamp_bytes_dtype for name in timestamp_columns}}
+        if callable(chunksize):
+            chunks = _pandas_sized_chunks(filepath, chunksize, **kwargs)
+        else:
+            chunks = pd.read_csv(filepath, chunksize=chunksize, **kwargs)
+        return _with_parsed_timestamps(chunks, timestamp_columns) if timestamp_columns else chunks
+    elif csv_engine == 'arrow':
+        return arrow_csv_chunks(filepath, chunksize, **kwargs)
+    raise ValueError(f'Unknown CSV engine: {csv_engine!r}')
+
+
+def _pandas_sized_chunks(filepath: str, chunksize: Callable[[], int], **kwargs) -> Iterator[pd.DataFrame]:
+    reader = pd.read_csv(filepath, chunksize=chunksize(), **kwargs)
+    try:
+        while True:
+            try:
+                chunk = reader.get_chunk(chunksize())
+            except StopIteration:
+                return
+            yield chunk
+    finally:
+        reader.close()
+
+
+def _with_parsed_timestamps(chunks: Iterable[pd.DataFrame], columns: List[str]) -> Iterator[pd.DataFrame]:
+    try:
+        for chunk in chunks:
+            for name in columns:
+                chunk[name] = parse_timestamps(chunk[name])
+            yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+# the first chunk is read with at most this many rows when chunks are sized under memory budget
+probe_chunk_rows = 100000
+min_chunk_rows = 10000
+
+
+class ChunkSizer:
+    """Chunk size that keeps memory used for reading and processing a chunk under the budget.
+
+    CSV reader calls it before reading every chunk. Growth of RSS from that moment until the first chunk
+    was processed (so including the spatial join) is divided by number of rows of the chunk,
+    the following chunks get as many rows as fit in the budget at that footprint per row.
+    RSS may not grow when memory freed by previous chunks or files is reused, so footprint per row is never taken
+    lower than size of the raw and processed chunk together (both are held while the chunk is processed).
+    Memory held by the consumer (eg. concatenated result in process_taxi_data_file) isn't part of the budget.
+    Lookup data that the join by join_by needs is loaded before the measurement starts, otherwise loading it
+    (shapefile, raster index) would be counted as footprint of every row of the first chunk.
+    """
+
+    def __init__(self, memory_budget: int, max_first_chunk_rows: int = probe_chunk_rows, name: str = '',
+                 join_by: Optional[str] = None):
+        self.memory_budget = memory_budget
+        self.rows = min(max_first_chunk_rows, probe_chunk_rows)
+        self.bytes_per_row: Optional[float] = None
+        self.name = name
+        self.join_by = join_by
+        self._measurement: Optional[Measurement] = None
+
+    def __call__(self) -> int:
+        if self.bytes_per_row is None and self._measurement is None:
+            if self.join_by is not None:
+                get_zone_registry().load(self.join_by)
+            self._measurement = Measurement()
+            self._measurement.start()
+        return self.rows
+
+    def chunk_processed(self, chunk: FrameType, processed_chunk: FrameType) -> None:
+        if self._measurement is None or frame_rows(chunk) == 0:
+            return
+        self._measurement.stop()
+        frames_size = _deep_size(chunk) + _deep_size(processed_chunk)
+        footprint = max(self._measurement.peak_memory_delta or 0, frames_size)
+        self.bytes_per_row = footprint / frame_rows(chunk)
+        self.rows = max(min_chunk_rows, int(self.memory_budget / self.bytes_per_row))
+        self._measurement = None
+        logging.info(f'File: {self.name!r} - {self.bytes_per_row:.0f} bytes per row, '
+                     f'reading chunks of {self.rows:_d} rows to stay under {self.memory_budget:_d} bytes.')
+
+
+def _deep_size(data_frame: FrameType) -> int:
+    return data_frame.nbytes if isinstance(data_frame, pa.Table) else data_frame.memory_usage(deep=True).sum()
 
 
 def join_location_data(data_frame: pd.DataFrame, join_by: str, drop_missing: bool = True) -> pd.DataFrame:
+    data_frame = add_location_data(data_frame, join_by)
+    rules = [row_rules['invalid_coordinates']] if join_by == 'coordinates' else []
+    if drop_missing:
+        rules.append(row_rules['missing_location_ids'])
+    data_frame = filter_rows(data_frame, rules, drop_columns=coordinate_columns)
+    return _convert_location_id_types(data_frame, 'int16' if drop_missing else 'Int16')
+
+
+def add_location_data(data_frame: pd.DataFrame, join_by: str) -> pd.DataFrame:
+    """Adds borough, zone and location id (if joining by coordinates) of pickup and dropoff to every row.
+    Nothing is removed, rows without location get nulls."""
+
     data_frame = data_frame.reset_index(drop=True)
     if join_by == 'id':
         data_frame = _join_location_data_by_id(data_frame)
     elif join_by == 'coordinates':
-        data_frame = drop_invalid_coordinates(data_frame)
         data_frame = _join_location_data_by_coordinates(data_frame)
-    if drop_missing:
-        data_frame = drop_missing_location_ids(data_frame)
-        new_type = 'int16'
-    else:
-        new_type = 'Int16'
+    return data_frame
+
+
+def _convert_location_id_types(data_frame: pd.DataFrame, new_type: str) -> pd.DataFrame:
     data_frame['pickup_location_id'] = data_frame['pickup_location_id'].astype(new_type)
     data_frame['dropoff_location_id'] = data_frame['dropoff_location_id'].astype(new_type)
     return data_frame
@@ -127,63 +499,38 @@ def join_location_data(data_frame: pd.DataFrame, join_by: str, drop_missing: boo
 
 @timer(logging.DEBUG)
 def _join_location_data_by_id(data_frame: pd.DataFrame) -> pd.DataFrame:
-    """Merge information about location to DataFrame using locations' ids."""
-
-    ldf = pd.read_csv(lookup_csv_path, index_col='LocationID',
-                      usecols=['LocationID', 'Borough', 'Zone'])
-    pickup_column_names = {'Borough': 'pickup_borough', 'Zone': 'pickup_zone', 'LocationID': 'pickup_location_id'}
-    dropoff_column_names = {'Borough': 'dropoff_borough', 'Zone': 'dropoff_zone', 'LocationID': 'dropoff_location_id'}
-
-    data_frame = data_frame.merge(
-        ldf.rename(columns=pickup_column_names),
-        how='left',
-        left_on='pickup_location_id', right_index=True)
-    data_frame = data_frame.merge(
-        ldf.rename(columns=dropoff_column_names),
-        how='left',
-        left_on='dropoff_location_id', right_index=True)
+    """Add information about location to DataFrame using locations' ids."""
+
+    zone_attributes = get_zone_registry().zone_attributes
+    for prefix in ('pickup', 'dropoff'):
+        location_ids = data_frame[f'{prefix}_location_id'].values
+        data_frame[f'{prefix}_borough'] = zone_attributes.boroughs(location_ids)
+        data_frame[f'{prefix}_zone'] = zone_attributes.zones(location_ids)
     return data_frame
 
 
 @timer(logging.DEBUG)
 def _join_location_data_by_coordinates(data_frame: pd.DataFrame) -> pd.DataFrame:
-    """Merge information about location to DataFrame using coordinates."""
-
-    import geopandas as gpd
-
-    gdf = gpd.read_file(lookup_shp_path)
-    gdf.drop(columns=['OBJECTID', 'Shape_Leng', 'Shape_Area'], inplace=True)
-    gdf.to_crs('EPSG:4326', inplace=True)  # reproject to common Coordinate Reference System
-    pickup_column_names = {'borough': 'pickup_borough', 'zone': 'pickup_zone', 'LocationID': 'pickup_location_id'}
-    dropoff_column_names = {'borough': 'dropoff_borough', 'zone': 'dropoff_zone', 'LocationID': 'dropoff_location_id'}
-
-    temp_pickup_gdf = gpd.GeoDataFrame(
-        geometry=gpd.points_from_xy(
-            x=data_frame['pickup_longitude'],
-            y=data_frame['pickup_latitude']),
-        crs='EPSG:4326')
-    temp_dropoff_gdf = gpd.GeoDataFrame(
-        geometry=gpd.points_from_xy(
-            x=data_frame['dropoff_longitude'],
-            y=data_frame['dropoff_latitude']),
-        crs='EPSG:4326')
-    temp_pickup_gdf = gpd.sjoin(
-        left_df=temp_pickup_gdf,
-        right_df=gdf,
-        how='left', op='within')[['borough', 'zone', 'LocationID']]
-    temp_dropoff_gdf = gpd.sjoin(
-        left_df=temp_dropoff_gdf,
-        right_df=gdf,
-        how='left', op='within')[['borough', 'zone', 'LocationID']]
-    data_frame = data_frame.merge(
-        temp_pickup_gdf.rename(columns=pickup_column_names),
-        how='left',
-        left_index=True, right_index=True)
-    data_frame = data_frame.merge(
-        temp_dropoff_gdf.rename(columns=dropoff_column_names),
-        how='left',
-        left_index=True, right_index=True)
-    return data_frame.drop(columns=[name for name in data_frame.columns if 'longitude' in name or 'latitude' in name])
+    """Add information about location to DataFrame using coordinates."""
+
+    registry = get_zone_registry()
+    zone_location_ids = registry.zones_gdf['LocationID'].values
+    data_frame = data_frame.reset_index(drop=True)
+
+    for prefix in ('pickup', 'dropoff'):
+        points, zones = locate_points(
+            registry.zones_gdf, registry.zone_index,
+            x=data_frame[f'{prefix}_longitude'].values,
+            y=data_frame[f'{prefix}_latitude'].values)
+        if len(points) != len(data_frame.index):
+            # some points are in area where zones overlap, row is repeated for every zone (like with sjoin)
+            data_frame = data_frame.take(points).reset_index(drop=True)
+        location_ids = np.where(zones >= 0, zone_location_ids[zones], np.nan)
+        data_frame[f'{prefix}_borough'] = registry.zone_attributes.boroughs(location_ids)
+        data_frame[f'{prefix}_zone'] = registry.zone_attributes.zones(location_ids)
+        data_frame[f'{prefix}_location_id'] = location_ids
+
+    return data_frame
 
 
 if __name__ == '__main__':
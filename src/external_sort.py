@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+from typing import List, Optional, Iterable, Iterator, Tuple, Any
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+default_run_rows = 5000000  # rows sorted in memory before they're spilled to disk as a run
+merge_batch_rows = 65536  # rows per record batch in run files, every run has one batch in memory while merging
+
+
+class ExternalSorter:
+    """Sorts more rows than fit in memory: tables are buffered until run_rows rows, sorted and spilled
+    to Arrow IPC files (runs) in a temporary folder, runs are then merged batch by batch.
+
+    Memory use is bounded by run_rows while adding and by number of runs times merge_batch_rows while merging.
+    If everything fits in one run nothing is written to disk. Nulls are sorted after all other values.
+    Use as context manager so the temporary folder is removed even if merging is interrupted.
+    """
+
+    def __init__(self, sort_keys: List[str], run_rows: int = default_run_rows, spill_folder: Optional[str] = None):
+        self.sort_keys = sort_keys
+        self.run_rows = run_rows
+        self.spill_folder = spill_folder
+        self.runs: List[str] = []
+        self._buffered: List[pa.Table] = []
+        self._buffered_rows = 0
+        self._temp_folder: Optional[str] = None
+
+    def __enter__(self) -> 'ExternalSorter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._temp_folder is not None:
+            shutil.rmtree(self._temp_folder, ignore_errors=True)
+            self._temp_folder = None
+
+    def add(self, table: pa.Table) -> None:
+        self._buffered.append(table)
+        self._buffered_rows += table.num_rows
+        if self._buffered_rows >= self.run_rows:
+            self._spill()
+
+    def sorted_tables(self) -> Iterator[pa.Table]:
+        """Yields tables that concatenated together hold all added rows in order."""
+
+        if not self.runs:
+            if self._buffered:
+                yield sort_table(pa.concat_tables(self._buffered), self.sort_keys)
+            return
+        if self._buffered:
+            self._spill()
+        yield from merge_runs([_read_batches(path) for path in self.runs], self.sort_keys)
+
+    def _spill(self) -> None:
+        if self._temp_folder is None:
+            self._temp_folder = tempfile.mkdtemp(prefix='nyc-taxi-sort-', dir=self.spill_folder)
+        table = sort_table(pa.concat_tables(self._buffered), self.sort_keys)
+        self._buffered = []
+        self._buffered_rows = 0
+        path = os.path.join(self._temp_folder, f'run-{len(self.runs):05d}.arrow')
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=merge_batch_rows)
+        self.runs.append(path)
+
+
+def sort_table(table: pa.Table, sort_keys: List[str]) -> pa.Table:
+    return table.sort_by([(key, 'ascending') for key in sort_keys])
+
+
+def merge_runs(runs: List[Iterator[pa.RecordBatch]], sort_keys: List[str]) -> Iterator[pa.Table]:
+    """K-way merge of sorted runs given as iterators of record batches, yields sorted tables.
+
+    Every round takes the smallest of last keys of batches that are currently loaded (bound), rows not greater
+    than the bound are taken from every batch, sorted together and yielded. Batch that the bound came from
+    is used up, so every round loads at least one new batch. Runs that have no more batches don't limit the bound.
+    """
+
+    buffers: List[Optional[pa.Table]] = [None] * len(runs)
+    finished = [False] * len(runs)
+    while True:
+        for i, run in enumerate(runs):
+            while not finished[i] and (buffers[i] is None or buffers[i].num_rows == 0):
+                batch = next(run, None)
+                if batch is None:
+                    finished[i] = True
+                else:
+                    buffers[i] = pa.Table.from_batches([batch])
+        loaded = [i for i, buffer in enumerate(buffers) if buffer is not None and buffer.num_rows > 0]
+        if not loaded:
+            return
+
+        limiting = [i for i in loaded if not finished[i]]
+        if limiting:
+            bound = min((_row_key(buffers[i], buffers[i].num_rows - 1, sort_keys) for i in limiting),
+                        key=_comparable)
+        else:
+            bound = None  # everything that's left can be taken
+
+        taken = []
+        for i in loaded:
+            buffer = buffers[i]
+            rows = buffer.num_rows if bound is None else _count_not_greater(buffer, bound, sort_keys)
+            if rows:
+                taken.append(buffer.slice(0, rows))
+                buffers[i] = buffer.slice(rows)
+        yield sort_table(pa.concat_tables(taken), sort_keys)
+
+
+def _read_batches(path: str) -> Iterator[pa.RecordBatch]:
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def _row_key(table: pa.Table, row: int, sort_keys: List[str]) -> Tuple[Any, ...]:
+    return tuple(table.column(key)[row].as_py() for key in sort_keys)
+
+
+def _comparable(key: Tuple[Any, ...]) -> Tuple[Tuple[bool, Any], ...]:
+    # nulls are last like in sort_table
+    return tuple((value is None, value if value is not None else 0) for value in key)
+
+
+def _count_not_greater(table: pa.Table, bound: Tuple[Any, ...], sort_keys: List[str]) -> int:
+    """Number of rows at the beginning of sorted table with keys lower than or equal to the bound."""
+
+    not_greater = pa.array(np.ones(table.num_rows, dtype=bool))
+    # compares keys from the last one: row <= bound if first key is lower or equal and the rest is <= bound
+    for key, value in reversed(list(zip(sort_keys, bound))):
+        column = table.column(key)
+        if value is None:
+            lower = pc.is_valid(column)
+            equal = pc.is_null(column)
+        else:
+            scalar = pa.scalar(value, type=column.type)
+            lower = pc.fill_null(pc.less(column, scalar), False)
+            equal = pc.fill_null(pc.equal(column, scalar), False)
+        not_greater = pc.or_(lower, pc.and_(equal, not_greater))
+    return pc.sum(pc.cast(not_greater, pa.int64())).as_py() or 0
+
+
+def row_groups(tables: Iterable[pa.Table], rows: int) -> Iterator[pa.Table]:
+    """Regroups tables into tables of given number of rows (apart from the last one)."""
+
+    buffered: List[pa.Table] = []
+    buffered_rows = 0
+    for table in tables:
+        buffered.append(table)
+        buffered_rows += table.num_rows
+        if buffered_rows >= rows:
+            table = pa.concat_tables(buffered)
+            full_rows = table.num_rows - table.num_rows % rows
+            for offset in range(0, full_rows, rows):
+                yield table.slice(offset, rows)
+            buffered = [table.slice(full_rows)]
+            buffered_rows = table.num_rows - full_rows
+    if buffered_rows:
+        yield pa.concat_tables(buffered)
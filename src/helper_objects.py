@@ -1,9 +1,11 @@
 import datetime
+import json
 import os
 import time
+from contextlib import contextmanager
 from glob import glob
-from sys import stdout, stderr
-from typing import Dict, Union, List
+import sys
+from typing import Dict, Union, List, Optional, Iterator
 import functools
 import logging
 
@@ -12,8 +14,9 @@ import pyarrow as pa
 logging.basicConfig(format='%(asctime)s - PROC%(process)d - %(levelname)s - %(message)s')
 
 this_file_dir = os.path.dirname(os.path.abspath(__file__))
-lookup_csv_path = os.path.join(this_file_dir, '../lookup/taxi+_zone_lookup.csv')
-lookup_shp_path = os.path.join(this_file_dir, '../lookup/taxi_zones.shp')
+lookup_folder_path = os.path.join(this_file_dir, '../lookup')
+lookup_csv_path = os.path.join(lookup_folder_path, 'taxi+_zone_lookup.csv')
+lookup_shp_path = os.path.join(lookup_folder_path, 'taxi_zones.shp')
 
 column_name_mapping_dict: Dict[str, str] = {
     'congestion_surcharge': 'congestion_surcharge',
@@ -89,6 +92,9 @@ arrow_schema = pa.schema([
     ('hour_of_day', pa.int8()),
 ])
 
+# columns that partitioned dataset is split by (company=/year=/month= folders), in order of nesting
+partition_columns = ['company', 'year', 'month']
+
 ParameterType = Dict[str, Union[str, Dict[str, Union[bool, Dict[str, str], List[str]]]]]
 ParametersDictType = Dict[str, ParameterType]
 yellow_taxi_params: ParametersDictType = {
@@ -543,21 +549,96 @@ def green_taxi_paths(folder: str) -> List[str]:
     return glob(os.path.join(folder, 'green_tripdata*'))
 
 
-def print_sanity_stats(initial_number_of_rows: int, final_number_of_rows: int) -> None:
-    stdout.write(f'\tInitial number of rows in DataFrame: {initial_number_of_rows:_d}.\n')
-    stdout.write(f'\tFinal number of rows in DataFrame: {final_number_of_rows:_d}.\n')
+class DropStats:
+    """Counts of rows rejected by every cleaning rule summed over all chunks of a file.
+
+    Rejected - rows that failed the rule, rejected alone - rows that failed only that rule
+    (would be kept if the rule was removed).
+    """
+
+    def __init__(self, source_file: str = ''):
+        self.source_file = source_file
+        self.rows_read = 0
+        self.rows_checked = 0  # rows that rules were evaluated on (after joining locations)
+        self.rows_written = 0
+        self.rejected: Dict[str, int] = {}
+        self.rejected_alone: Dict[str, int] = {}
+
+    def add_rule_counts(self, rule_name: str, rejected: int, rejected_alone: int) -> None:
+        self.rejected[rule_name] = self.rejected.get(rule_name, 0) + rejected
+        self.rejected_alone[rule_name] = self.rejected_alone.get(rule_name, 0) + rejected_alone
+
+    def merge(self, other: 'DropStats') -> None:
+        """Adds counts of other (eg. of part of the file processed elsewhere) to these."""
+
+        self.rows_read += other.rows_read
+        self.rows_checked += other.rows_checked
+        self.rows_written += other.rows_written
+        for rule_name, rejected in other.rejected.items():
+            self.add_rule_counts(rule_name, rejected, other.rejected_alone[rule_name])
+
+    def to_dict(self) -> Dict[str, Union[str, int, float, Dict[str, Dict[str, int]]]]:
+        dropped_rows = self.rows_read - self.rows_written
+        return {
+            'source_file': self.source_file,
+            'rows_read': self.rows_read,
+            'rows_checked': self.rows_checked,
+            'rows_written': self.rows_written,
+            'rows_dropped': dropped_rows,
+            'percent_dropped': round((100.0 * dropped_rows) / self.rows_read, 3) if self.rows_read else 0.0,
+            'rules': {
+                name: {'rejected': rejected, 'rejected_alone': self.rejected_alone[name]}
+                for name, rejected in self.rejected.items()
+            },
+        }
+
+    def write_json(self, filepath: str) -> None:
+        with atomic_output(filepath) as temp_path, open(temp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+@contextmanager
+def atomic_output(filepath: str) -> Iterator[str]:
+    """Yields temporary path to write to instead of filepath, it's renamed to filepath once the block succeeds
+    so the file is either complete or not there at all (previous version is kept if the block fails).
+
+    Temporary file name starts with a dot so Athena and Spark ignore it if it's left behind by killed process.
+    """
+
+    temp_path = temp_path_for(filepath)
+    try:
+        yield temp_path
+        os.replace(temp_path, filepath)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def temp_path_for(filepath: str) -> str:
+    folder, name = os.path.split(filepath)
+    return os.path.join(folder, f'.{name}.{os.getpid()}.tmp')
+
+
+def print_sanity_stats(initial_number_of_rows: int, final_number_of_rows: int,
+                       drop_stats: Optional[DropStats] = None) -> None:
+    sys.stdout.write(f'\tInitial number of rows in DataFrame: {initial_number_of_rows:_d}.\n')
+    sys.stdout.write(f'\tFinal number of rows in DataFrame: {final_number_of_rows:_d}.\n')
     dropped_rows = initial_number_of_rows - final_number_of_rows
     percent_dropped = (100.0 * dropped_rows) / initial_number_of_rows
-    stdout.write(f'\tDropped rows from DataFrame: {dropped_rows:_d}. Percent: {percent_dropped:.1f}%.\n')
+    sys.stdout.write(f'\tDropped rows from DataFrame: {dropped_rows:_d}. Percent: {percent_dropped:.1f}%.\n')
+    if drop_stats is not None:
+        for name, rejected in drop_stats.rejected.items():
+            sys.stdout.write(f'\t\t{name}: {rejected:_d} rows rejected, '
+                             f'{drop_stats.rejected_alone[name]:_d} only by this rule.\n')
 
     warning_threshold = 5.0
     if percent_dropped > warning_threshold:
-        stderr.write(f'##############\n')
-        stderr.write(f'WARNING!\n')
-        stderr.write(f'Percentage of dropped rows above {warning_threshold}% threshold!\n')
-        stderr.write(f'##############\n')
-    stdout.flush()
-    stderr.flush()
+        sys.stderr.write(f'##############\n')
+        sys.stderr.write(f'WARNING!\n')
+        sys.stderr.write(f'Percentage of dropped rows above {warning_threshold}% threshold!\n')
+        sys.stderr.write(f'##############\n')
+    sys.stdout.flush()
+    sys.stderr.flush()
 
 
 def timer(log_level=logging.INFO):
@@ -0,0 +1,95 @@
+import datetime
+import hashlib
+import json
+import os
+from typing import Dict, List, Union
+
+from helper_objects import atomic_output
+
+# name starts with underscore so Athena and Spark ignore it
+manifest_file_name = '_manifest.json'
+
+SourceStateType = Dict[str, Union[int, str]]
+
+
+class RunManifest:
+    """Record of source files converted into the output folder, saved in the folder after every converted file.
+
+    Entries are keyed by absolute source path and hold size, modification time and SHA-1 of the source,
+    fingerprint of the pipeline and layout of the output it was converted with and paths of the output files.
+    File is up to date if none of these changed and all its output files still exist.
+    """
+
+    def __init__(self, output_folder: str):
+        self.output_folder = output_folder
+        self.filepath = os.path.join(output_folder, manifest_file_name)
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(self.filepath):
+            with open(self.filepath) as f:
+                self.entries = json.load(f)['files']
+
+    def source_state(self, path: str) -> SourceStateType:
+        """Size, modification time and content hash of the source file.
+        Hash is reused from the manifest if size and modification time didn't change."""
+
+        stat = os.stat(path)
+        previous = self.entries.get(os.path.abspath(path), {}).get('source', {})
+        if previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+            sha1 = previous['sha1']
+        else:
+            sha1 = file_sha1(path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1}
+
+    def is_current(self, path: str, source_state: SourceStateType, pipeline: str, layout: str) -> bool:
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None:
+            return False
+        # touching the file (new mtime, same contents) doesn't make it outdated
+        return (entry['source']['sha1'] == source_state['sha1']
+                and entry['pipeline'] == pipeline
+                and entry['layout'] == layout
+                and all(os.path.exists(os.path.join(self.output_folder, output)) for output in entry['outputs']))
+
+    def record(self, path: str, source_state: SourceStateType, pipeline: str, layout: str,
+               outputs: List[str]) -> None:
+        """Adds (or replaces) entry for converted file and saves the manifest."""
+
+        self.entries[os.path.abspath(path)] = {
+            'source': source_state,
+            'pipeline': pipeline,
+            'layout': layout,
+            'outputs': sorted(os.path.relpath(output, self.output_folder) for output in outputs),
+            'converted_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        self.save()
+
+    def sources_sharing_outputs(self, path: str) -> List[str]:
+        """Other sources whose rows are in the same output files as rows of the source (merged by compaction)."""
+
+        outputs = set(self.entries.get(os.path.abspath(path), {}).get('outputs', []))
+        return sorted(other for other, entry in self.entries.items()
+                      if other != os.path.abspath(path) and outputs & set(entry['outputs']))
+
+    def record_compaction(self, sources: List[str], old_outputs: List[str], new_outputs: List[str]) -> None:
+        """Replaces old output files of the sources with files they were merged into and saves the manifest."""
+
+        old = {os.path.relpath(output, self.output_folder) for output in old_outputs}
+        new = {os.path.relpath(output, self.output_folder) for output in new_outputs}
+        for source in sources:
+            entry = self.entries[os.path.abspath(source)]
+            entry['outputs'] = sorted({output for output in entry['outputs'] if output not in old} | set(new))
+            entry['compacted_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+        self.save()
+
+    def save(self) -> None:
+        with atomic_output(self.filepath) as temp_path, open(temp_path, 'w') as f:
+            json.dump({'files': self.entries}, f, indent=2, sort_keys=True)
+
+
+def file_sha1(path: str, block_size: int = 16 * 1024 * 1024) -> str:
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
@@ -0,0 +1,325 @@
+import datetime
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional, Iterator, Union, Callable, Iterable, ContextManager, Set
+
+import pandas as pd
+import pyarrow as pa
+
+from helper_objects import atomic_output
+
+RecordType = Dict[str, Union[str, int, float, None]]
+# chunks are DataFrames or Arrow tables (Arrow processing engine)
+FrameType = Union[pd.DataFrame, pa.Table]
+# values of records that are summed when aggregating, the rest takes maximum
+_summed_values = ['wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'bytes_in', 'bytes_out']
+_max_values = ['peak_memory_delta_bytes', 'peak_rss_bytes']
+
+
+class Measurement:
+    """Wall time, CPU time of the calling thread and peak resident set size while inside the with block.
+    CPU time of other threads (eg. prefetching or writing chunks at the same time) isn't counted,
+    neither is work that pyarrow hands to its own thread pool. RSS of the whole process is sampled
+    every few milliseconds by the shared sampler so very short peaks may be missed."""
+
+    def __init__(self):
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.start_rss: Optional[int] = None
+        self.peak_rss: Optional[int] = None
+
+    @property
+    def peak_memory_delta(self) -> Optional[int]:
+        """Bytes that RSS grew by at its peak (0 if it never grew)."""
+
+        if self.peak_rss is None or self.start_rss is None:
+            return None
+        return self.peak_rss - self.start_rss
+
+    def __enter__(self) -> 'Measurement':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self.start_rss = current_rss()
+        self.peak_rss = self.start_rss
+        _rss_sampler.add(self)
+        self._start_cpu = time.thread_time()
+        self._start = time.perf_counter()
+
+    def stop(self) -> None:
+        self.wall_seconds = time.perf_counter() - self._start
+        self.cpu_seconds = time.thread_time() - self._start_cpu
+        _rss_sampler.remove(self)
+        self.observe_rss(current_rss())
+
+    def observe_rss(self, rss: Optional[int]) -> None:
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+
+class RssSampler:
+    """Background thread that samples RSS of the process every few milliseconds while any measurement is open
+    and passes every reading to all of them. One is shared by all measurements of the process,
+    it waits without sampling while none is open."""
+
+    interval = 0.005  # seconds
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        self._condition = threading.Condition()
+        self._measurements: Set[Measurement] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, measurement: Measurement) -> None:
+        with self._condition:
+            self._measurements.add(measurement)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='rss sampler', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def remove(self, measurement: Measurement) -> None:
+        with self._condition:
+            self._measurements.discard(measurement)
+
+    def _sample(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._measurements)
+            rss = current_rss()
+            with self._condition:
+                for measurement in self._measurements:
+                    measurement.observe_rss(rss)
+            time.sleep(self.interval)
+
+
+_rss_sampler = RssSampler()
+if hasattr(os, 'register_at_fork'):
+    # forked worker process doesn't have the thread (and the lock may be held by it), it starts its own
+    os.register_at_fork(after_in_child=_rss_sampler._reset)
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of the current process in bytes (None if it can't be determined on this platform)."""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class FileMetrics:
+    """Measurements of every stage (reading, steps of process_taxi_data, writing) for every chunk of a file.
+
+    Bytes are shallow sizes of DataFrames (memory_usage without deep=True) so strings in object columns
+    count as pointers only, measuring them would cost more than some stages themselves.
+    Arrow tables report size of all their buffers (strings included), it's known without measuring.
+    """
+
+    def __init__(self, source_file: str = ''):
+        self.source_file = source_file
+        self.records: List[RecordType] = []
+
+    @contextmanager
+    def measure(self, stage: str, chunk: Optional[int] = None) -> Iterator[RecordType]:
+        """Measures the with block, yields record that rows and bytes can be filled in,
+        it's added to records once the block succeeds."""
+
+        record = self._new_record(stage, chunk)
+        measurement = Measurement()
+        with measurement:
+            yield record
+        self._add_record(record, measurement)
+
+    def measured_iter(self, stage: str, data_frames: Iterable[FrameType]) -> Iterator[FrameType]:
+        """Yields DataFrames from the iterable recording how long it took to produce every one of them
+        (eg. reading and parsing CSV chunks)."""
+
+        iterator = iter(data_frames)
+        for chunk in itertools.count():
+            record = self._new_record(stage, chunk)
+            measurement = Measurement()
+            with measurement:
+                data_frame = next(iterator, None)
+            if data_frame is None:
+                return
+            record['rows_out'], record['bytes_out'] = frame_rows(data_frame), frame_bytes(data_frame)
+            self._add_record(record, measurement)
+            yield data_frame
+
+    def _new_record(self, stage: str, chunk: Optional[int]) -> RecordType:
+        return {'source_file': self.source_file, 'stage': stage, 'chunk': chunk,
+                'rows_in': 0, 'rows_out': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def _add_record(self, record: RecordType, measurement: Measurement) -> None:
+        record['wall_seconds'] = measurement.wall_seconds
+        record['cpu_seconds'] = measurement.cpu_seconds
+        record['peak_memory_delta_bytes'] = measurement.peak_memory_delta
+        record['peak_rss_bytes'] = measurement.peak_rss
+        self.records.append(record)
+
+    def apply(self, stage: str, chunk: Optional[int], func: Callable[[FrameType], FrameType],
+              data_frame: FrameType) -> FrameType:
+        """Calls func on the DataFrame and records it, returns what func returned."""
+
+        with self.measure(stage, chunk) as record:
+            record['rows_in'], record['bytes_in'] = frame_rows(data_frame), frame_bytes(data_frame)
+            data_frame = func(data_frame)
+        record['rows_out'], record['bytes_out'] = frame_rows(data_frame), frame_bytes(data_frame)
+        return data_frame
+
+    def merge(self, other: 'FileMetrics', chunk_offset: int = 0) -> None:
+        """Adds records of other (eg. of part of the file processed elsewhere) to these,
+        its chunks are numbered from chunk_offset."""
+
+        for record in other.records:
+            if record['chunk'] is not None:
+                record = {**record, 'chunk': record['chunk'] + chunk_offset}
+            self.records.append(record)
+
+    def stage_summary(self) -> Dict[str, RecordType]:
+        """Records of every stage summed over all chunks, in order stages were first seen."""
+
+        return aggregate(self.records)
+
+
+def measure(metrics: Optional[FileMetrics], stage: str,
+            chunk: Optional[int] = None) -> ContextManager[RecordType]:
+    """FileMetrics.measure if metrics are given, otherwise does nothing."""
+
+    return nullcontext({}) if metrics is None else metrics.measure(stage, chunk)
+
+
+def frame_rows(data_frame: FrameType) -> int:
+    return data_frame.num_rows if isinstance(data_frame, pa.Table) else len(data_frame.index)
+
+
+def frame_bytes(data_frame: FrameType) -> int:
+    if isinstance(data_frame, pa.Table):
+        return data_frame.nbytes
+    return int(data_frame.memory_usage(index=False).sum())
+
+
+def aggregate(records: List[RecordType]) -> Dict[str, RecordType]:
+    """Sums records by stage, adds rows per second (of rows that came into the stage, or out of it for reading)."""
+
+    summary: Dict[str, RecordType] = {}
+    for record in records:
+        total = summary.setdefault(record['stage'], {'stage': record['stage'], 'chunks': 0,
+                                                      **{name: 0 for name in _summed_values},
+                                                      **{name: None for name in _max_values}})
+        total['chunks'] += 1
+        for name in _summed_values:
+            total[name] += record[name]
+        for name in _max_values:
+            if record[name] is not None:
+                total[name] = max(total[name] or 0, record[name])
+    for total in summary.values():
+        rows = total['rows_in'] or total['rows_out']
+        total['rows_per_second'] = rows / total['wall_seconds'] if total['wall_seconds'] else None
+    return summary
+
+
+class RunMetrics:
+    """Metrics of every file converted by one csv2parquet call, exported as JSON lines and Prometheus textfile."""
+
+    def __init__(self):
+        self.started_at = datetime.datetime.now()
+        self.files: List[FileMetrics] = []
+
+    def add(self, file_metrics: FileMetrics) -> None:
+        self.files.append(file_metrics)
+
+    def stage_summary(self) -> Dict[str, RecordType]:
+        return aggregate([record for file_metrics in self.files for record in file_metrics.records])
+
+    def write_jsonl(self, filepath: str) -> None:
+        """Appends line for every stage of every chunk, per file and per run summary of every stage
+        (kind field tells them apart: chunk, file, run). All lines of the run have the same run_id."""
+
+        run_id = self.started_at.isoformat(timespec='seconds')
+        with open(filepath, 'a') as f:
+            for file_metrics in self.files:
+                for record in file_metrics.records:
+                    f.write(json.dumps({'run_id': run_id, 'kind': 'chunk', **record}) + '\n')
+                for total in file_metrics.stage_summary().values():
+                    f.write(json.dumps({'run_id': run_id, 'kind': 'file',
+                                        'source_file': file_metrics.source_file, **total}) + '\n')
+            for total in self.stage_summary().values():
+                f.write(json.dumps({'run_id': run_id, 'kind': 'run', **total}) + '\n')
+
+    def write_prometheus(self, filepath: str) -> None:
+        """Writes (replaces atomically, as node_exporter's textfile collector requires) per stage totals of the run
+        and per file totals of the whole pipeline in Prometheus text format."""
+
+        lines = []
+        run_stages = self.stage_summary().values()
+        for name, help_text, key in _prometheus_stage_metrics:
+            metric = f'nyc_taxi_stage_{name}'
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} gauge']
+            lines += [f'{metric}{{stage="{total["stage"]}"}} {_prometheus_value(total[key])}' for total in run_stages]
+        for name, help_text, key in _prometheus_file_metrics:
+            metric = f'nyc_taxi_file_{name}'
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} gauge']
+            for file_metrics in self.files:
+                value = _file_total(file_metrics, key)
+                lines.append(f'{metric}{{source_file="{_escape(file_metrics.source_file)}"}} {_prometheus_value(value)}')
+        lines += ['# HELP nyc_taxi_run_files Number of files converted by the last run.',
+                  '# TYPE nyc_taxi_run_files gauge',
+                  f'nyc_taxi_run_files {len(self.files)}',
+                  '# HELP nyc_taxi_run_timestamp_seconds Unix time when the last run started.',
+                  '# TYPE nyc_taxi_run_timestamp_seconds gauge',
+                  f'nyc_taxi_run_timestamp_seconds {self.started_at.timestamp():.0f}']
+        with atomic_output(filepath) as temp_path, open(temp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+_prometheus_stage_metrics = [
+    ('wall_seconds', 'Wall time spent in the stage during the last run.', 'wall_seconds'),
+    ('cpu_seconds', 'CPU time of the thread that ran the stage during the last run.', 'cpu_seconds'),
+    ('rows_in', 'Rows that came into the stage during the last run.', 'rows_in'),
+    ('rows_out', 'Rows that came out of the stage during the last run.', 'rows_out'),
+    ('rows_per_second', 'Throughput of the stage during the last run.', 'rows_per_second'),
+    ('peak_memory_delta_bytes', 'Highest growth of RSS within one chunk of the stage during the last run.',
+     'peak_memory_delta_bytes'),
+]
+_prometheus_file_metrics = [
+    ('wall_seconds', 'Wall time spent on the file in all stages.', 'wall_seconds'),
+    ('rows_read', 'Rows read from the file.', 'rows_read'),
+    ('rows_per_second', 'Rows read from the file per second of all stages.', 'rows_per_second'),
+]
+
+
+def _file_total(file_metrics: FileMetrics, key: str) -> Optional[float]:
+    summary = file_metrics.stage_summary()
+    wall_seconds = sum(total['wall_seconds'] for total in summary.values())
+    rows_read = summary['read_csv']['rows_out'] if 'read_csv' in summary else 0
+    if key == 'wall_seconds':
+        return wall_seconds
+    elif key == 'rows_read':
+        return rows_read
+    return rows_read / wall_seconds if wall_seconds else None
+
+
+def _prometheus_value(value: Optional[float]) -> str:
+    return 'NaN' if value is None else repr(float(value))
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
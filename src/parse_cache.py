@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+from typing import Iterator, Dict, Any, Union, Callable
+
+import pyarrow as pa
+
+from arrow_csv import arrow_csv_tables
+from helper_objects import atomic_output
+from manifest import file_sha1, SourceStateType
+
+# bump when cached tables change for reasons the key can't see (eg. changed arrow_csv.py)
+cache_version = 1
+_source_metadata_key = b'source'
+
+
+def cache_path(cache_folder: str, filepath: str, csv_params: Dict[str, Any]) -> str:
+    """Path of the cached parsed columns of the file. Name holds hash of everything that changes the parsed
+    columns besides the file itself, so a new version of the file replaces the previous one in the cache."""
+
+    key = hashlib.sha1(repr([cache_version, csv_params, pa.__version__]).encode()).hexdigest()[:16]
+    return os.path.join(cache_folder, f'{os.path.basename(filepath).split(".")[0]}-{key}.arrow')
+
+
+def cached_csv_tables(filepath: str, cache_folder: str, chunksize: Union[int, Callable[[], int]] = 1000000,
+                      **csv_params) -> Iterator[pa.Table]:
+    """Same tables as arrow_csv_tables(filepath, chunksize, **csv_params) but parsed columns are cached
+    in Arrow IPC file in the cache folder. If the cached file is there and the source didn't change
+    (same size and modification time or same contents) it's memory mapped instead of parsing the CSV,
+    otherwise tables are written to the cache as they're parsed."""
+
+    path = cache_path(cache_folder, filepath, csv_params)
+    if _is_current(path, filepath):
+        yield from _cached_tables(path, chunksize)
+        return
+
+    os.makedirs(cache_folder, exist_ok=True)
+    source = json.dumps(_source_state(filepath)).encode()
+    with atomic_output(path) as temp_path:
+        writer = None
+        try:
+            for table in arrow_csv_tables(filepath, chunksize, **csv_params):
+                if writer is None:
+                    schema = table.schema.with_metadata({_source_metadata_key: source})
+                    writer = pa.ipc.new_file(temp_path, schema)
+                writer.write_table(table)
+                yield table
+            if writer is None:
+                # file without rows, cached as such so it isn't parsed again either
+                writer = pa.ipc.new_file(temp_path, pa.schema([], {_source_metadata_key: source}))
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def _source_state(filepath: str) -> SourceStateType:
+    stat = os.stat(filepath)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': file_sha1(filepath)}
+
+
+def _is_current(path: str, filepath: str) -> bool:
+    if not os.path.exists(path):
+        return False
+    with pa.memory_map(path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if _source_metadata_key not in metadata:
+        return False
+    cached = json.loads(metadata[_source_metadata_key])
+    stat = os.stat(filepath)
+    if cached['size'] != stat.st_size:
+        return False
+    # touching the file (new mtime, same contents) doesn't make the cache outdated
+    return cached['mtime_ns'] == stat.st_mtime_ns or cached['sha1'] == file_sha1(filepath)
+
+
+def _cached_tables(path: str, chunksize: Union[int, Callable[[], int]]) -> Iterator[pa.Table]:
+    # buffers of the table point into the memory map, they keep it mapped after the file is closed
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all().replace_schema_metadata(None)
+    offset = 0
+    while offset < table.num_rows:
+        rows = chunksize() if callable(chunksize) else chunksize
+        yield table.slice(offset, rows)
+        offset += rows
+
@@ -0,0 +1,164 @@
+import glob
+import os
+from typing import List, Dict, Tuple, Optional, NamedTuple, Iterable, Iterator
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from compact_schema import to_arrow_table, check_schema
+from helper_objects import arrow_schema, partition_columns, temp_path_for
+from metrics import FileMetrics, FrameType, measure, frame_bytes, frame_rows
+from writer_profile import WriterProfile, parquet_options
+
+default_target_file_size = 256 * 1024 * 1024  # bytes
+default_row_group_size = 1000000  # rows
+
+
+class DatasetOptions(NamedTuple):
+    """Layout of files in partitioned dataset."""
+
+    target_file_size: int = default_target_file_size  # new file is started once it's reached
+    row_group_size: int = default_row_group_size
+
+
+def write_partitioned(data_frames: Iterable[FrameType], output_folder: str, result_name: str,
+                      dataset: DatasetOptions = DatasetOptions(), metrics: Optional[FileMetrics] = None,
+                      profile: Optional[WriterProfile] = None, compact: bool = False) -> List[str]:
+    """Writes DataFrames to partition folders as files named <result_name>-<part number>.parquet.
+
+    Files are written under temporary names and renamed only after all of them are complete,
+    then files left from previous conversion of the same source are removed. Returns paths of written files.
+    """
+
+    partition_folders = os.path.join(output_folder, *['*'] * len(partition_columns))
+    old_file_paths = set(glob.glob(os.path.join(partition_folders, f'{result_name}-*.parquet')))
+    # temporary files of a conversion that was killed
+    for temp_file_path in glob.glob(os.path.join(partition_folders, f'.{result_name}-*.parquet.*.tmp')):
+        os.remove(temp_file_path)
+
+    writer = _PartitionedWriter(output_folder, result_name, dataset, profile, compact)
+    try:
+        for idx, data_frame in enumerate(data_frames):
+            with measure(metrics, 'write_parquet', idx) as record:
+                record['rows_in'], record['bytes_in'] = frame_rows(data_frame), frame_bytes(data_frame)
+                writer.write(data_frame)
+        # rows that were buffered until the end are counted in chunks they came in
+        with measure(metrics, 'write_parquet'):
+            writer.flush()
+            writer.close()
+    except BaseException:
+        writer.discard()
+        raise
+
+    for file_path, temp_file_path in writer.file_paths.items():
+        os.replace(temp_file_path, file_path)
+    for old_file_path in old_file_paths - set(writer.file_paths):
+        os.remove(old_file_path)
+    return list(writer.file_paths)
+
+
+_data_schema = pa.schema([field for field in arrow_schema if field.name not in partition_columns])
+
+
+def _partitions(data_frame: FrameType) -> Iterator[Tuple[tuple, FrameType]]:
+    """Values of partition columns and rows of the DataFrame (or Arrow table) that have them,
+    in order of first rows. Usually whole chunk belongs to a single partition, it isn't copied then."""
+
+    if isinstance(data_frame, pa.Table):
+        columns = [data_frame.column(name).combine_chunks() for name in partition_columns]
+        columns = [column.dictionary_decode() if pa.types.is_dictionary(column.type) else column
+                   for column in columns]
+        # one integer per combination of values, unique keeps order of first appearance
+        keys = pa.scalar(0, pa.int64())
+        for column in columns:
+            encoded = pc.dictionary_encode(column)
+            keys = pc.add(pc.multiply(keys, len(encoded.dictionary)), pc.cast(encoded.indices, pa.int64()))
+        unique_keys = pc.unique(keys)
+        for unique_key in unique_keys:
+            position = pc.index(keys, unique_key).as_py()
+            key = tuple(column[position].as_py() for column in columns)
+            yield key, data_frame if len(unique_keys) == 1 else data_frame.filter(pc.equal(keys, unique_key))
+        return
+    groups = data_frame.groupby(partition_columns, sort=False, observed=True).indices
+    for key, positions in groups.items():
+        yield key, data_frame if len(groups) == 1 else data_frame.iloc[positions]
+
+
+class _PartitionedWriter:
+    """Buffers rows of every partition until there are enough of them for full row group,
+    keeps one open file per partition and starts the next one when it grows over target size."""
+
+    def __init__(self, output_folder: str, result_name: str, dataset: DatasetOptions,
+                 profile: Optional[WriterProfile] = None, compact: bool = False):
+        self.output_folder = output_folder
+        self.result_name = result_name
+        self.dataset = dataset
+        self.profile = profile
+        self.compact = compact
+        self.buffers: Dict[tuple, List[pa.Table]] = {}
+        self.buffered_rows: Dict[tuple, int] = {}
+        self.files: Dict[tuple, Tuple[pq.ParquetWriter, pa.NativeFile]] = {}
+        self.parts: Dict[tuple, int] = {}
+        self.file_paths: Dict[str, str] = {}  # final path: temporary path
+
+    def write(self, data_frame: FrameType) -> None:
+        if frame_rows(data_frame) == 0:
+            return
+        for key, partition_df in _partitions(data_frame):
+            table = to_arrow_table(partition_df, _data_schema, self.compact)
+            self.buffers.setdefault(key, []).append(table)
+            self.buffered_rows[key] = self.buffered_rows.get(key, 0) + table.num_rows
+            if self.buffered_rows[key] >= self.dataset.row_group_size:
+                self._writerow_groups(key, final=False)
+
+    def flush(self) -> None:
+        for key in list(self.buffers):
+            self._writerow_groups(key, final=True)
+
+    def close(self) -> None:
+        for key in list(self.files):
+            self._close_file(key)
+
+    def discard(self) -> None:
+        """Closes and removes all files written so far."""
+
+        self.close()
+        for temp_file_path in self.file_paths.values():
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+    def _writerow_groups(self, key: tuple, final: bool) -> None:
+        table = pa.concat_tables(self.buffers.pop(key))
+        row_group_size = self.dataset.row_group_size
+        full_rows = table.num_rows if final else table.num_rows - table.num_rows % row_group_size
+        for offset in range(0, full_rows, row_group_size):
+            writer, sink = self._open_file(key, table.schema)
+            writer.write_table(table.slice(offset, min(row_group_size, full_rows - offset)),
+                               row_group_size=row_group_size)
+            if sink.tell() >= self.dataset.target_file_size:
+                self._close_file(key)
+        rest = table.slice(full_rows)
+        self.buffers[key] = [rest]
+        self.buffered_rows[key] = rest.num_rows
+        if final:
+            del self.buffers[key], self.buffered_rows[key]
+
+    def _open_file(self, key: tuple, schema: pa.Schema) -> Tuple[pq.ParquetWriter, pa.NativeFile]:
+        if key not in self.files:
+            folder = os.path.join(self.output_folder, *[f'{name}={value}' for name, value in zip(partition_columns, key)])
+            os.makedirs(folder, exist_ok=True)
+            part = self.parts.get(key, 0)
+            self.parts[key] = part + 1
+            check_schema(schema, self.compact, partitioned=True)
+            file_path = os.path.join(folder, f'{self.result_name}-{part:05d}.parquet')
+            self.file_paths[file_path] = temp_path_for(file_path)
+            sink = pa.OSFile(self.file_paths[file_path], 'wb')
+            self.files[key] = (pq.ParquetWriter(sink, schema=schema, flavor='spark',
+                                                **parquet_options(self.profile, schema)), sink)
+        return self.files[key]
+
+    def _close_file(self, key: tuple) -> None:
+        writer, sink = self.files.pop(key)
+        writer.close()
+        sink.close()
@@ -0,0 +1,70 @@
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+_done = object()
+# how often producer blocked on full queue checks whether consumer is gone (seconds)
+_poll_interval = 0.1
+
+
+def prefetch(items: Iterable[T], depth: int = 1, name: str = 'prefetch') -> Iterator[T]:
+    """Yields items of the iterable, producing them in a background thread up to depth items ahead of the consumer.
+
+    Exception raised by the iterable is raised in the consumer at the point where the item would be.
+    If consumer stops early (break, exception, generator closed) producer stops after the item it's working on
+    and the iterable is closed (so eg. file it reads from is closed too).
+    Work only really overlaps if producer or consumer release the GIL (pandas and pyarrow readers,
+    writing Parquet, most of numpy and pandas operations on numeric columns do).
+    """
+
+    buffer: 'queue.Queue' = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def produce() -> None:
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not _put(buffer, (item, None), stopped):
+                    return
+            _put(buffer, (_done, None), stopped)
+        except BaseException as e:
+            _put(buffer, (_done, e), stopped)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _done:
+                return
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def _put(buffer: 'queue.Queue', entry: tuple, stopped: threading.Event) -> bool:
+    """Waits for space in the buffer, returns False if consumer stopped in the meantime."""
+
+    while not stopped.is_set():
+        try:
+            buffer.put(entry, timeout=_poll_interval)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def chunks_in_flight(depth: int) -> int:
+    """Most chunks held in memory at once when reading, processing and writing are pipelined with given depth:
+    one in every stage and depth waiting between reading and processing and between processing and writing."""
+
+    return 3 + 2 * depth
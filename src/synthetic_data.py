@@ -0,0 +1,191 @@
+import os
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from data_cleaning import column_mapping_function
+from data_processing import get_taxi_params
+from helper_objects import yellow_taxi_params, green_taxi_params, ParameterType
+from zone_index import ZoneRasterIndex, zone_index_path, BOUNDARY, OUTSIDE
+
+# file name used for eras without end date (zzz_generic_schema)
+_generic_schema_month = '2020-06'
+# share of rows with values that some cleaning rule should reject
+invalid_share = 0.02
+# shares of valid coordinates in raster cells crossed by zone edges (resolved by exact point in polygon test)
+# and in cells outside every zone (eg. water, New Jersey), the rest is in cells inside a single zone.
+# Boundary cells are about 16% of the area covered by zones, trips are concentrated in Manhattan
+# where zones are small so more of them end up close to edges.
+boundary_share = 0.2
+outside_share = 0.01
+
+
+def eras() -> List[str]:
+    """Keys of every entry in yellow_taxi_params and green_taxi_params."""
+
+    return [f'yellow:{key}' for key in yellow_taxi_params] + [f'green:{key}' for key in green_taxi_params]
+
+
+def synthetic_file_name(era: str) -> str:
+    """Name of the file (without extension) that get_taxi_params resolves to the given era."""
+
+    company, key = era.split(':')
+    if key.startswith(f'{company}_tripdata_'):
+        return key
+    return f'{company}_tripdata_{_generic_schema_month}'
+
+
+def generate_taxi_files(folder: str, rows: int = 100000, seed: int = 0,
+                        selected_eras: Optional[List[str]] = None) -> List[str]:
+    """Generates CSV file for every era (or the selected ones) in the folder, returns their paths."""
+
+    return [generate_taxi_file(folder, era, rows, seed) for era in (selected_eras or eras())]
+
+
+def generate_taxi_file(folder: str, era: str, rows: int = 100000, seed: int = 0) -> str:
+    """Generates CSV file with the columns, header and value formats of the given era ('<company>:<params key>').
+
+    Values are random but deterministic for the same era, number of rows and seed. Most rows are valid,
+    about 2% of the values are broken in ways that cleaning rules reject (nulls, zero coordinates,
+    negative amounts, dropoff before pickup...). Coordinates are mixed like in real files: most points
+    are in raster cells inside a single zone, boundary_share of them close to zone edges (some of those
+    aren't in any zone) and outside_share outside every zone, see location_mix.
+    """
+
+    company, key = era.split(':')
+    params = (yellow_taxi_params if company == 'yellow' else green_taxi_params)[key]
+    file_name = synthetic_file_name(era)
+    year, month = (int(part) for part in file_name.split('_')[-1].split('-'))
+    rng = np.random.default_rng([seed, rows, zlib.crc32(era.encode())])
+
+    csv_params = params['csv_params']
+    names = csv_params.get('names')
+    header = names[:-2] if names is not None else _extra_columns + csv_params['usecols']
+    columns = names if names is not None else header
+    values = _generate_values(rng, rows, company, year, month, params)
+    data_frame = pd.DataFrame({
+        column: values.get(column_mapping_function(column), _filler_value(column))
+        for column in columns
+    })
+
+    filepath = os.path.join(folder, file_name + '.csv')
+    with open(filepath, 'w', newline='') as f:
+        # files with explicit names have two more (empty) fields in every row than in the header
+        f.write(','.join(header) + '\n')
+        data_frame.to_csv(f, header=False, index=False, na_rep='')
+    return filepath
+
+
+# columns that files have but the pipeline doesn't read
+_extra_columns = ['VendorID', 'mta_tax']
+
+
+def _filler_value(column: str) -> str:
+    return '' if column.startswith('junk') else '1'
+
+
+def _generate_values(rng: np.random.Generator, rows: int, company: str, year: int, month: int,
+                     params: ParameterType) -> Dict[str, pd.Series]:
+    """Values of every column the pipeline reads, keyed by column name after renaming."""
+
+    month_start = np.datetime64(f'{year:04d}-{month:02d}-01T00:00:00', 's')
+    seconds_in_month = int(((month_start.astype('datetime64[M]') + 1).astype('datetime64[s]') - month_start).astype(np.int64))
+    pickup = month_start + rng.integers(0, seconds_in_month, rows).astype('timedelta64[s]')
+    duration = np.round(rng.gamma(2.0, 6.0, rows) * 60).astype('timedelta64[s]')
+    dropoff = pickup + np.where(_invalid(rng, rows), -duration, duration)
+
+    values = {
+        'pickup_datetime': _format_timestamps(pickup),
+        'dropoff_datetime': _format_timestamps(dropoff),
+        'passenger_count': _with_invalid(rng, pd.array(rng.choice([1, 1, 1, 1, 2, 2, 3, 5, 6], rows), dtype='Int64'),
+                                         pd.array([pd.NA, 0, 208], dtype='Int64')),
+        'trip_distance': np.round(rng.gamma(1.5, 2.0, rows), 2),
+        'fare_amount': _with_invalid(rng, pd.Series(np.round(2.5 + rng.gamma(2.0, 6.0, rows), 2)), [-5.5]),
+        'tip_amount': np.round(rng.gamma(1.0, 2.0, rows) * rng.integers(0, 2, rows), 2),
+        'store_and_forward': _with_invalid(rng, pd.Series(rng.choice(['N', 'N', 'N', 'Y'], rows)), [None]),
+        'payment_type': pd.Series(rng.choice(_payment_types(company, year), rows)),
+    }
+    values['total_amount'] = np.round(values['fare_amount'] + values['tip_amount'] + 0.5, 2)
+    if company == 'green':
+        values['trip_type'] = _with_invalid(rng, pd.array(rng.choice([1, 1, 1, 2], rows), dtype='Int64'),
+                                            pd.array([pd.NA], dtype='Int64'))
+
+    if params['location'] == 'id':
+        for prefix in ('pickup', 'dropoff'):
+            values[f'{prefix}_location_id'] = _with_invalid(
+                rng, pd.array(rng.integers(1, 264, rows), dtype='Int64'), pd.array([pd.NA], dtype='Int64'))
+    else:
+        zone_index = ZoneRasterIndex.load(zone_index_path)
+        for prefix in ('pickup', 'dropoff'):
+            x, y = _points_in_zones(rng, zone_index, rows)
+            broken = _invalid(rng, rows)
+            values[f'{prefix}_longitude'] = np.where(broken, 0.0, np.round(x, 6))
+            values[f'{prefix}_latitude'] = np.where(broken, 0.0, np.round(y, 6))
+    return values
+
+
+def _payment_types(company: str, year: int) -> List[str]:
+    if company == 'yellow' and year <= 2009:
+        return ['Credit', 'CASH', 'Cash', 'No Charge', 'Dispute']
+    elif company == 'yellow' and year <= 2014:
+        return ['CRD', 'CSH', 'CSH', 'NOC', 'DIS', 'UNK']
+    return ['1', '2', '2', '3', '4', '5']
+
+
+def _points_in_zones(rng: np.random.Generator, zone_index: ZoneRasterIndex, rows: int):
+    """Random points in raster cells inside a single zone, cells on zone edges and outside cells
+    in boundary_share and outside_share proportions."""
+
+    ny, nx = zone_index.grid.shape
+    grid = zone_index.grid.ravel()
+    cell_kinds = [np.flatnonzero(grid >= 0), np.flatnonzero(grid == BOUNDARY), np.flatnonzero(grid == OUTSIDE)]
+    kinds = rng.choice(len(cell_kinds), rows, p=[1 - boundary_share - outside_share, boundary_share, outside_share])
+    cells = np.empty(rows, dtype=np.intp)
+    for kind, kind_cells in enumerate(cell_kinds):
+        selected = kinds == kind
+        cells[selected] = rng.choice(kind_cells, selected.sum())
+    rows_in_grid, columns_in_grid = np.divmod(cells, nx)
+    x = zone_index.x0 + (columns_in_grid + rng.random(rows)) * zone_index.cell_size
+    y = zone_index.y0 + (rows_in_grid + rng.random(rows)) * zone_index.cell_size
+    return x, y
+
+
+def location_mix(filepath: str) -> Optional[Dict[str, float]]:
+    """Shares of pickup and dropoff points of the file (zero coordinates left out) in raster cells inside
+    a single zone, in boundary cells and outside every zone. None for files with location ids."""
+
+    company, params = get_taxi_params(os.path.basename(filepath).split('.')[0])
+    if params['location'] != 'coordinates':
+        return None
+    data_frame = pd.read_csv(filepath, **params['csv_params']).rename(columns=column_mapping_function)
+    zone_index = ZoneRasterIndex.load(zone_index_path)
+    codes = np.concatenate([
+        zone_index.lookup(data_frame[f'{prefix}_longitude'].values, data_frame[f'{prefix}_latitude'].values)
+        [(data_frame[f'{prefix}_longitude'] != 0).values]
+        for prefix in ('pickup', 'dropoff')])
+    return {'zone': float(np.mean(codes >= 0)), 'boundary': float(np.mean(codes == BOUNDARY)),
+            'outside': float(np.mean(codes == OUTSIDE))}
+
+
+def _invalid(rng: np.random.Generator, rows: int) -> np.ndarray:
+    return rng.random(rows) < invalid_share
+
+
+def _with_invalid(rng: np.random.Generator, values, invalid_values) -> pd.Series:
+    values = pd.Series(values)
+    broken = np.flatnonzero(_invalid(rng, len(values)))
+    invalid_values = pd.Series(invalid_values, dtype=values.dtype)
+    values.iloc[broken] = invalid_values.iloc[rng.integers(0, len(invalid_values), len(broken))].values
+    return values
+
+
+def _format_timestamps(timestamps: np.ndarray) -> np.ndarray:
+    return np.char.replace(np.datetime_as_string(timestamps, unit='s'), 'T', ' ')
+
+
+if __name__ == '__main__':
+    # generates file for every era in the current folder
+    for path in generate_taxi_files(os.getcwd(), rows=100000):
+        print(path)
@@ -0,0 +1,75 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+# TLC files write every timestamp as YYYY-MM-DD HH:MM:SS
+fixed_format_length = 19
+_separators = {4: ord('-'), 7: ord('-'), 10: ord(' '), 13: ord(':'), 16: ord(':')}
+_digit_positions = [i for i in range(fixed_format_length) if i not in _separators]
+_days_in_month = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+# years whose every second fits in datetime64[ns], others are left to pandas (that makes them NaT)
+_min_year, _max_year = pd.Timestamp.min.year + 1, pd.Timestamp.max.year - 1
+_nat = np.iinfo(np.int64).min
+
+
+def parse_timestamps(values: Union[pd.Series, np.ndarray]) -> pd.Series:
+    """Parses strings in YYYY-MM-DD HH:MM:SS format to datetime64[ns] with numpy arithmetic on their characters.
+    Values can be str or bytes (eg. read by pd.read_csv with dtype='S64', it doesn't create str objects then).
+
+    Missing values (NaN, None or empty) become NaT. Values in any other format (or not valid dates like 2014-02-30) are parsed
+    one by one with pd.to_datetime, the ones it can't parse become NaT too (pd.read_csv would leave
+    the whole column as strings then), so they're rejected by the invalid_timestamps rule.
+    """
+
+    values = pd.Series(values, dtype=object, copy=False)
+    try:
+        # one byte more than the format has, so longer values can be told apart, NaN becomes b'nan'
+        characters = values.to_numpy().astype(f'S{fixed_format_length + 1}').view(np.uint8) \
+            .reshape(len(values), fixed_format_length + 1)
+    except UnicodeEncodeError:
+        return _slow_parse(values)
+    # every character position as contiguous row
+    characters = np.ascontiguousarray(characters.T)
+
+    missing = (characters[0] == 0) | ((characters[0] == ord('n')) & (characters[1] == ord('a'))
+                                      & (characters[2] == ord('n')) & (characters[3] == 0))
+    fixed = (characters[fixed_format_length - 1] != 0) & (characters[fixed_format_length] == 0)
+    for position, separator in _separators.items():
+        fixed &= characters[position] == separator
+    digits = characters[_digit_positions] - ord('0')  # characters other than digits wrap around to over 9
+    fixed &= (digits <= 9).all(axis=0)
+    digits = digits.astype(np.int32)
+    year = digits[0] * 1000 + digits[1] * 100 + digits[2] * 10 + digits[3]
+    month, day, hour, minute, second = (digits[i] * 10 + digits[i + 1] for i in range(4, 14, 2))
+    fixed &= ((year >= _min_year) & (year <= _max_year) & (month >= 1) & (month <= 12) & (day >= 1)
+              & (day <= _month_length(year, month)) & (hour < 24) & (minute < 60) & (second < 60))
+
+    seconds = (_days_since_epoch(year, month, day).astype(np.int64) * 86400
+               + (hour * 3600 + minute * 60 + second))
+    result = np.where(fixed, seconds * 1000000000, _nat)
+    slow = ~fixed & ~missing
+    if slow.any():
+        result[slow] = _slow_parse(values[slow]).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    return pd.Series(result.view('datetime64[ns]'), index=values.index, name=values.name)
+
+
+def _slow_parse(values: pd.Series) -> pd.Series:
+    values = values.map(lambda value: value.decode('utf-8', 'replace') if isinstance(value, bytes) else value)
+    return pd.to_datetime(values, errors='coerce')
+
+
+def _month_length(year: np.ndarray, month: np.ndarray) -> np.ndarray:
+    is_leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return _days_in_month[np.clip(month, 1, 12) - 1] + (is_leap & (month == 2))
+
+
+def _days_since_epoch(year: np.ndarray, month: np.ndarray, day: np.ndarray) -> np.ndarray:
+    """Days from 1970-01-01 of dates in proleptic Gregorian calendar (H. Hinnant's days_from_civil)."""
+
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
@@ -0,0 +1,194 @@
+import io
+import json
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Any, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from compact_schema import timestamp_options
+from helper_objects import atomic_output
+
+# name starts with underscore so Athena and Spark ignore it
+writer_profile_file_name = '_writer_profile.json'
+
+# codec and level pairs tried for every column
+candidate_codecs: List[Tuple[str, Optional[int]]] = [
+    ('snappy', None),
+    ('zstd', 1),
+    ('zstd', 3),
+    ('zstd', 9),
+    ('gzip', None),
+]
+# encodings tried for every column besides dictionary, the ones that don't apply to the column's type are skipped
+# (writer refuses them), timestamps are written as INT96 with flavor='spark' so only PLAIN works for them
+# (apart from second timestamps of compact_arrow_schema that are INT64), dictionary typed columns
+# of compact_arrow_schema always keep dictionary encoding (pyarrow can't read them back with the other ones)
+candidate_encodings = ['PLAIN', 'DELTA_BINARY_PACKED', 'BYTE_STREAM_SPLIT', 'DELTA_LENGTH_BYTE_ARRAY',
+                       'DELTA_BYTE_ARRAY']
+
+
+class ColumnSettings(NamedTuple):
+    """How a column is compressed and encoded in Parquet files."""
+
+    compression: str = 'snappy'
+    compression_level: Optional[int] = None
+    encoding: str = 'dictionary'  # dictionary or name of Parquet encoding used without dictionary
+
+
+class WriterProfile:
+    """Per column Parquet writer settings, columns that aren't in the profile get defaults (snappy, dictionary).
+    Compact tells whether it was tuned on columns of compact_arrow_schema or of the default schema."""
+
+    def __init__(self, columns: Dict[str, ColumnSettings], compact: bool = False):
+        self.columns = columns
+        self.compact = compact
+
+    def writer_options(self, schema: pa.Schema) -> Dict[str, Any]:
+        """Keyword arguments for pq.ParquetWriter and pq.write_table for files with the given schema."""
+
+        settings = {name: self.columns.get(name, ColumnSettings()) for name in schema.names}
+        for field in schema:
+            if pa.types.is_dictionary(field.type) and settings[field.name].encoding != 'dictionary':
+                settings[field.name] = settings[field.name]._replace(encoding='dictionary')
+        options = {
+            'compression': {name: column.compression for name, column in settings.items()},
+            'use_dictionary': [name for name, column in settings.items() if column.encoding == 'dictionary'],
+            'column_encoding': {name: column.encoding for name, column in settings.items()
+                                if column.encoding != 'dictionary'} or None,
+        }
+        levels = {name: column.compression_level for name, column in settings.items()
+                  if column.compression_level is not None}
+        if levels:
+            options['compression_level'] = levels
+        return options
+
+    def save(self, filepath: str) -> None:
+        with atomic_output(filepath) as temp_path, open(temp_path, 'w') as f:
+            json.dump({'compact': self.compact,
+                       'columns': {name: column._asdict() for name, column in self.columns.items()}}, f, indent=2)
+
+    @classmethod
+    def load(cls, filepath: str) -> 'WriterProfile':
+        with open(filepath) as f:
+            data = json.load(f)
+        # profiles saved before compact schema existed were tuned on the default schema
+        return cls({name: ColumnSettings(**column) for name, column in data['columns'].items()},
+                   data.get('compact', False))
+
+    @classmethod
+    def for_output_folder(cls, output_folder: str, compact: Optional[bool] = None) -> Optional['WriterProfile']:
+        """Profile saved in the output folder by tune_writer_profile (None if there's none).
+        If compact is given, raises ValueError when the profile was tuned on the other schema."""
+
+        filepath = os.path.join(output_folder, writer_profile_file_name)
+        if not os.path.exists(filepath):
+            return None
+        profile = cls.load(filepath)
+        if compact is not None and profile.compact != compact:
+            raise ValueError(f'writer profile {filepath} was tuned with compact={profile.compact}, '
+                             f'files are written with compact={compact}, tune it again')
+        return profile
+
+
+def writer_options(profile: Optional[WriterProfile], schema: pa.Schema) -> Dict[str, Any]:
+    return {} if profile is None else profile.writer_options(schema)
+
+
+def parquet_options(profile: Optional[WriterProfile], schema: pa.Schema) -> Dict[str, Any]:
+    """Keyword arguments for pq.ParquetWriter: settings of the profile (if any) and timestamp options."""
+
+    return {**writer_options(profile, schema), **timestamp_options(schema)}
+
+
+class CandidateResult(NamedTuple):
+    column: str
+    settings: ColumnSettings
+    size: int  # bytes
+    write_seconds: float
+    read_seconds: float
+    error: Optional[str] = None  # why files written with the settings can't be read back (candidate is discarded)
+
+
+def tune_columns(table: pa.Table, max_write_slowdown: float = 3.0, max_read_slowdown: float = 1.5,
+                 repeat: int = 3, compact: bool = False) -> Tuple[WriterProfile, List[CandidateResult]]:
+    """Writes every column of the table on its own with every codec and encoding candidate and picks the settings
+    that give the smallest column among those that aren't slower to write than max_write_slowdown times
+    and slower to read than max_read_slowdown times the default (snappy, dictionary).
+    Dictionary typed columns are only tried with dictionary encoding. Compact is stored in the profile
+    (whether the table has compact_arrow_schema).
+    Candidates whose files can't be read back are discarded (their results hold the error).
+    Returns chosen profile and results of all candidates (times are the best of repeat runs)."""
+
+    chosen = {}
+    results = []
+    for field in table.schema:
+        name = field.name
+        # without pandas metadata, it's bigger than some of the columns
+        column_table = table.select([name]).replace_schema_metadata(None)
+        column_results = []
+        encodings = [] if pa.types.is_dictionary(field.type) else candidate_encodings
+        for encoding in ['dictionary'] + encodings:
+            for compression, compression_level in candidate_codecs:
+                settings = ColumnSettings(compression, compression_level, encoding)
+                result = _measure_candidate(column_table, name, settings, repeat)
+                if result is not None:
+                    column_results.append(result)
+        default = next(result for result in column_results if result.settings == ColumnSettings())
+        acceptable = [result for result in column_results if result.error is None
+                      and result.write_seconds <= default.write_seconds * max_write_slowdown
+                      and result.read_seconds <= default.read_seconds * max_read_slowdown]
+        chosen[name] = min(acceptable, key=lambda result: (result.size, result.read_seconds)).settings
+        results += column_results
+    return WriterProfile(chosen, compact), results
+
+
+def _measure_candidate(table: pa.Table, name: str, settings: ColumnSettings,
+                       repeat: int) -> Optional[CandidateResult]:
+    options = {**WriterProfile({name: settings}).writer_options(table.schema), **timestamp_options(table.schema)}
+    write_seconds = read_seconds = float('inf')
+    size = 0
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        try:
+            pq.write_table(table, buffer, flavor='spark', **options)
+        except (pa.ArrowException, ValueError, OSError):
+            return None  # encoding doesn't apply to the type of the column
+        write_seconds = min(write_seconds, time.perf_counter() - start)
+        size = buffer.tell()
+        buffer.seek(0)
+        start = time.perf_counter()
+        try:
+            pq.read_table(buffer)
+        except (pa.ArrowException, ValueError, OSError) as e:
+            # writer accepts some encodings that reader doesn't support for the type
+            return CandidateResult(name, settings, size, write_seconds, float('inf'), f'{type(e).__name__}: {e}')
+        read_seconds = min(read_seconds, time.perf_counter() - start)
+    return CandidateResult(name, settings, size, write_seconds, read_seconds)
+
+
+def format_report(profile: WriterProfile, results: List[CandidateResult]) -> str:
+    """Table with size, write and read time of every candidate (chosen ones marked with *, discarded ones
+    with the error) and totals of the default and chosen settings."""
+
+    lines = [f'{"column":<24}{"compression":<12}{"level":>6}  {"encoding":<24}{"bytes":>14}{"write s":>10}{"read s":>10}']
+    totals = {'default': [0, 0.0, 0.0], 'chosen': [0, 0.0, 0.0]}
+    for result in results:
+        settings = result.settings
+        is_chosen = profile.columns.get(result.column) == settings
+        line = f'{result.column:<24}{settings.compression:<12}{settings.compression_level or "":>6}  {settings.encoding:<24}'
+        if result.error is not None:
+            lines.append(f'{line}  discarded, reading fails with {result.error}')
+            continue
+        lines.append(f'{line}{result.size:>14_d}{result.write_seconds:>10.4f}'
+                     f'{result.read_seconds:>10.4f}{" *" if is_chosen else ""}')
+        for kind, included in (('default', settings == ColumnSettings()), ('chosen', is_chosen)):
+            if included:
+                totals[kind][0] += result.size
+                totals[kind][1] += result.write_seconds
+                totals[kind][2] += result.read_seconds
+    for kind, (size, write_seconds, read_seconds) in totals.items():
+        lines.append(f'{"total " + kind:<68}{size:>14_d}{write_seconds:>10.4f}{read_seconds:>10.4f}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,198 @@
+import hashlib
+import logging
+import os
+from typing import Tuple, Iterable
+
+import numpy as np
+
+from helper_objects import lookup_folder_path, lookup_shp_path, timer
+
+zone_index_path = os.path.join(lookup_folder_path, 'taxi_zones_raster.npz')
+default_cell_size = 0.00025  # degrees, roughly 20 x 30 meters in NYC
+
+OUTSIDE = -1  # cell doesn't touch any zone
+BOUNDARY = -2  # cell is crossed by (or is close to) edge of some zone, or lies where zones overlap
+
+
+class ZoneRasterIndex:
+    """Grid over the extent of taxi zones where every cell holds position (row number in zones GeoDataFrame)
+    of the only zone that fully contains it, OUTSIDE or BOUNDARY.
+
+    Points in zone or outside cells are resolved with array arithmetic only,
+    points in boundary cells need exact point in polygon test.
+    """
+
+    def __init__(self, grid: np.ndarray, x0: float, y0: float, cell_size: float, fingerprint: str):
+        self.grid = grid
+        self.x0 = x0
+        self.y0 = y0
+        self.cell_size = cell_size
+        self.fingerprint = fingerprint
+
+    @classmethod
+    @timer(logging.INFO)
+    def build(cls, zones_gdf, fingerprint: str, cell_size: float = default_cell_size) -> 'ZoneRasterIndex':
+        """Rasterize zones from GeoDataFrame (in EPSG:4326)."""
+
+        minx, miny, maxx, maxy = zones_gdf.total_bounds
+        # one empty cell of margin on each side
+        x0 = minx - cell_size
+        y0 = miny - cell_size
+        nx = int(np.ceil((maxx - x0) / cell_size)) + 1
+        ny = int(np.ceil((maxy - y0) / cell_size)) + 1
+
+        boundary = np.zeros((ny, nx), dtype=bool)
+        zones_count = np.zeros((ny, nx), dtype=np.int16)
+        grid = np.full((ny, nx), OUTSIDE, dtype=np.int16)
+        for position, geometry in enumerate(zones_gdf.geometry):
+            rings = list(_rings(geometry))
+            for ring in rings:
+                _mark_ring_cells(boundary, ring, x0, y0, cell_size)
+            inside = _cell_centers_inside(rings, x0, y0, cell_size, nx, ny)
+            zones_count += inside
+            grid[inside] = position
+        # edges of zones are densified with step smaller than cell so the line may pass through a cell between
+        # two sampled points only if they landed in its neighbours, including them makes sure that any cell
+        # that isn't marked as boundary has no edge closer than 3/4 of the cell size
+        boundary = _dilate(boundary)
+        grid[boundary | (zones_count > 1)] = BOUNDARY
+
+        return cls(grid, x0, y0, cell_size, fingerprint)
+
+    @classmethod
+    def load(cls, path: str = zone_index_path) -> 'ZoneRasterIndex':
+        with np.load(path) as data:
+            x0, y0, cell_size = data['parameters']
+            return cls(data['grid'], float(x0), float(y0), float(cell_size), str(data['fingerprint']))
+
+    def save(self, path: str = zone_index_path) -> None:
+        np.savez_compressed(
+            path,
+            grid=self.grid,
+            parameters=np.array([self.x0, self.y0, self.cell_size]),
+            fingerprint=np.array(self.fingerprint))
+
+    def lookup(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Returns zone position, OUTSIDE or BOUNDARY for every point."""
+
+        ny, nx = self.grid.shape
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            column = np.floor((x - self.x0) / self.cell_size)
+            row = np.floor((y - self.y0) / self.cell_size)
+            in_grid = (column >= 0) & (column < nx) & (row >= 0) & (row < ny)  # false for NaNs too
+        codes = np.full(len(x), OUTSIDE, dtype=np.int16)
+        codes[in_grid] = self.grid[row[in_grid].astype(np.intp), column[in_grid].astype(np.intp)]
+        return codes
+
+
+def shapefile_fingerprint(cell_size: float = default_cell_size) -> str:
+    """Hash of shapefile contents (and cell size) that index was built from."""
+
+    sha = hashlib.sha1()
+    base_path = os.path.splitext(lookup_shp_path)[0]
+    for extension in ('.shp', '.shx', '.dbf', '.prj'):
+        with open(base_path + extension, 'rb') as f:
+            sha.update(f.read())
+    sha.update(repr(cell_size).encode())
+    return sha.hexdigest()
+
+
+def locate_points(zones_gdf, zone_index: ZoneRasterIndex, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds zones that contain the points (same semantics as geopandas.sjoin with predicate='within' and how='left').
+
+    Returns two arrays of the same length: positions of the points and positions of matching zones (-1 if none).
+    Every point appears at least once, points that lie in more than one zone appear multiple times.
+    """
+
+    import geopandas as gpd
+
+    codes = zone_index.lookup(x, y)
+    on_boundary = np.flatnonzero(codes == BOUNDARY)
+    if len(on_boundary) == 0:
+        return np.arange(len(codes)), codes.astype(np.intp)
+
+    # exact test only for points close to edges
+    boundary_points = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(x=np.asarray(x)[on_boundary], y=np.asarray(y)[on_boundary]),
+        index=on_boundary,
+        crs=zones_gdf.crs)
+    matches = gpd.sjoin(left_df=boundary_points, right_df=zones_gdf, how='inner', predicate='within')
+    unmatched = on_boundary[~np.isin(on_boundary, matches.index.values)]
+    resolved = np.flatnonzero(codes != BOUNDARY)
+
+    points = np.concatenate([resolved, matches.index.values, unmatched])
+    zones = np.concatenate([codes[resolved], matches['index_right'].values, np.full(len(unmatched), OUTSIDE)])
+    order = np.argsort(points, kind='mergesort')
+    return points[order], zones[order].astype(np.intp)
+
+
+def _rings(geometry) -> Iterable[np.ndarray]:
+    polygons = geometry.geoms if geometry.geom_type == 'MultiPolygon' else [geometry]
+    for polygon in polygons:
+        yield np.asarray(polygon.exterior.coords)[:, :2]
+        for interior in polygon.interiors:
+            yield np.asarray(interior.coords)[:, :2]
+
+
+def _mark_ring_cells(boundary: np.ndarray, ring: np.ndarray, x0: float, y0: float, cell_size: float) -> None:
+    step = cell_size / 4
+    start, end = ring[:-1], ring[1:]
+    lengths = np.hypot(*(end - start).T)
+    samples = np.ceil(lengths / step).astype(np.intp) + 1
+    segment = np.repeat(np.arange(len(start)), samples)
+    offsets = np.arange(samples.sum()) - np.repeat(np.cumsum(samples) - samples, samples)
+    fraction = (offsets / np.repeat(np.maximum(samples - 1, 1), samples))[:, None]
+    points = start[segment] + (end[segment] - start[segment]) * fraction
+    columns = np.floor((points[:, 0] - x0) / cell_size).astype(np.intp)
+    rows = np.floor((points[:, 1] - y0) / cell_size).astype(np.intp)
+    boundary[rows, columns] = True
+
+
+def _cell_centers_inside(rings, x0: float, y0: float, cell_size: float, nx: int, ny: int) -> np.ndarray:
+    """Even-odd scanline fill of cell centers (rings of one polygon or multipolygon)."""
+
+    crossing_rows = []
+    crossing_xs = []
+    for ring in rings:
+        (xa, ya), (xb, yb) = ring[:-1].T, ring[1:].T
+        # rows whose center line y is in [min(ya, yb), max(ya, yb)) for every edge
+        low = np.ceil((np.minimum(ya, yb) - y0) / cell_size - 0.5).astype(np.intp)
+        high = np.ceil((np.maximum(ya, yb) - y0) / cell_size - 0.5).astype(np.intp)
+        count = high - low
+        edge = np.repeat(np.arange(len(xa)), count)
+        rows = np.repeat(low, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        yc = y0 + (rows + 0.5) * cell_size
+        xc = xa[edge] + (yc - ya[edge]) * (xb[edge] - xa[edge]) / (yb[edge] - ya[edge])
+        crossing_rows.append(rows)
+        crossing_xs.append(xc)
+
+    rows = np.concatenate(crossing_rows)
+    xs = np.concatenate(crossing_xs)
+    order = np.lexsort((xs, rows))
+    rows, xs = rows[order], xs[order]
+    # crossings come in pairs on every row (enter, leave), cells between them are inside
+    starts = np.ceil((xs[0::2] - x0) / cell_size - 0.5).astype(np.intp)
+    ends = np.ceil((xs[1::2] - x0) / cell_size - 0.5).astype(np.intp)
+    changes = np.zeros((ny, nx + 1), dtype=np.int16)
+    np.add.at(changes, (rows[0::2], starts), 1)
+    np.add.at(changes, (rows[0::2], ends), -1)
+    return np.cumsum(changes, axis=1)[:, :nx] > 0
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    result = mask.copy()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            result[max(dy, 0):mask.shape[0] + min(dy, 0), max(dx, 0):mask.shape[1] + min(dx, 0)] |= \
+                mask[max(-dy, 0):mask.shape[0] + min(-dy, 0), max(-dx, 0):mask.shape[1] + min(-dx, 0)]
+    return result
+
+
+if __name__ == '__main__':
+    # rebuilds index shipped in lookup folder, run it after changing the shapefile
+    from zone_registry import get_zone_registry
+
+    logging.getLogger().setLevel(logging.INFO)
+    ZoneRasterIndex.build(get_zone_registry().zones_gdf, shapefile_fingerprint()).save()
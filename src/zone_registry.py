@@ -0,0 +1,152 @@
+import logging
+import os
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from helper_objects import lookup_csv_path, lookup_shp_path, lookup_folder_path, timer
+from zone_index import ZoneRasterIndex, shapefile_fingerprint, zone_index_path
+
+FingerprintType = Tuple[Tuple[str, int, int], ...]
+
+
+class ZoneRegistry:
+    """Taxi zones lookup data loaded once and shared by every chunk and file processed in the current process.
+
+    Geometries are loaded (and reprojected) lazily, files using location ids never need them.
+    """
+
+    def __init__(self, fingerprint: FingerprintType):
+        self.fingerprint = fingerprint
+        self._zones_lookup_df = None
+        self._zones_gdf = None
+        self._zone_index = None
+        self._zone_attributes = None
+
+    @property
+    def zones_lookup_df(self) -> pd.DataFrame:
+        """DataFrame with borough and zone names indexed by LocationID."""
+
+        if self._zones_lookup_df is None:
+            self._zones_lookup_df = _read_zones_lookup_csv()
+        return self._zones_lookup_df
+
+    @property
+    def zone_attributes(self) -> 'ZoneAttributes':
+        """Arrays for translating LocationID to borough and zone names."""
+
+        if self._zone_attributes is None:
+            self._zone_attributes = ZoneAttributes(self.zones_lookup_df)
+        return self._zone_attributes
+
+    @property
+    def zones_gdf(self):
+        """GeoDataFrame with zone geometries in EPSG:4326 and spatial index already built."""
+
+        if self._zones_gdf is None:
+            self._zones_gdf = _read_zones_shapefile()
+        return self._zones_gdf
+
+    @property
+    def zone_index(self) -> ZoneRasterIndex:
+        """Raster index used to find zones of points without spatial join."""
+
+        if self._zone_index is None:
+            self._zone_index = _load_zone_index(self.zones_gdf)
+        return self._zone_index
+
+    def load(self, join_by: str) -> 'ZoneRegistry':
+        """Loads now everything that joining by join_by ('id' or 'coordinates') needs instead of on the first use
+        (eg. so the one-time load isn't measured as memory used by the first chunk)."""
+
+        self.zone_attributes
+        if join_by == 'coordinates':
+            self.zone_index  # loads zones_gdf too
+        return self
+
+
+class ZoneAttributes:
+    """Dense arrays indexed by LocationID holding codes of borough and zone names as categoricals.
+
+    Names for any ids are computed by a single take on the arrays, ids outside of the lookup give nulls.
+    """
+
+    def __init__(self, zones_lookup_df: pd.DataFrame):
+        self.size = int(zones_lookup_df.index.max()) + 1
+        self.borough_categories, self.borough_codes = self._dense_codes(zones_lookup_df['Borough'])
+        self.zone_categories, self.zone_codes = self._dense_codes(zones_lookup_df['Zone'])
+
+    def _dense_codes(self, names: pd.Series) -> Tuple[pd.Index, np.ndarray]:
+        codes, categories = pd.factorize(names, sort=True)
+        dense_codes = np.full(self.size, -1, dtype=np.int16)
+        dense_codes[names.index.values] = codes
+        return categories, dense_codes
+
+    def boroughs(self, location_ids: Union[pd.Series, np.ndarray]) -> pd.Categorical:
+        return pd.Categorical.from_codes(self._take(self.borough_codes, location_ids), self.borough_categories)
+
+    def zones(self, location_ids: Union[pd.Series, np.ndarray]) -> pd.Categorical:
+        return pd.Categorical.from_codes(self._take(self.zone_codes, location_ids), self.zone_categories)
+
+    def _take(self, dense_codes: np.ndarray, location_ids: Union[pd.Series, np.ndarray]) -> np.ndarray:
+        location_ids = np.asarray(location_ids, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            known = (location_ids >= 0) & (location_ids < self.size)  # false for NaNs too
+        codes = np.full(len(location_ids), -1, dtype=np.int16)
+        codes[known] = dense_codes[location_ids[known].astype(np.intp)]
+        return codes
+
+
+_registry: Optional[ZoneRegistry] = None
+
+
+def get_zone_registry() -> ZoneRegistry:
+    """Returns registry for the current process, it's recreated if any file in lookup folder changed."""
+
+    global _registry
+    fingerprint = lookup_fingerprint()
+    if _registry is None or _registry.fingerprint != fingerprint:
+        if _registry is not None:
+            logging.info('Lookup files changed, reloading taxi zones.')
+        _registry = ZoneRegistry(fingerprint)
+    return _registry
+
+
+def lookup_fingerprint() -> FingerprintType:
+    """Name, size and modification time of every file in lookup folder."""
+
+    fingerprint = []
+    for entry in sorted(os.scandir(lookup_folder_path), key=lambda e: e.name):
+        if entry.is_file():
+            stat = entry.stat()
+            fingerprint.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+@timer(logging.DEBUG)
+def _read_zones_lookup_csv() -> pd.DataFrame:
+    return pd.read_csv(lookup_csv_path, index_col='LocationID', usecols=['LocationID', 'Borough', 'Zone'])
+
+
+@timer(logging.DEBUG)
+def _read_zones_shapefile():
+    import geopandas as gpd
+
+    # pyogrio explicitly, geopandas would pick fiona when it's installed and fiona 1.10 breaks it
+    gdf = gpd.read_file(lookup_shp_path, engine='pyogrio')
+    gdf.drop(columns=['OBJECTID', 'Shape_Leng', 'Shape_Area'], inplace=True)
+    gdf.to_crs('EPSG:4326', inplace=True)  # reproject to common Coordinate Reference System
+    gdf.sindex  # build spatial index now so every spatial join can reuse it
+    return gdf
+
+
+def _load_zone_index(zones_gdf) -> ZoneRasterIndex:
+    fingerprint = shapefile_fingerprint()
+    if os.path.exists(zone_index_path):
+        zone_index = ZoneRasterIndex.load(zone_index_path)
+        if zone_index.fingerprint == fingerprint:
+            return zone_index
+    logging.warning(f'Zone index {zone_index_path!r} is missing or out of date, building it in memory. '
+                    f'Run zone_index.py to rebuild the file.')
+    return ZoneRasterIndex.build(zones_gdf, fingerprint)
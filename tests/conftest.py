@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# scripts in src import each other as top level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from synthetic_data import generate_taxi_file  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def green_csv(tmp_path_factory) -> str:
+    """Small synthetic green taxi file with location ids (no spatial join needed)."""
+
+    return generate_taxi_file(str(tmp_path_factory.mktemp('csv')), 'green:zzz_generic_schema', rows=2000)
@@ -0,0 +1,14 @@
+import decimal
+
+import pyarrow as pa
+
+from compact_schema import to_compact_table, money_type
+
+
+def test_amounts_over_ten_million_dollars():
+    table = pa.table({'fare_amount': [12.5, 12345678.9, 99999999999.99, 1e20, float('inf'), None]})
+
+    fares = to_compact_table(table).column('fare_amount')
+    assert fares.type == money_type
+    assert fares.to_pylist() == [decimal.Decimal('12.50'), decimal.Decimal('12345678.90'),
+                                 decimal.Decimal('99999999999.99'), None, None, None]
@@ -0,0 +1,50 @@
+import glob
+import os
+
+import pyarrow.parquet as pq
+import pytest
+
+from compaction import compact_output_folder
+from data_export import csv2parquet
+from synthetic_data import generate_taxi_file
+
+_eras = ['yellow:yellow_tripdata_2018-12', 'yellow:yellow_tripdata_2019-12', 'yellow:zzz_generic_schema']
+
+
+@pytest.fixture(scope='module')
+def yellow_csvs(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp('csv'))
+    return [generate_taxi_file(folder, era, rows=3000) for era in _eras]
+
+
+def _parquet_files(folder: str):
+    return sorted(glob.glob(os.path.join(folder, '*.parquet')))
+
+
+def _total_rows(folder: str) -> int:
+    return sum(pq.ParquetFile(file_path).metadata.num_rows for file_path in _parquet_files(folder))
+
+
+@pytest.mark.parametrize('split', [True, False], ids=['split', 'merged'])
+def test_converting_compacted_source_again_keeps_rows_once(yellow_csvs, tmp_path, split):
+    output_folder = str(tmp_path)
+    csv2parquet(yellow_csvs, output_folder)
+    rows = _total_rows(output_folder)
+    sizes = [os.path.getsize(file_path) for file_path in _parquet_files(output_folder)]
+    if split:
+        # every file is over max size, each one is split into a few
+        target_file_size, max_file_size = min(sizes) // 3, min(sizes) // 2
+    else:
+        target_file_size, max_file_size = 2 * sum(sizes), 4 * sum(sizes)
+
+    compact_output_folder(output_folder, target_file_size, max_file_size, row_group_size=500)
+    assert _total_rows(output_folder) == rows
+    assert len(_parquet_files(output_folder)) == (len(sizes) * 3 if split else 1)
+
+    csv2parquet([yellow_csvs[1]], output_folder, force=True)
+    assert _total_rows(output_folder) == rows
+    # nothing is converted or removed when everything is up to date
+    files = _parquet_files(output_folder)
+    csv2parquet(yellow_csvs, output_folder)
+    assert _parquet_files(output_folder) == files
+    assert _total_rows(output_folder) == rows
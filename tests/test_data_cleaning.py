@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_cleaning import _civil_date, _epoch_days, map_distinct_values, store_and_fwd_flag_mapping_function, \
+    payment_type_mapping_function, trip_type_mapping_function, payment_type_dtype, trip_type_dtype
+
+
+def test_civil_date_matches_pandas():
+    # every day of years around leap years, century years (1900 and 2100 aren't leap years, 2000 is)
+    # and days before 1970, at the first and the last second of every day
+    days = pd.concat([pd.Series(pd.date_range(start, end, freq='D')) for start, end in
+                      [('1899-12-25', '1901-01-05'), ('1969-12-01', '1970-01-31'), ('1999-12-25', '2001-01-05'),
+                       ('2008-01-01', '2024-12-31'), ('2099-12-25', '2101-01-05')]], ignore_index=True)
+    timestamps = pd.concat([days, days + pd.Timedelta(hours=23, minutes=59, seconds=59)], ignore_index=True)
+
+    year, month, day = _civil_date(_epoch_days(timestamps))
+
+    np.testing.assert_array_equal(year, timestamps.dt.year)
+    np.testing.assert_array_equal(month, timestamps.dt.month)
+    np.testing.assert_array_equal(day, timestamps.dt.day)
+    assert ((month == 2) & (day == 29)).sum() == 2 * (1 + 5)  # 2000, 2008, 2012, 2016, 2020, 2024
+
+
+@pytest.mark.parametrize('values, mapping_function, dtype', [
+    (pd.Series(['Y', 'N', 'y', 'n', '1', '0', 'T', 'F', 'x', '', None, np.nan, 1, 0, 7], dtype=object),
+     store_and_fwd_flag_mapping_function, pd.Int16Dtype()),
+    (pd.Series(['CRD', 'csh', 'No', 'DIS', 'UNK', 'Cre', 'Cas', 'NOC', 'voided trip', 'other', None, np.nan],
+               dtype=object), payment_type_mapping_function, payment_type_dtype),
+    (pd.Series([1, 2, 3, 4, 5, 6, 7, 0]), payment_type_mapping_function, payment_type_dtype),
+    (pd.Series([1.0, 2.0, np.nan, 3.0, 0.0, 1.0]), trip_type_mapping_function, trip_type_dtype),
+], ids=['store_and_forward', 'payment_type', 'payment_type_ids', 'trip_type'])
+def test_map_distinct_values_matches_mapping_every_row(values, mapping_function, dtype):
+    # repeated in shuffled order so distinct values are broadcast back to many rows
+    values = pd.concat([values] * 20, ignore_index=True).sample(frac=1, random_state=0).reset_index(drop=True)
+
+    expected = pd.array(values.apply(mapping_function).tolist(), dtype=dtype)
+    result = map_distinct_values(values, mapping_function, dtype)
+
+    pd.testing.assert_extension_array_equal(result, expected)
+    assert result.isna().any()
@@ -0,0 +1,72 @@
+import glob
+import io
+import logging
+import os
+import warnings
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_export import csv2parquet, default_row_group_size
+
+
+def test_partitioned_with_default_sizes(green_csv, tmp_path):
+    csv2parquet([green_csv], str(tmp_path), partitioned=True)
+
+    files = glob.glob(os.path.join(str(tmp_path), 'company=green', 'year=*', 'month=*', '*.parquet'))
+    assert files
+    for file_path in files:
+        metadata = pq.ParquetFile(file_path).metadata
+        assert metadata.num_rows > 0
+        assert all(metadata.row_group(i).num_rows <= default_row_group_size for i in range(metadata.num_row_groups))
+
+
+def test_arrow_engine_writes_tables_the_same_as_pandas_engine(green_csv, tmp_path):
+    from data_processing import process_taxi_data_file_chunks
+
+    assert all(isinstance(chunk, pa.Table) for chunk in process_taxi_data_file_chunks(green_csv, 500, engine='arrow'))
+    tables = {}
+    for engine in ('pandas', 'arrow'):
+        (tmp_path / engine).mkdir()
+        csv2parquet([green_csv], str(tmp_path / engine), streaming=True, chunksize=500, engine=engine)
+        tables[engine] = pq.read_table(str(tmp_path / engine / os.path.basename(green_csv).replace('.csv', '.parquet')))
+
+    assert tables['arrow'].equals(tables['pandas'])
+    assert tables['arrow'].schema.metadata == tables['pandas'].schema.metadata
+
+
+def test_logs_and_warnings_of_worker_go_to_its_buffer(capsys):
+    from data_export import _logging_to
+
+    buffer = io.StringIO()
+    handlers = logging.getLogger().handlers
+    with _logging_to(buffer):
+        logging.warning('rows rejected')
+        warnings.warn('dtype changed')
+
+    assert 'rows rejected' in buffer.getvalue()
+    assert 'dtype changed' in buffer.getvalue()
+    assert capsys.readouterr().err == ''
+    assert logging.getLogger().handlers == handlers
+
+
+def test_changing_an_option_converts_file_again(green_csv, tmp_path):
+    from manifest import RunManifest
+
+    output_path = str(tmp_path / os.path.basename(green_csv).replace('.csv', '.parquet'))
+
+    def pipeline():
+        return RunManifest(str(tmp_path)).entries[os.path.abspath(green_csv)]['pipeline']
+
+    csv2parquet([green_csv], str(tmp_path))
+    pipelines = [pipeline()]
+    modified = os.stat(output_path).st_mtime_ns
+    csv2parquet([green_csv], str(tmp_path))
+    assert os.stat(output_path).st_mtime_ns == modified
+
+    for options in ({'csv_engine': 'arrow'}, {'engine': 'arrow'}, {'compact': True}):
+        csv2parquet([green_csv], str(tmp_path), **options)
+        assert os.stat(output_path).st_mtime_ns != modified
+        modified = os.stat(output_path).st_mtime_ns
+        pipelines.append(pipeline())
+    assert len(set(pipelines)) == len(pipelines)
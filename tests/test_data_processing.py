@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from synthetic_data import generate_taxi_file
+
+probe_rows = 5000
+
+
+def _first_chunk_bytes_per_row(filepath: str, registry_loaded: bool) -> float:
+    """Footprint per row that ChunkSizer measures on the first chunk, in the fresh process it's called in."""
+
+    from data_processing import ChunkSizer, get_taxi_params, process_taxi_data, _csv_chunks
+    from zone_registry import get_zone_registry
+
+    company, params = get_taxi_params(os.path.basename(filepath).split('.')[0])
+    if registry_loaded:
+        get_zone_registry().load(params['location'])
+    sizer = ChunkSizer(1024 * 1024 * 1024, probe_rows, join_by=params['location'])
+    chunk = next(iter(_csv_chunks(filepath, sizer, **params['csv_params'])))
+    sizer.chunk_processed(chunk, process_taxi_data(chunk, params, company))
+    return sizer.bytes_per_row
+
+
+@pytest.fixture(scope='module')
+def coordinates_csv(tmp_path_factory) -> str:
+    return generate_taxi_file(str(tmp_path_factory.mktemp('csv')), 'yellow:yellow_tripdata_2014-12', rows=probe_rows)
+
+
+def test_chunk_sizer_does_not_count_loading_lookup_data(coordinates_csv):
+    # every measurement in its own new process, the registry is loaded once per process
+    bytes_per_row = {}
+    for registry_loaded in (False, True):
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            bytes_per_row[registry_loaded] = executor.submit(_first_chunk_bytes_per_row, coordinates_csv,
+                                                             registry_loaded).result()
+
+    assert bytes_per_row[False] == pytest.approx(bytes_per_row[True], rel=0.5)
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import external_sort
+from data_cleaning import default_sort_keys
+from data_export import csv2parquet
+from external_sort import ExternalSorter
+
+
+def _is_sorted(table: pa.Table, sort_keys) -> bool:
+    # stable sort keeps already sorted table as it is, nulls are last in both
+    return table.select(sort_keys).equals(table.sort_by([(key, 'ascending') for key in sort_keys]).select(sort_keys))
+
+
+def _canonical(table: pa.Table) -> pa.Table:
+    return table.sort_by([(name, 'ascending') for name in table.column_names])
+
+
+def test_runs_are_merged_in_order(monkeypatch):
+    # several batches per run so merging loads them one by one
+    monkeypatch.setattr(external_sort, 'merge_batch_rows', 64)
+    rng = np.random.default_rng(0)
+    rows = 5000
+    keys = rng.integers(0, 50, rows).astype(float)
+    keys[rng.random(rows) < 0.05] = np.nan
+    table = pa.table({'key': pa.array(keys, from_pandas=True), 'second': rng.integers(0, 3, rows),
+                      'row': np.arange(rows)})
+
+    with ExternalSorter(['key', 'second'], run_rows=700) as sorter:
+        for offset in range(0, rows, 300):
+            sorter.add(table.slice(offset, 300))
+        result = pa.concat_tables(sorter.sorted_tables())
+        assert len(sorter.runs) > 1
+
+    assert _is_sorted(result, ['key', 'second'])
+    assert _canonical(result).equals(_canonical(table))
+
+
+def test_global_sort_with_runs_smaller_than_file(green_csv, tmp_path, monkeypatch):
+    spills = []
+    spill = ExternalSorter._spill
+
+    def counting_spill(sorter):
+        spills.append(sorter._buffered_rows)
+        spill(sorter)
+
+    monkeypatch.setattr(ExternalSorter, '_spill', counting_spill)
+
+    tables = {}
+    for global_sort in (False, True):
+        output_folder = tmp_path / str(global_sort)
+        output_folder.mkdir()
+        csv2parquet([green_csv], str(output_folder), global_sort=global_sort, sort_run_rows=300, chunksize=250,
+                    spill_folder=str(tmp_path))
+        tables[global_sort] = pq.read_table(str(output_folder / os.path.basename(green_csv).replace('.csv', '.parquet')))
+
+    assert len(spills) > 1
+    assert all(rows < tables[True].num_rows for rows in spills)
+    assert _is_sorted(tables[True], default_sort_keys)
+    assert _canonical(tables[True]).equals(_canonical(tables[False]))
@@ -0,0 +1,44 @@
+import threading
+import time
+
+import numpy as np
+
+from metrics import FileMetrics, Measurement
+
+
+def test_stages_share_one_sampler_thread():
+    metrics = FileMetrics('file.csv')
+    threads = threading.active_count()
+    for chunk in range(200):
+        with metrics.measure('stage', chunk):
+            pass
+
+    assert threading.active_count() <= threads + 1
+    assert len(metrics.records) == 200
+
+
+def test_peak_memory_of_every_open_measurement():
+    size = 200 * 1024 * 1024
+    with Measurement() as outer:
+        with Measurement() as inner:
+            data = np.ones(size, dtype=np.uint8)
+            time.sleep(0.05)
+            del data
+
+    assert inner.peak_memory_delta >= size // 2
+    assert outer.peak_memory_delta >= size // 2
+
+
+def test_cpu_time_of_other_threads_is_not_counted():
+    def spin():
+        end = time.perf_counter() + 0.3
+        while time.perf_counter() < end:
+            pass
+
+    thread = threading.Thread(target=spin)
+    with Measurement() as measurement:
+        thread.start()
+        thread.join()
+
+    assert measurement.wall_seconds >= 0.3
+    assert measurement.cpu_seconds < 0.1
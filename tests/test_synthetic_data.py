@@ -0,0 +1,17 @@
+import pytest
+
+import synthetic_data
+from synthetic_data import generate_taxi_file, location_mix
+
+
+def test_coordinates_reach_boundary_cells(tmp_path):
+    filepath = generate_taxi_file(str(tmp_path), 'yellow:yellow_tripdata_2014-12', rows=20000)
+
+    mix = location_mix(filepath)
+    assert mix['boundary'] == pytest.approx(synthetic_data.boundary_share, abs=0.02)
+    assert mix['outside'] == pytest.approx(synthetic_data.outside_share, abs=0.005)
+    assert mix['zone'] + mix['boundary'] + mix['outside'] == pytest.approx(1)
+
+
+def test_no_mix_for_location_ids(green_csv):
+    assert location_mix(green_csv) is None
@@ -0,0 +1,67 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from data_export import csv2parquet, tune_writer_profile
+from writer_profile import WriterProfile, ColumnSettings
+
+
+def test_compact_files_with_tuned_profile_can_be_read(green_csv, tmp_path):
+    tables = {}
+    for tuned in (False, True):
+        output_folder = str(tmp_path / str(tuned))
+        os.mkdir(output_folder)
+        if tuned:
+            profile = tune_writer_profile(green_csv, output_folder, sample_rows=1000, compact=True)
+            assert profile.compact
+        csv2parquet([green_csv], output_folder, compact=True)
+        tables[tuned] = pq.read_table(os.path.join(output_folder,
+                                                   os.path.basename(green_csv).replace('.csv', '.parquet')))
+
+    table = tables[True]
+    assert table.equals(tables[False])
+    dictionary_columns = [field.name for field in table.schema if pa.types.is_dictionary(field.type)]
+    assert dictionary_columns
+    assert all(profile.columns[name].encoding == 'dictionary' for name in dictionary_columns)
+
+
+def test_dictionary_columns_keep_dictionary_encoding():
+    schema = pa.schema([('company', pa.dictionary(pa.int8(), pa.string())), ('note', pa.string())])
+    profile = WriterProfile({name: ColumnSettings('zstd', 3, 'DELTA_LENGTH_BYTE_ARRAY') for name in schema.names})
+    options = profile.writer_options(schema)
+
+    assert options['use_dictionary'] == ['company']
+    assert options['column_encoding'] == {'note': 'DELTA_LENGTH_BYTE_ARRAY'}
+
+
+def test_profile_of_other_schema_is_rejected(green_csv, tmp_path):
+    output_folder = str(tmp_path)
+    WriterProfile({}, compact=False).save(os.path.join(output_folder, '_writer_profile.json'))
+
+    with pytest.raises(ValueError):
+        csv2parquet([green_csv], output_folder, compact=True)
+    assert WriterProfile.for_output_folder(output_folder, compact=False) is not None
+
+
+def test_candidates_that_cannot_be_read_back_are_discarded(monkeypatch):
+    from writer_profile import tune_columns, format_report
+
+    read_table = pq.read_table
+
+    def failing_read_table(source, **kwargs):
+        if 'DELTA_BINARY_PACKED' in pq.ParquetFile(source).metadata.row_group(0).column(0).encodings:
+            raise pa.ArrowNotImplementedError('unsupported encoding')
+        source.seek(0)
+        return read_table(source, **kwargs)
+
+    monkeypatch.setattr(pq, 'read_table', failing_read_table)
+    table = pa.table({'trip_distance_milli': pa.array(range(10000), pa.int64())})
+    profile, results = tune_columns(table, max_write_slowdown=float('inf'), max_read_slowdown=float('inf'), repeat=1)
+
+    discarded = [result for result in results if result.error is not None]
+    assert discarded
+    assert all(result.settings.encoding == 'DELTA_BINARY_PACKED' for result in discarded)
+    assert profile.columns['trip_distance_milli'].encoding != 'DELTA_BINARY_PACKED'
+    assert 'discarded, reading fails with ArrowNotImplementedError' in format_report(profile, results)
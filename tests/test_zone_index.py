@@ -0,0 +1,55 @@
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Polygon
+
+from zone_index import ZoneRasterIndex, locate_points, BOUNDARY, OUTSIDE
+
+cell_size = 0.01
+
+
+def _zones() -> gpd.GeoDataFrame:
+    square = Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+    # overlaps right half of the square
+    overlapping = Polygon([(0.5, 0.2), (1.5, 0.2), (1.5, 0.8), (0.5, 0.8)])
+    # has a hole, points in it are outside of every zone
+    with_hole = Polygon([(0, 1.2), (1, 1.2), (1, 2), (0, 2)], [[(0.3, 1.5), (0.7, 1.5), (0.7, 1.7), (0.3, 1.7)]])
+    return gpd.GeoDataFrame({'zone': ['square', 'overlapping', 'with hole']},
+                            geometry=[square, overlapping, with_hole], crs='EPSG:4326')
+
+
+def _points(zones: gpd.GeoDataFrame, rng: np.random.Generator):
+    minx, miny, maxx, maxy = zones.total_bounds
+    # everywhere in and around zones, exactly on edges and corners, far outside and missing coordinates
+    x = [rng.uniform(minx - 0.5, maxx + 0.5, 3000)]
+    y = [rng.uniform(miny - 0.5, maxy + 0.5, 3000)]
+    for geometry in zones.geometry:
+        coords = np.asarray(geometry.exterior.coords)
+        x.append(coords[:, 0])
+        y.append(coords[:, 1])
+        fraction = rng.uniform(0, 1, 100)
+        x.append(coords[0, 0] + (coords[1, 0] - coords[0, 0]) * fraction)
+        y.append(coords[0, 1] + (coords[1, 1] - coords[0, 1]) * fraction)
+    x.append([-40.0, 40.0, np.nan, 0.5])
+    y.append([-40.0, 40.0, 0.5, np.nan])
+    return np.concatenate(x), np.concatenate(y)
+
+
+def test_locate_points_matches_sjoin():
+    zones = _zones()
+    index = ZoneRasterIndex.build(zones, 'test', cell_size)
+    x, y = _points(zones, np.random.default_rng(0))
+
+    codes = index.lookup(x, y)
+    assert (codes == BOUNDARY).any() and (codes == OUTSIDE).any() and (codes >= 0).any()
+
+    points, positions = locate_points(zones, index, x, y)
+    located = sorted(zip(points.tolist(), positions.tolist()))
+
+    point_frame = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs=zones.crs)
+    joined = gpd.sjoin(point_frame, zones, how='left', predicate='within')
+    expected = sorted(zip(joined.index.tolist(), joined['index_right'].fillna(OUTSIDE).astype(int).tolist()))
+
+    assert located == expected
+    # overlapping zones give a row per zone, points in the hole and outside the grid get none
+    assert len(located) > len(x)
+    assert any(position == OUTSIDE for _, position in located)